@@ -0,0 +1,101 @@
+# Cost of evaluating the cloth forces: the stretch forces the way
+# sim.ipynb computes them (per-face .at[].set loops and the full
+# jacfwd of the per-face energies) against the whole-array energies
+# of cloth.energies, and the total internal forces, per grid size.
+#
+#   python -m benchmarks.bench_cloth_forces [--sizes 4 8 16 32 64]
+import argparse
+import time
+import jax
+import jax.numpy as jnp
+from cloth.energies import e_stretch, internal_forces
+from cloth.model import ClothModel
+
+def loop_e_stretch(model, x):
+    r"""
+    Stretch energy of each face, computed face by face as in the
+    notebook.
+    """
+    num_faces = model.num_faces
+    b_u, b_v = model.uv_rest_lengths
+    x = jnp.reshape(x, (model.num_particles, 3))
+    faces = model.faces
+    dx1s = [jnp.zeros((num_faces, 3))]
+    dx2s = [jnp.zeros((num_faces, 3))]
+    for face_index in range(num_faces):
+        dx1s.append(dx1s[face_index].at[face_index].set(
+            x[faces[face_index][1]] - x[faces[face_index][0]]))
+        dx2s.append(dx2s[face_index].at[face_index].set(
+            x[faces[face_index][2]] - x[faces[face_index][0]]))
+    dx1, dx2 = dx1s[-1], dx2s[-1]
+    w_us = [jnp.zeros((num_faces, 3))]
+    w_vs = [jnp.zeros((num_faces, 3))]
+    for face_index in range(num_faces):
+        del_uv = jnp.array([model.del_u[face_index], model.del_v[face_index]])
+        dx = jnp.transpose(jnp.array([dx1[face_index], dx2[face_index]]))
+        deform = jnp.matmul(dx, jnp.linalg.inv(del_uv))
+        w_us.append(w_us[face_index].at[face_index].set(deform[:, 0]))
+        w_vs.append(w_vs[face_index].at[face_index].set(deform[:, 1]))
+    w_u, w_v = w_us[-1], w_vs[-1]
+    E_sts = [jnp.zeros(num_faces)]
+    for face_index in range(num_faces):
+        C_st = model.area[face_index] * jnp.array([jnp.linalg.norm(w_u[face_index]) - b_u,
+                                                   jnp.linalg.norm(w_v[face_index]) - b_v])
+        E_sts.append(E_sts[face_index].at[face_index].set(
+            0.5 * model.k_stretch * jnp.dot(C_st, C_st)))
+    return E_sts[-1]
+
+def loop_f_stretch(model, x):
+    r"""
+    Stretch forces as in the notebook: the (F, 3n) Jacobian of the
+    per-face energies, summed over the faces.
+    """
+    x_flat = jnp.reshape(x, (3*model.num_particles, ))
+    return -jnp.sum(jax.jacfwd(lambda x: loop_e_stretch(model, x))(x_flat), axis=0)
+
+def best_time(function, x, repeats):
+    r"""
+    Best time of one evaluation of function(x), after a warm-up
+    evaluation that also compiles jitted functions.
+    """
+    start = time.perf_counter()
+    jax.block_until_ready(function(x))
+    first = time.perf_counter() - start
+    best = first
+    for _ in range(repeats):
+        start = time.perf_counter()
+        jax.block_until_ready(function(x))
+        best = min(best, time.perf_counter() - start)
+    return first, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of evaluating the cloth forces")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--loop-max-size", type=int, default=8,
+                        help="largest size timed with the notebook loops")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'N':>5} {'faces':>7} {'loop stretch':>13} {'stretch':>10} {'speedup':>9} "
+          f"{'forces':>10} {'compile':>9}")
+    with jax.enable_x64(True):
+        for size in args.sizes:
+            model = ClothModel.rectangle(1.0, 1.0, size, size)
+            x = jnp.asarray(model.rest_positions) + 0.01*jnp.sin(
+                jnp.arange(3*model.num_particles)).reshape(-1, 3)
+            stretch = jax.jit(lambda x: -jax.grad(lambda x: jnp.sum(e_stretch(model, x)))(x))
+            forces = jax.jit(lambda x: internal_forces(model, x))
+            _, t_stretch = best_time(stretch, x, args.repeats)
+            first, t_forces = best_time(forces, x, args.repeats)
+            if size <= args.loop_max_size:
+                # the loops are too slow to repeat
+                t_loop, _ = best_time(lambda x: loop_f_stretch(model, x), x, 0)
+                loop = f"{t_loop:12.3f}s"
+                speedup = f"{t_loop / t_stretch:8.0f}x"
+            else:
+                loop, speedup = f"{'-':>13}", f"{'-':>9}"
+            print(f"{size:5d} {model.num_faces:7d} {loop} {t_stretch*1e3:8.3f}ms {speedup} "
+                  f"{t_forces*1e3:8.3f}ms {first:8.2f}s")
+
+if __name__ == "__main__":
+    main()
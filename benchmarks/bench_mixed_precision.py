@@ -0,0 +1,69 @@
+# Compare float64 MPCG with float32 MPCG + float64 iterative
+# refinement on cloth-like systems of growing resolution.
+#
+#   python -m benchmarks.bench_mixed_precision [--sizes 32 64 128]
+import argparse
+import time
+import numpy as np
+from benchmarks.systems import cloth_system
+from solvers.mixed_precision import MixedPrecisionMPCGSolver
+from solvers.mpcg import MPCGSolver
+
+def relative_residual(solver, A, b, x):
+    r"""
+    Compute ||filter(b - A x)|| / ||filter(b)|| in float64.
+    """
+    b_2d = np.expand_dims(b, axis=1)
+    r = solver.filter(b_2d - A @ x)
+    return np.linalg.norm(r) / np.linalg.norm(solver.filter(b_2d))
+
+def matrix_megabytes(A):
+    r"""
+    Return the memory held by the values and indices of A in MB.
+    """
+    if hasattr(A, "data") and hasattr(A, "indices"):
+        return (A.data.nbytes + A.indices.nbytes + A.indptr.nbytes) / 2**20
+    return A.nbytes / 2**20
+
+def best_of(repeats, run):
+    r"""
+    Run run() repeats times; return the fastest wall time and the
+    last result.
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Float64 MPCG against float32 MPCG with float64 refinement")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--rtol", type=float, default=1e-10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'N':>5} {'dofs':>8} {'mode':>8} {'time [s]':>10} {'iters':>7} "
+          f"{'refine':>7} {'A [MB]':>8} {'rel. residual':>14} {'|x - x64|/|x64|':>16}")
+    for N in args.sizes:
+        A, b, S, z = cloth_system(N, k_stretch=1e4)
+        # float64 reference path
+        solver_64 = MPCGSolver(A, b, S, z, rtol=args.rtol)
+        time_64, x_64 = best_of(args.repeats, solver_64.solve)
+        # float32 iterations + float64 refinement
+        solver_mixed = MixedPrecisionMPCGSolver(A, b, S, z, rtol=args.rtol)
+        time_mixed, x_mixed = best_of(args.repeats, solver_mixed.solve)
+        # the mixed solver stores A in float64 and in float32
+        memory_64 = matrix_megabytes(solver_64.A)
+        memory_mixed = memory_64 + matrix_megabytes(solver_mixed.inner_solver.A)
+        for mode, solve_time, x, iterations, refinements, memory in (
+                ("float64", time_64, x_64, solver_64.num_iterations, 0, memory_64),
+                ("mixed", time_mixed, x_mixed, solver_mixed.stats.num_iterations,
+                 solver_mixed.num_refinements, memory_mixed)):
+            error = np.linalg.norm(x - x_64) / np.linalg.norm(x_64)
+            print(f"{N:>5} {A.shape[0]:>8} {mode:>8} {solve_time:>10.4f} {iterations:>7} "
+                  f"{refinements:>7} {memory:>8.2f} {relative_residual(solver_64, A, b, x):>14.3e} {error:>16.3e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Effect of the particle numbering on products with A and on MPCG:
+# the standard_rectangle numbering, a random numbering (as from an
+# arbitrary mesh file) and the reverse Cuthill-McKee reordering of
+# the random one.
+#
+#   python -m benchmarks.bench_reordering [--size 256]
+import argparse
+import time
+import numpy as np
+import dhutils.dhutils as dhu
+from benchmarks.systems import spring_system
+from solvers.api import LinearSystem, solve
+from solvers.reordering import ParticleOrdering, block_bandwidth
+
+def time_matvecs(A, repeats):
+    r"""
+    Best time of one product of A with a (3n, 1) vector.
+    """
+    v = np.ones((A.shape[0], 1))
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(10):
+            A @ v
+        best = min(best, (time.perf_counter() - start) / 10)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Effect of the particle numbering on products with A and on MPCG")
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--preconditioner", default="jacobi")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    positions, faces = dhu.standard_rectangle(1.0, 1.0, args.size, args.size)
+    num_particles = positions.shape[0]
+    shuffle = ParticleOrdering(np.random.default_rng(0).permutation(num_particles))
+    positions_shuffled = shuffle.permute_particles(positions)
+    faces_shuffled = shuffle.permute_faces(faces)
+    rcm = ParticleOrdering.from_faces(faces_shuffled, num_particles)
+    orderings = {
+        "rectangle": (positions, faces),
+        "random": (positions_shuffled, faces_shuffled),
+        "rcm": (rcm.permute_particles(positions_shuffled), rcm.permute_faces(faces_shuffled)),
+    }
+    print(f"{num_particles} particles")
+    print(f"{'ordering':>9} {'bandwidth':>9} {'matvec [ms]':>11} {'mpcg [s]':>9} {'iters':>6}")
+    for name, (positions_k, faces_k) in orderings.items():
+        A, b, S, z = spring_system(positions_k, faces_k)
+        system = LinearSystem(A, b, S, z)
+        solve_time = np.inf
+        for _ in range(args.repeats):
+            result = solve(system, method="mpcg", rtol=1e-8,
+                           preconditioner=args.preconditioner)
+            solve_time = min(solve_time, result.stats.solve_time)
+        print(f"{name:>9} {block_bandwidth(A):>9} {1e3*time_matvecs(A, args.repeats):>11.3f} "
+              f"{solve_time:>9.4f} {result.num_iterations:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Compare the number of products with A, wall time and accuracy of
+# CGSolver and SDSolver with the true residual recomputed every
+# iteration (residual_replacement=1, the former behaviour) and with
+# the recurrence r = r - alpha*q.
+#
+#   python -m benchmarks.bench_residual_recurrence [--sizes 4 8 16]
+import argparse
+import time
+import numpy as np
+from benchmarks.systems import cloth_system
+from solvers.cg import CGSolver
+from solvers.sd import SDSolver
+
+def main():
+    parser = argparse.ArgumentParser(description="CG and SD with the true residual against the residual recurrence")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--replacements", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--max-iter", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'N':>4} {'dofs':>6} {'solver':>6} {'k':>4} {'iters':>7} {'matvecs':>8} "
+          f"{'time [s]':>10} {'|b - Ax|/|b|':>14}")
+    for N in args.sizes:
+        # CG and SD have no filter: solve with A and b only
+        A, b, _, _ = cloth_system(N)
+        A = A.toarray()
+        for name, solver_class in (("CG", CGSolver), ("SD", SDSolver)):
+            for k in args.replacements:
+                solver = solver_class(A, b, args.max_iter, residual_replacement=k)
+                start = time.perf_counter()
+                xs, _ = solver.solve()
+                solve_time = time.perf_counter() - start
+                residual = np.linalg.norm(b - A @ xs[-1][:, 0]) / np.linalg.norm(b)
+                print(f"{N:>4} {A.shape[0]:>6} {name:>6} {k:>4} {len(xs) - 1:>7} "
+                      f"{solver.num_matvecs:>8} {solve_time:>10.4f} {residual:>14.3e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Scaling benchmark of the linear solvers on cloth systems built
+# from dhutils.standard_rectangle, from N = 4 to N = 256 segments
+# per side. Times SD, CG and MPCG (every preconditioner) with A
+# stored sparse, and dense for small systems; records iterations,
+# wall time, peak memory and matvecs per second as JSON.
+#
+#   python -m benchmarks.bench_scaling run --output results.json
+#   python -m benchmarks.bench_scaling run --sizes 4 16 --baseline baseline.json
+#   python -m benchmarks.bench_scaling compare baseline.json results.json
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from benchmarks.systems import cloth_system
+from solvers.api import LinearSystem, solve
+from solvers.mpcg import constraint_matrices
+from solvers.preconditioners import PRECONDITIONERS
+
+DEFAULT_SIZES = [4, 16, 64, 128, 256]
+# dense A is only benchmarked up to this many unknowns (the N = 16
+# dense A is 867 x 867; N = 64 would need 1.3 GB)
+DENSE_MAX_DOFS = 1000
+# cap on the iterations of every solve; SD needs thousands
+DEFAULT_MAX_ITER = 5000
+
+def benchmark_cases(sizes, methods):
+    r"""
+    Enumerate the benchmark cases.
+
+    :param sizes: list of resolutions N
+    :param methods: subset of "sd", "cg", "mpcg", "cholesky"
+
+    Return:
+    list of dicts with keys N, method, storage, preconditioner
+    """
+    cases = []
+    for N in sizes:
+        num_dofs = 3*(N + 1)**2
+        storages = ["sparse", "dense"] if num_dofs <= DENSE_MAX_DOFS else ["sparse"]
+        for storage in storages:
+            for method in methods:
+                preconditioners = sorted(PRECONDITIONERS) if method == "mpcg" else [None]
+                for preconditioner in preconditioners:
+                    cases.append({"N": N, "method": method, "storage": storage,
+                                  "preconditioner": preconditioner})
+    return cases
+
+def case_key(case):
+    r"""
+    Key identifying a case across result files.
+    """
+    return (case["N"], case["method"], case["storage"], case["preconditioner"])
+
+def relative_residual(system, x):
+    r"""
+    Compute ||S (b - A x)|| / ||S b||, with S the constraint
+    filter of the system.
+    """
+    S, _ = constraint_matrices(system.S, system.num_particles)
+    r = np.einsum("kij,kj->ki", S, np.reshape(system.b - system.A @ x[:, 0], (-1, 3)))
+    b = np.einsum("kij,kj->ki", S, np.reshape(system.b, (-1, 3)))
+    return np.linalg.norm(r) / np.linalg.norm(b)
+
+def run_case(case, system, rtol, max_iter, repeats):
+    r"""
+    Run one case: the best wall time of repeats solves, then one
+    more solve under tracemalloc for the peak memory.
+
+    :param case: dict from benchmark_cases()
+    :param system: LinearSystem of the case
+    :param rtol: relative tolerance of the solves
+    :param max_iter: max number of iterations of the solves
+    :param repeats: number of timed solves
+
+    Return:
+    case updated with the measurements
+    """
+    opts = {}
+    if case["preconditioner"] is not None:
+        opts["preconditioner"] = case["preconditioner"]
+    wall_time = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = solve(system, method=case["method"], rtol=rtol, max_iter=max_iter, **opts)
+        elapsed = time.perf_counter() - start
+        if elapsed < wall_time:
+            wall_time, best = elapsed, result
+    # peak memory of setup + solve, measured separately since
+    # tracemalloc slows down allocations
+    tracemalloc.start()
+    solve(system, method=case["method"], rtol=rtol, max_iter=max_iter, **opts)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = best.stats
+    case = dict(case)
+    case.update({
+        "num_dofs": system.num_dofs,
+        "num_iterations": int(stats.num_iterations),
+        "termination": stats.termination,
+        "wall_time": wall_time,
+        "setup_time": float(stats.setup_time),
+        "solve_time": float(stats.solve_time),
+        "num_matvecs": int(stats.num_matvecs),
+        "matvecs_per_second": stats.num_matvecs / stats.solve_time if stats.solve_time > 0 else None,
+        "peak_memory": int(peak_memory),
+        "relative_residual": float(relative_residual(system, best.x)),
+    })
+    return case
+
+def run(sizes, methods, rtol, max_iter, repeats, verbose=True):
+    r"""
+    Run all cases.
+
+    Return:
+    dict with the metadata of the run and the list of results
+    """
+    results = []
+    cases = benchmark_cases(sizes, methods)
+    systems = {}
+    for case in cases:
+        key = (case["N"], case["storage"], case["method"])
+        if key not in systems:
+            A, b, S, z = cloth_system(case["N"])
+            if case["storage"] == "dense":
+                A = A.toarray()
+            # SD and CG cannot enforce constraints: they solve the
+            # unpinned system, which is SPD as well
+            if case["method"] in ("mpcg", "cholesky"):
+                systems[key] = LinearSystem(A, b, S, z)
+            else:
+                systems[key] = LinearSystem(A, b)
+        result = run_case(case, systems[key], rtol, max_iter, repeats)
+        results.append(result)
+        if verbose:
+            print(format_result(result), flush=True)
+    return {
+        "metadata": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "rtol": rtol,
+            "max_iter": max_iter,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+def format_result(result):
+    r"""
+    One line of the result table.
+    """
+    matvecs_per_second = result["matvecs_per_second"] or 0.0
+    return (f"{result['N']:>4} {result['num_dofs']:>7} {result['method']:>5} "
+            f"{result['storage']:>6} {str(result['preconditioner']):>12} "
+            f"{result['num_iterations']:>6} {result['termination']:>10} "
+            f"{result['wall_time']:>9.4f} {result['peak_memory']/2**20:>9.2f} "
+            f"{matvecs_per_second:>10.0f} {result['relative_residual']:>10.2e}")
+
+def header():
+    r"""
+    Header of the result table.
+    """
+    return (f"{'N':>4} {'dofs':>7} {'meth':>5} {'A':>6} {'precond':>12} {'iters':>6} "
+            f"{'stop':>10} {'time [s]':>9} {'peak [MB]':>9} {'matvec/s':>10} {'residual':>10}")
+
+def compare(baseline, current, time_tolerance=0.25, memory_tolerance=0.25, min_time=1e-3):
+    r"""
+    Compare two runs case by case.
+
+    :param baseline: result dict of run(), e.g. loaded from JSON
+    :param current: result dict of run()
+    :param time_tolerance: relative wall time increase reported as
+        a regression
+    :param memory_tolerance: relative peak memory increase reported
+        as a regression
+    :param min_time: wall times below this (in seconds) are too
+        noisy to compare
+
+    Return:
+    list of regression messages; empty if there are none
+    """
+    baseline_results = {case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = case_key(result)
+        if key not in baseline_results:
+            continue
+        reference = baseline_results[key]
+        name = "N={} {} {} {}".format(*key)
+        if reference["termination"] == "converged" and result["termination"] != "converged":
+            regressions.append(f"{name}: no longer converges ({result['termination']})")
+        if result["num_iterations"] > reference["num_iterations"]:
+            regressions.append(
+                f"{name}: iterations {reference['num_iterations']} -> {result['num_iterations']}")
+        if max(result["wall_time"], reference["wall_time"]) >= min_time and \
+                result["wall_time"] > (1 + time_tolerance)*reference["wall_time"]:
+            regressions.append(
+                f"{name}: wall time {reference['wall_time']:.4g} s -> {result['wall_time']:.4g} s")
+        if result["peak_memory"] > (1 + memory_tolerance)*reference["peak_memory"]:
+            regressions.append(
+                f"{name}: peak memory {reference['peak_memory']} B -> {result['peak_memory']} B")
+    return regressions
+
+def report(regressions):
+    r"""
+    Print regressions; return the exit code.
+    """
+    if len(regressions) == 0:
+        print("no regressions")
+        return 0
+    print(f"{len(regressions)} regression(s):")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the linear solvers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_run = subparsers.add_parser("run", help="run the benchmark")
+    parser_run.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser_run.add_argument("--methods", nargs="+", default=["sd", "cg", "mpcg"],
+                            choices=["sd", "cg", "mpcg", "cholesky"])
+    parser_run.add_argument("--rtol", type=float, default=1e-8)
+    parser_run.add_argument("--max-iter", type=int, default=DEFAULT_MAX_ITER)
+    parser_run.add_argument("--repeats", type=int, default=3)
+    parser_run.add_argument("--output", help="write the results to this JSON file")
+    parser_run.add_argument("--baseline", help="compare the results with this JSON file")
+    parser_compare = subparsers.add_parser("compare", help="compare two result files")
+    parser_compare.add_argument("baseline")
+    parser_compare.add_argument("current")
+    for subparser in (parser_run, parser_compare):
+        subparser.add_argument("--time-tolerance", type=float, default=0.25)
+        subparser.add_argument("--memory-tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(header())
+        current = run(args.sizes, args.methods, args.rtol, args.max_iter, args.repeats)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=1)
+        if args.baseline is None:
+            return 0
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+    return report(compare(baseline, current, args.time_tolerance, args.memory_tolerance))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# Time MPCG iterations on a cloth system with 1, 2, 4, ... threads
+# of solvers.parallel.ParticleBlockKernels, for the classic or the
+# pipelined (single-reduction) iteration.
+#
+#   python -m benchmarks.bench_threads [--size 256] [--threads 1 2 4 8]
+#   python -m benchmarks.bench_threads --solver pipelined
+import argparse
+import os
+import numpy as np
+from benchmarks.systems import cloth_system
+from solvers.mpcg import MPCGSolver
+from solvers.pipelined import PipelinedMPCGSolver
+
+SOLVER_CLASSES = {"mpcg": MPCGSolver, "pipelined": PipelinedMPCGSolver}
+
+def main():
+    parser = argparse.ArgumentParser(description="Threaded MPCG iterations on a cloth system")
+    parser.add_argument("--size", type=int, default=256,
+                        help="segments per side; N = 256 has 66049 particles")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--solver", choices=sorted(SOLVER_CLASSES), default="mpcg")
+    parser.add_argument("--preconditioner", default="jacobi")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    A, b, S, z = cloth_system(args.size, k_stretch=1e4)
+    print(f"{A.shape[0] // 3} particles, {os.cpu_count()} cores")
+    print(f"{'threads':>7} {'ms/iter':>9} {'speedup':>8}")
+    x_ref = None
+    serial_time = None
+    for num_threads in args.threads:
+        # a fixed number of iterations, so that all runs do the same work
+        solver = SOLVER_CLASSES[args.solver](A, b, S, z, preconditioner=args.preconditioner,
+                                             rtol=0.0, max_iter=args.iterations,
+                                             num_threads=num_threads)
+        best = np.inf
+        for _ in range(args.repeats):
+            x, stats = solver.solve(return_stats=True)
+            best = min(best, stats.solve_time)
+        if x_ref is None:
+            x_ref = x
+        assert np.allclose(x, x_ref, rtol=1e-10, atol=1e-14)
+        time_per_iteration = best / stats.num_iterations
+        if serial_time is None:
+            serial_time = time_per_iteration
+        print(f"{num_threads:>7} {1e3*time_per_iteration:>9.3f} "
+              f"{serial_time / time_per_iteration:>8.2f}")
+
+if __name__ == "__main__":
+    main()
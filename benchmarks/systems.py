@@ -0,0 +1,90 @@
+import numpy as np
+import scipy.sparse as sp
+import dhutils.dhutils as dhu
+
+def mesh_edges(faces):
+    r"""
+    Unique undirected edges of a triangle mesh.
+
+    :param faces: array of shape (F, 3)
+
+    Return:
+    array of shape (E, 2) with edge[0] < edge[1]
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+def spring_system(positions, faces, h=1e-2, mass=1e-2, k_stretch=1e3, k_shear=1e2, pinned=()):
+    r"""
+    Build a cloth-like linear system A dv = b for one implicit Euler
+    step of a mass-spring network on the mesh edges:
+
+        A = I + h^2/m K,  b = h/m f
+
+    where K is the (positive semi-definite) stiffness matrix of the
+    springs, k_stretch along and k_shear across each edge, and f is
+    gravity plus a smooth perturbation. A has one 3x3 block per
+    particle pair sharing an edge, like the cloth systems from
+    sim.ipynb, and its condition number grows with resolution.
+
+    :param positions: rest positions of shape (n, 3)
+    :param faces: faces of shape (F, 3)
+    :param pinned: indices of particles fixed in all directions
+
+    Return:
+    - A as a BSR matrix (3x3 blocks) of shape (3n, 3n);
+    - b of shape (3n, );
+    - constraint list S of length n (see MPCGSolver);
+    - z of shape (n, 3)
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    num_particles = positions.shape[0]
+    edges = mesh_edges(faces)
+    d = positions[edges[:, 1]] - positions[edges[:, 0]]
+    d /= np.linalg.norm(d, axis=1, keepdims=True)
+    # per-edge stiffness block, (E, 3, 3)
+    dd = np.einsum("ei,ej->eij", d, d)
+    K_e = k_stretch*dd + k_shear*(np.eye(3) - dd)
+    # block (i, i) and (j, j) get +K_e, (i, j) and (j, i) get -K_e
+    block_rows = np.concatenate([edges[:, 0], edges[:, 1], edges[:, 0], edges[:, 1], np.arange(num_particles)])
+    block_cols = np.concatenate([edges[:, 0], edges[:, 1], edges[:, 1], edges[:, 0], np.arange(num_particles)])
+    blocks = np.concatenate([
+        h**2/mass*K_e, h**2/mass*K_e, -h**2/mass*K_e, -h**2/mass*K_e,
+        np.tile(np.eye(3), (num_particles, 1, 1))])
+    # expand the 3x3 blocks to scalar COO entries
+    offsets = np.arange(3)
+    rows = np.broadcast_to(3*block_rows[:, None, None] + offsets[None, :, None], blocks.shape)
+    cols = np.broadcast_to(3*block_cols[:, None, None] + offsets[None, None, :], blocks.shape)
+    A = sp.coo_matrix(
+        (blocks.ravel(), (rows.ravel(), cols.ravel())),
+        shape=(3*num_particles, 3*num_particles)).tobsr(blocksize=(3, 3))
+    A.sum_duplicates()
+    A.sort_indices()
+    # gravity plus a smooth in-plane perturbation
+    f = np.zeros((num_particles, 3))
+    f[:, 2] = -9.8*mass
+    f[:, 0] = mass*np.sin(3.0*positions[:, 1])
+    b = h/mass*f.ravel()
+    S = [()]*num_particles
+    all_directions = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+    for particle_index in pinned:
+        S[particle_index] = all_directions
+    z = np.zeros((num_particles, 3))
+    return A, b, S, z
+
+def cloth_system(N, **kwargs):
+    r"""
+    Spring system on the N x N dhutils.standard_rectangle pinned at
+    its two top corners, as in the simulator's hanging cloth.
+
+    :param N: number of segments along each side
+    :param kwargs: passed on to spring_system()
+
+    Return:
+    A, b, S, z as for spring_system()
+    """
+    positions, faces = dhu.standard_rectangle(1.0, 1.0, N, N)
+    # top corners: vertex 0 and the first vertex of the last column
+    pinned = (0, N*(N+1))
+    return spring_system(positions, faces, pinned=pinned, **kwargs)
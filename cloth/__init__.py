@@ -0,0 +1,3 @@
+from cloth.model import ClothModel
+from cloth.scene import DEFAULT_SCENE, build_model, build_simulator, load_scene, merge_scene
+from cloth.simulator import Simulator
@@ -0,0 +1,58 @@
+# Run a cloth scene headless and optionally save the trajectory.
+#
+#   python -m cloth                             # the scene of sim.ipynb
+#   python -m cloth scene.json --steps 100 --output run.npz
+#   python -m cloth --size 16 --method cholesky
+import argparse
+import sys
+import time
+import numpy as np
+from cloth.scene import build_simulator, load_scene, merge_scene
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cloth",
+                                     description="Run a cloth scene headless")
+    parser.add_argument("scene", nargs="?", help="scene JSON file; the default scene if omitted")
+    parser.add_argument("--steps", type=int, help="number of time steps")
+    parser.add_argument("--dt", type=float, help="time step")
+    parser.add_argument("--size", type=int, help="number of segments along each side")
+    parser.add_argument("--method", help="linear solver, e.g. mpcg or cholesky")
+    parser.add_argument("--pattern-cache", help="directory caching the sparsity patterns")
+    parser.add_argument("--output", help="save times, positions and faces to this .npz file")
+    parser.add_argument("--quiet", action="store_true", help="do not print per-step statistics")
+    args = parser.parse_args(argv)
+
+    scene = merge_scene({}) if args.scene is None else load_scene(args.scene)
+    if args.steps is not None:
+        scene["num_steps"] = args.steps
+    if args.dt is not None:
+        scene["dt"] = args.dt
+    if args.size is not None:
+        scene["cloth"]["Nx"] = scene["cloth"]["Ny"] = args.size
+    if args.method is not None:
+        scene["solver"]["method"] = args.method
+    if args.pattern_cache is not None:
+        scene["solver"]["pattern_cache_dir"] = args.pattern_cache
+
+    simulator = build_simulator(scene)
+    model = simulator.model
+    print(f"{model.num_particles} particles, {model.num_faces} faces, "
+          f"{scene['num_steps']} steps of {scene['dt']}")
+
+    def report(simulator):
+        if args.quiet:
+            return
+        stats = simulator.stats
+        print(f"step {simulator.num_steps:>5}  t = {simulator.t:.4f}  "
+              f"iterations {stats.num_iterations:>4}  {stats.termination}  "
+              f"|v|_max = {np.max(np.linalg.norm(simulator.v, axis=1)):.4e}")
+
+    start = time.perf_counter()
+    times, positions = simulator.run(scene["num_steps"], callback=report)
+    print(f"{time.perf_counter() - start:.3f} s")
+    if args.output is not None:
+        np.savez(args.output, times=times, positions=positions, faces=model.faces)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import numpy as np
+import scipy.sparse as sp
+
+# number of topologies whose BlockPattern is kept in memory by
+# BlockPattern.from_topology()
+PATTERN_CACHE_SIZE = 8
+
+# BlockPattern per topology key, least recently used first
+_PATTERN_CACHE = {}
+
+def topology_key(num_particles, elements):
+    r"""
+    Hash of a mesh connectivity, identifying its BlockPattern.
+
+    :param num_particles: n
+    :param elements: sequence of element arrays of shape (E, k)
+
+    Return:
+    hexadecimal SHA-1 digest
+    """
+    digest = hashlib.sha1(np.int64(num_particles).tobytes())
+    for element_array in elements:
+        element_array = np.ascontiguousarray(element_array, dtype=np.int64)
+        digest.update(np.array(element_array.shape, dtype=np.int64).tobytes())
+        digest.update(element_array.tobytes())
+    return digest.hexdigest()
+
+class BlockPattern:
+    r"""
+    Block sparsity pattern of a matrix assembled from per-element
+    blocks, e.g. the force Jacobian df/dx of a cloth mesh, and the
+    map scattering the element blocks into it.
+
+    An element with vertices (p_0, ..., p_(k-1)) contributes a
+    3k x 3k block whose 3x3 sub-block (a, b) is added to the block
+    (p_a, p_b) of the matrix. The pattern is the union of these
+    blocks and of the diagonal, stored as a BSR matrix with 3x3
+    blocks and sorted indices, as the solvers expect.
+
+    The pattern and the scatter map only depend on the connectivity.
+    They are computed once per topology (from_topology() caches them
+    in memory and optionally on disk), and assemble() is then a
+    scatter-add of the element values into the data array of the
+    matrix: every entry of an element block has a precomputed flat
+    index into that array. Assembling into a matrix from allocate()
+    allocates nothing of the size of the matrix.
+    """
+
+    def __init__(self, num_particles, elements) -> None:
+        r"""
+        Constructor for BlockPattern
+
+        :param num_particles: n
+        :param elements: sequence of element arrays of shape (E, k),
+            e.g. (model.faces, model.hinges); k may differ between
+            arrays
+        """
+        rows = [np.arange(num_particles)]
+        cols = [np.arange(num_particles)]
+        for element_array in elements:
+            element_array = np.asarray(element_array, dtype=np.int64)
+            k = element_array.shape[1]
+            # block (a, b) of element e lands at (element[e, a], element[e, b])
+            rows.append(np.ravel(np.repeat(element_array[:, :, None], k, axis=2)))
+            cols.append(np.ravel(np.repeat(element_array[:, None, :], k, axis=1)))
+        # sorted by row, then column: the canonical BSR order
+        keys, block_target = np.unique(np.concatenate(rows)*num_particles + np.concatenate(cols),
+                                       return_inverse=True)
+        indices = keys % num_particles
+        indptr = np.searchsorted(keys // num_particles, np.arange(num_particles + 1))
+        diagonal_blocks = block_target[:num_particles]
+        # entry (3a + i, 3b + j) of the block of element e goes to entry
+        # (i, j) of the stored block block_target[e, a, b]
+        targets = []
+        start = num_particles
+        for element_array in elements:
+            num_elements, k = np.shape(element_array)
+            element_target = np.reshape(block_target[start:start + num_elements*k*k],
+                                        (num_elements, k, 1, k, 1))
+            start += num_elements*k*k
+            offsets = 3*np.arange(3)[None, None, :, None, None] + \
+                np.arange(3)[None, None, None, None, :]
+            targets.append(np.ravel(9*element_target + offsets))
+        self._set_arrays(num_particles, indptr, indices, diagonal_blocks, targets)
+
+    def _set_arrays(self, num_particles, indptr, indices, diagonal_blocks, targets):
+        r"""
+        Set the arrays of the pattern, computed or loaded from disk.
+        """
+        self._num_particles = int(num_particles)
+        self._indptr = np.asarray(indptr, dtype=np.int64)
+        self._indices = np.asarray(indices, dtype=np.int64)
+        self._diagonal_blocks = np.asarray(diagonal_blocks, dtype=np.int64)
+        self._targets = [np.asarray(target, dtype=np.int64) for target in targets]
+
+    @classmethod
+    def from_topology(cls, num_particles, elements, cache_dir=None):
+        r"""
+        BlockPattern of a connectivity, computed once per topology
+        key and then shared; the patterns of the last
+        PATTERN_CACHE_SIZE topologies used are kept in memory. With
+        cache_dir, patterns are also saved to and loaded from
+        <cache_dir>/<key>.npz, so that they survive the process.
+
+        :param num_particles: n
+        :param elements: sequence of element arrays of shape (E, k)
+        :param cache_dir: optional directory of the disk cache
+
+        Return:
+        BlockPattern
+        """
+        key = topology_key(num_particles, elements)
+        path = None if cache_dir is None else os.path.join(cache_dir, key + ".npz")
+        pattern = _PATTERN_CACHE.pop(key, None)
+        if pattern is None:
+            if path is not None and os.path.exists(path):
+                pattern = cls.load(path)
+            else:
+                pattern = cls(num_particles, elements)
+            if len(_PATTERN_CACHE) >= PATTERN_CACHE_SIZE:
+                # drop the least recently used topology
+                del _PATTERN_CACHE[next(iter(_PATTERN_CACHE))]
+        _PATTERN_CACHE[key] = pattern
+        if path is not None and not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            pattern.save(path)
+        return pattern
+
+    @classmethod
+    def load(cls, path):
+        r"""
+        Load a pattern saved by save().
+
+        :param path: .npz file
+        """
+        pattern = cls.__new__(cls)
+        with np.load(path) as arrays:
+            targets = [arrays[f"target_{index}"] for index in range(int(arrays["num_targets"]))]
+            pattern._set_arrays(arrays["num_particles"], arrays["indptr"], arrays["indices"],
+                                arrays["diagonal_blocks"], targets)
+        return pattern
+
+    def save(self, path):
+        r"""
+        Save the pattern to a .npz file.
+
+        :param path: file name
+        """
+        targets = {f"target_{index}": target for index, target in enumerate(self._targets)}
+        # write then rename, so that concurrent runs never read a
+        # partial file
+        temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary_path, num_particles=self._num_particles, indptr=self._indptr,
+                 indices=self._indices, diagonal_blocks=self._diagonal_blocks,
+                 num_targets=len(self._targets), **targets)
+        os.replace(temporary_path, path)
+
+    @property
+    def num_particles(self):
+        r"""
+        Getter for num_particles
+        """
+        return self._num_particles
+
+    @property
+    def num_blocks(self):
+        r"""
+        Number of stored 3x3 blocks
+        """
+        return self._indices.shape[0]
+
+    @property
+    def indptr(self):
+        r"""
+        Getter for the BSR index pointer
+        """
+        return self._indptr
+
+    @property
+    def indices(self):
+        r"""
+        Getter for the BSR block column indices
+        """
+        return self._indices
+
+    @property
+    def diagonal_blocks(self):
+        r"""
+        Getter for the index of the diagonal block of every particle
+        among the stored blocks
+        """
+        return self._diagonal_blocks
+
+    def allocate(self):
+        r"""
+        Allocate a zero BSR matrix with this pattern, to assemble
+        into.
+
+        Return:
+        BSR matrix of shape (3n, 3n)
+        """
+        num_dofs = 3*self._num_particles
+        return sp.bsr_matrix((np.zeros((self.num_blocks, 3, 3)), self._indices, self._indptr),
+                             shape=(num_dofs, num_dofs))
+
+    def assemble(self, element_blocks, diagonal=None, out=None):
+        r"""
+        Sum element blocks into a BSR matrix with this pattern.
+
+        :param element_blocks: sequence of arrays of shape
+            (E, 3k, 3k), one per element array of the constructor,
+            with rows and columns ordered as (vertex, coordinate)
+        :param diagonal: optional per-particle term added to the
+            diagonal blocks: a scalar, shape (n, ) for multiples of
+            the identity, or shape (n, 3, 3)
+        :param out: optional matrix from allocate() whose values are
+            overwritten; its data must be C-contiguous
+
+        Return:
+        BSR matrix of shape (3n, 3n)
+        """
+        if out is None:
+            out = self.allocate()
+        data = out.data
+        if data.shape != (self.num_blocks, 3, 3) or not data.flags.c_contiguous:
+            raise ValueError("out must be a matrix from allocate(), with contiguous data")
+        # a view, since data is contiguous
+        data_flat = data.reshape(-1)
+        data_flat.fill(0.0)
+        for target, element_block in zip(self._targets, element_blocks):
+            np.add.at(data_flat, target, np.ravel(element_block))
+        if diagonal is not None:
+            diagonal = np.asarray(diagonal, dtype=data.dtype)
+            if diagonal.ndim < 3:
+                # multiples of the identity
+                for component in range(3):
+                    data[self._diagonal_blocks, component, component] += diagonal
+            else:
+                data[self._diagonal_blocks] += diagonal
+        return out
@@ -0,0 +1,259 @@
+r"""
+Energies of the cloth model of Baraff and Witkin, 98', in JAX, and
+the forces and force Jacobian derived from them by automatic
+differentiation. Positions x have shape (n, 3); see ClothModel for
+the definitions of the conditions.
+
+Every quantity is computed for all faces or hinges at once, by
+gathering vertex positions through model.faces and model.hinges
+and contracting with einsum; the rest-state [del_u; del_v]^{-1}
+are precomputed by the model. The cost is linear in the number of
+elements.
+
+The force Jacobian is also available per element
+(element_force_jacobians): a 9x9 block for the stretch and shear of
+each face and a 12x12 block for the bend of each hinge, from the
+Hessian of a single element's energy vmapped over the elements.
+By default each block is projected onto the positive semidefinite
+matrices, so that M - h^2 df/dx stays positive definite when the
+cloth is compressed or folded. cloth.assembly scatters them into a
+sparse matrix.
+
+Evaluate under jax.enable_x64(True) for double precision results.
+"""
+import jax
+import jax.numpy as jnp
+
+def deformation(x_faces, del_uv_inverse):
+    r"""
+    Compute w_u and w_v of faces: [w_u w_v] = [dx1 dx2]
+    [del_u; del_v]^{-1} with dx1 = x_j - x_i, dx2 = x_k - x_i.
+
+    :param x_faces: vertex positions of the faces, shape (F, 3, 3)
+    :param del_uv_inverse: [del_u; del_v]^{-1} of shape (F, 2, 2)
+
+    Return:
+    w_u, w_v of shape (F, 3) each
+    """
+    # (F, 2, 3) rows dx1, dx2
+    dx = x_faces[:, 1:] - x_faces[:, 0:1]
+    w = jnp.einsum("fai,fab->fbi", dx, del_uv_inverse)
+    return w[:, 0], w[:, 1]
+
+def face_conditions(x_faces, del_uv_inverse, area, uv_rest_lengths):
+    r"""
+    Compute the stretch and shear conditions of faces.
+
+    :param x_faces: vertex positions of the faces, shape (F, 3, 3)
+    :param del_uv_inverse: [del_u; del_v]^{-1} of shape (F, 2, 2)
+    :param area: areas of shape (F, )
+    :param uv_rest_lengths: (b_u, b_v)
+
+    Return:
+    C_u, C_v (the stretch conditions) and C_sh, of shape (F, ) each
+    """
+    w_u, w_v = deformation(x_faces, del_uv_inverse)
+    b_u, b_v = uv_rest_lengths
+    C_u = area * (jnp.linalg.norm(w_u, axis=1) - b_u)
+    C_v = area * (jnp.linalg.norm(w_v, axis=1) - b_v)
+    # C_sh = area * w_u^T * w_v
+    C_sh = area * jnp.einsum("fi,fi->f", w_u, w_v)
+    return C_u, C_v, C_sh
+
+def hinge_angles(x_hinges):
+    r"""
+    Compute the angle between the normals n1, n2 of the two faces of
+    each hinge as atan2((n1 x n2) . e, n1 . n2) with e the unit
+    shared edge, which equals arccos(n1 . n2) up to its sign but,
+    unlike arccos, is differentiable when the faces are flat.
+
+    :param x_hinges: positions of the hinge vertices [e0, e1, a, b]
+        (shared edge e0 -> e1, opposite vertices a, b), shape (H, 4, 3)
+
+    Return:
+    angles of shape (H, )
+    """
+    edge = x_hinges[:, 1] - x_hinges[:, 0]
+    # faces (e0, e1, a) and (e1, e0, b) of a consistently oriented mesh
+    n1 = jnp.cross(edge, x_hinges[:, 2] - x_hinges[:, 0])
+    n2 = jnp.cross(-edge, x_hinges[:, 3] - x_hinges[:, 1])
+    n1 = n1 / jnp.linalg.norm(n1, axis=1, keepdims=True)
+    n2 = n2 / jnp.linalg.norm(n2, axis=1, keepdims=True)
+    edge = edge / jnp.linalg.norm(edge, axis=1, keepdims=True)
+    return jnp.arctan2(jnp.einsum("hi,hi->h", jnp.cross(n1, n2), edge),
+                       jnp.einsum("hi,hi->h", n1, n2))
+
+def del_x(model, x):
+    r"""
+    Compute del(x1) = x_j - x_i and del(x2) = x_k - x_i for each
+    face (i, j, k).
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    dx1, dx2 of shape (F, 3) each
+    """
+    x_faces = x[model.faces]
+    return x_faces[:, 1] - x_faces[:, 0], x_faces[:, 2] - x_faces[:, 0]
+
+def e_stretch(model, x):
+    r"""
+    Compute the stretch energy of each face.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    energies of shape (F, )
+    """
+    C_u, C_v, _ = face_conditions(x[model.faces], model.del_uv_inverse, model.area,
+                                  model.uv_rest_lengths)
+    return 0.5 * model.k_stretch * (C_u**2 + C_v**2)
+
+def e_shear(model, x):
+    r"""
+    Compute the shear energy of each face.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    energies of shape (F, )
+    """
+    _, _, C_sh = face_conditions(x[model.faces], model.del_uv_inverse, model.area,
+                                 model.uv_rest_lengths)
+    return 0.5 * model.k_shear * C_sh**2
+
+def get_normals(model, x):
+    r"""
+    Compute the unit normals of the faces.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    normals of shape (F, 3)
+    """
+    normals = jnp.cross(*del_x(model, x))
+    return normals / jnp.linalg.norm(normals, axis=1, keepdims=True)
+
+def e_bend(model, x):
+    r"""
+    Compute the bend energy of each hinge.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    energies of shape (H, )
+    """
+    return 0.5 * model.k_bend * hinge_angles(x[model.hinges])**2
+
+def face_energies(model, x_faces, del_uv_inverse, area):
+    r"""
+    Compute the stretch plus shear energy of faces.
+
+    :param model: ClothModel, for the stiffnesses and rest lengths
+    :param x_faces: vertex positions of the faces, shape (F, 3, 3)
+    :param del_uv_inverse: [del_u; del_v]^{-1} of shape (F, 2, 2)
+    :param area: areas of shape (F, )
+
+    Return:
+    energies of shape (F, )
+    """
+    C_u, C_v, C_sh = face_conditions(x_faces, del_uv_inverse, area, model.uv_rest_lengths)
+    return 0.5 * model.k_stretch * (C_u**2 + C_v**2) + 0.5 * model.k_shear * C_sh**2
+
+def total_energy(model, x):
+    r"""
+    Compute the total internal energy of the cloth; the conditions
+    of each face are computed once for the stretch and shear terms.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3) or (3n, )
+
+    Return:
+    scalar energy
+    """
+    x = jnp.reshape(x, (model.num_particles, 3))
+    return jnp.sum(face_energies(model, x[model.faces], model.del_uv_inverse, model.area)) + \
+        jnp.sum(e_bend(model, x))
+
+def internal_forces(model, x):
+    r"""
+    Compute f = -dE/dx, the internal forces on the particles.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    forces of shape (n, 3)
+    """
+    return -jax.grad(lambda x: total_energy(model, x))(x)
+
+def force_jacobian(model, x):
+    r"""
+    Compute df/dx = -d^2E/dx^2 as a dense matrix. Only meant for
+    small cloth and for checks; see element_force_jacobians().
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+
+    Return:
+    Jacobian of shape (3n, 3n)
+    """
+    x_flat = jnp.reshape(x, (3*model.num_particles, ))
+    return -jax.hessian(lambda x: total_energy(model, x))(x_flat)
+
+def project_psd(hessians):
+    r"""
+    Project symmetric matrices onto the positive semidefinite ones:
+    eigendecompose and set the negative eigenvalues to zero.
+
+    :param hessians: matrices of shape (E, k, k)
+
+    Return:
+    projected matrices of shape (E, k, k)
+    """
+    eigenvalues, eigenvectors = jnp.linalg.eigh(hessians)
+    return jnp.einsum("eik,ek,ejk->eij", eigenvectors, jnp.maximum(eigenvalues, 0.0),
+                      eigenvectors)
+
+def element_force_jacobians(model, x, project=True):
+    r"""
+    Compute the contribution of every element to df/dx: the Hessian
+    of a single face's (resp. hinge's) energy with respect to its
+    vertex positions, vmapped over the faces (resp. hinges).
+
+    The exact Hessian of an element is indefinite under compression
+    (stretch) and when folded (bend), and so can be A = M - h^2 df/dx
+    for large h, which breaks MPCG and Cholesky. With project, each
+    Hessian is projected by project_psd() first; df/dx is then
+    negative semidefinite and A is positive definite.
+
+    :param model: ClothModel
+    :param x: positions of shape (n, 3)
+    :param project: if False, return the blocks of the exact
+        Jacobian
+
+    Return:
+    - face blocks of shape (F, 9, 9), rows and columns ordered as
+    the (vertex, coordinate) pairs of model.faces;
+    - hinge blocks of shape (H, 12, 12), likewise for model.hinges
+    """
+    def face_energy(x_face, del_uv_inverse, area):
+        return face_energies(model, x_face[None], del_uv_inverse[None], area[None])[0]
+
+    def hinge_energy(x_hinge):
+        return 0.5 * model.k_bend * hinge_angles(x_hinge[None])[0]**2
+
+    face_hessians = jnp.reshape(jax.vmap(jax.hessian(face_energy))(
+        x[model.faces], jnp.asarray(model.del_uv_inverse), jnp.asarray(model.area)),
+        (model.num_faces, 9, 9))
+    hinge_hessians = jnp.reshape(jax.vmap(jax.hessian(hinge_energy))(x[model.hinges]),
+                                 (model.num_hinges, 12, 12))
+    if project:
+        face_hessians = project_psd(face_hessians)
+        hinge_hessians = project_psd(hinge_hessians)
+    return -face_hessians, -hinge_hessians
@@ -0,0 +1,279 @@
+import numpy as np
+import dhutils.dhutils as dhu
+from cloth.topology import MeshTopology, load_gltf_mesh
+
+class ClothModel:
+    r"""
+    Cloth as a triangle mesh of particles, with the stretch, shear
+    and bend energies of Baraff and Witkin, 98'.
+
+    Each particle has a world position x and material coordinates
+    (u, v). On each face, w_u = dx/du and w_v = dx/dv are the
+    columns of [x_j - x_i, x_k - x_i] [del_u; del_v]^{-1}, and
+
+        C_stretch = area [|w_u| - b_u, |w_v| - b_v]
+        C_shear = area w_u^T w_v
+
+    with b_u, b_v the rest lengths of w_u and w_v. Each pair of faces
+    sharing an edge has C_bend = the angle between their normals.
+    The energy of each condition C is 0.5 k C^T C.
+    """
+
+    def __init__(self, positions, faces, uv=None, uv_rest_lengths=(1.0, 1.0), mass=0.2,
+                 k_stretch=2.0, k_shear=2.0, k_bend=2.0, pinned=(), external_forces=None,
+                 gravity=(0.0, 0.0, 0.0)) -> None:
+        r"""
+        Constructor for ClothModel
+
+        :param positions: rest positions of shape (n, 3)
+        :param faces: consistently oriented faces of shape (F, 3)
+        :param uv: material coordinates of shape (n, 2); the x, y
+            rest coordinates by default
+        :param uv_rest_lengths: (b_u, b_v)
+        :param mass: mass of each particle; scalar or shape (n, )
+        :param k_stretch: stretch stiffness
+        :param k_shear: shear stiffness
+        :param k_bend: bend stiffness
+        :param pinned: indices of the particles fixed in place
+        :param external_forces: constant external forces of shape
+            (n, 3); zero by default
+        :param gravity: gravitational acceleration, shape (3, )
+        """
+        self._positions = np.array(positions, dtype=np.float64)
+        self._faces = np.array(faces, dtype=np.int64)
+        num_particles = self._positions.shape[0]
+        if uv is None:
+            uv = self._positions[:, 0:2]
+        self._uv = np.array(uv, dtype=np.float64)
+        self._uv_rest_lengths = tuple(float(b) for b in uv_rest_lengths)
+        self._mass = np.broadcast_to(np.asarray(mass, dtype=np.float64), (num_particles, )).copy()
+        self._k_stretch = k_stretch
+        self._k_shear = k_shear
+        self._k_bend = k_bend
+        self._pinned = np.array(pinned, dtype=np.int64)
+        if external_forces is None:
+            external_forces = np.zeros((num_particles, 3))
+        self._external_forces = np.array(external_forces, dtype=np.float64)
+        self._gravity = np.array(gravity, dtype=np.float64)
+        # per-face del_u = [u_j - u_i, u_k - u_i], del_v likewise
+        uv_faces = self._uv[self._faces]
+        self._del_u = uv_faces[:, 1:3, 0] - uv_faces[:, 0:1, 0]
+        self._del_v = uv_faces[:, 1:3, 1] - uv_faces[:, 0:1, 1]
+        # area of the faces in (u, v)
+        self._area = np.abs(0.5*(self._del_u[:, 0]*self._del_v[:, 1]
+                                 - self._del_v[:, 0]*self._del_u[:, 1]))
+        # [del_u; del_v]^{-1}, fixed by the rest state
+        self._del_uv_inverse = np.linalg.inv(np.stack([self._del_u, self._del_v], axis=1))
+        self._topology = MeshTopology(self._faces, num_particles)
+
+    @classmethod
+    def rectangle(cls, Lx, Ly, Nx, Ny, pinned="corners", **kwargs):
+        r"""
+        Cloth on the Nx x Ny dhutils.standard_rectangle, hanging
+        from y = 0. (u, v) count segments along x and -y, and the
+        rest lengths b_u, b_v are the segment lengths, as in
+        sim.ipynb.
+
+        :param Lx, Ly: size of the rectangle
+        :param Nx, Ny: number of segments along x and y
+        :param pinned: "corners" for the four corners, "top" for the
+            two top corners, or a sequence of particle indices
+        :param kwargs: passed on to the constructor
+
+        Return:
+        ClothModel
+        """
+        positions, faces = dhu.standard_rectangle(Lx, Ly, Nx, Ny)
+        positions = positions.astype(np.float64)
+        dx, dy = Lx / Nx, Ly / Ny
+        uv = np.stack([positions[:, 0] / dx, -positions[:, 1] / dy], axis=1)
+        # particle (jx, jy) has index jx*(Ny + 1) + jy
+        top_corners = [0, Nx*(Ny + 1)]
+        if isinstance(pinned, str):
+            if pinned == "corners":
+                pinned = top_corners + [Ny, Nx*(Ny + 1) + Ny]
+            elif pinned == "top":
+                pinned = top_corners
+            else:
+                raise ValueError(f"unknown pinned set {pinned!r}; expected 'corners' or 'top'")
+        return cls(positions, faces, uv=uv, uv_rest_lengths=(dx, dy), pinned=pinned, **kwargs)
+
+    @classmethod
+    def from_gltf(cls, path, **kwargs):
+        r"""
+        Cloth on the mesh of a glTF file, e.g. square.glb. Unless
+        given, (u, v) are the rest coordinates along the two axes
+        in which the mesh is widest, which is the rest state of a
+        flat mesh with the default rest lengths (1, 1).
+
+        :param path: .glb or .gltf file; loading needs gltflib
+        :param kwargs: passed on to the constructor
+
+        Return:
+        ClothModel
+        """
+        positions, faces = load_gltf_mesh(path)
+        if "uv" not in kwargs:
+            extents = np.ptp(positions, axis=0)
+            kwargs["uv"] = positions[:, np.sort(np.argsort(extents)[1:])]
+        return cls(positions, faces, **kwargs)
+
+    @property
+    def num_particles(self):
+        r"""
+        Number of particles n
+        """
+        return self._positions.shape[0]
+
+    @property
+    def num_faces(self):
+        r"""
+        Number of faces F
+        """
+        return self._faces.shape[0]
+
+    @property
+    def num_hinges(self):
+        r"""
+        Number of pairs of faces sharing an edge
+        """
+        return self._topology.hinges.shape[0]
+
+    @property
+    def rest_positions(self):
+        r"""
+        Getter for the rest positions, shape (n, 3)
+        """
+        return self._positions
+
+    @property
+    def faces(self):
+        r"""
+        Getter for the faces, shape (F, 3)
+        """
+        return self._faces
+
+    @property
+    def uv(self):
+        r"""
+        Getter for the material coordinates, shape (n, 2)
+        """
+        return self._uv
+
+    @property
+    def uv_rest_lengths(self):
+        r"""
+        Getter for (b_u, b_v)
+        """
+        return self._uv_rest_lengths
+
+    @property
+    def del_u(self):
+        r"""
+        Getter for the per-face [u_j - u_i, u_k - u_i], shape (F, 2)
+        """
+        return self._del_u
+
+    @property
+    def del_v(self):
+        r"""
+        Getter for the per-face [v_j - v_i, v_k - v_i], shape (F, 2)
+        """
+        return self._del_v
+
+    @property
+    def del_uv_inverse(self):
+        r"""
+        Getter for the per-face [del_u; del_v]^{-1}, shape (F, 2, 2)
+        """
+        return self._del_uv_inverse
+
+    @property
+    def area(self):
+        r"""
+        Getter for the areas of the faces in (u, v), shape (F, )
+        """
+        return self._area
+
+    @property
+    def topology(self):
+        r"""
+        Getter for the MeshTopology of the faces
+        """
+        return self._topology
+
+    @property
+    def hinges(self):
+        r"""
+        Getter for the hinge vertices, shape (H, 4); see
+        MeshTopology.hinges
+        """
+        return self._topology.hinges
+
+    @property
+    def hinge_faces(self):
+        r"""
+        Getter for the face pairs of the hinges, shape (H, 2)
+        """
+        return self._topology.hinge_faces
+
+    @property
+    def mass(self):
+        r"""
+        Getter for the particle masses, shape (n, )
+        """
+        return self._mass
+
+    @property
+    def k_stretch(self):
+        r"""
+        Getter for the stretch stiffness
+        """
+        return self._k_stretch
+
+    @property
+    def k_shear(self):
+        r"""
+        Getter for the shear stiffness
+        """
+        return self._k_shear
+
+    @property
+    def k_bend(self):
+        r"""
+        Getter for the bend stiffness
+        """
+        return self._k_bend
+
+    @property
+    def pinned(self):
+        r"""
+        Getter for the indices of the pinned particles
+        """
+        return self._pinned
+
+    def external_force(self, t):
+        r"""
+        Compute the external forces at time t: the constant external
+        forces plus gravity.
+
+        :param t: time
+
+        Return:
+        forces of shape (n, 3)
+        """
+        return self._external_forces + np.outer(self._mass, self._gravity)
+
+    def constraints(self):
+        r"""
+        Build the MPCG constraints of the pinned particles.
+
+        Return:
+        - constraint list S of length n (see solvers.mpcg.MPCGSolver);
+        - constrained velocities z of shape (n, 3)
+        """
+        S = [()]*self.num_particles
+        all_directions = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+        for particle_index in self._pinned:
+            S[particle_index] = all_directions
+        return S, np.zeros((self.num_particles, 3))
@@ -0,0 +1,88 @@
+r"""
+Scenes: the settings of a simulation run as a plain dictionary,
+e.g. loaded from JSON, so that runs can be scripted and compared.
+
+    {
+        "cloth": {"Lx": 1.5, "Ly": 1.5, "Nx": 4, "Ny": 4, "pinned": "corners"},
+        "material": {"mass": 0.2, "k_stretch": 2.0, "k_shear": 2.0, "k_bend": 2.0},
+        "gravity": [0.0, 0.0, 0.0],
+        "point_forces": [{"particle": "center", "force": [0.0, 0.0, -2.0]}],
+        "dt": 0.02,
+        "num_steps": 20,
+        "solver": {"method": "mpcg", "rtol": 1e-10}
+    }
+
+Missing entries take the values of DEFAULT_SCENE, which is the
+scene of sim.ipynb.
+"""
+import copy
+import json
+import numpy as np
+from cloth.model import ClothModel
+from cloth.simulator import Simulator
+
+DEFAULT_SCENE = {
+    "cloth": {"Lx": 1.5, "Ly": 1.5, "Nx": 4, "Ny": 4, "pinned": "corners"},
+    "material": {"mass": 0.2, "k_stretch": 2.0, "k_shear": 2.0, "k_bend": 2.0},
+    "gravity": [0.0, 0.0, 0.0],
+    "point_forces": [{"particle": "center", "force": [0.0, 0.0, -2.0]}],
+    "dt": 2e-2,
+    "num_steps": 20,
+    "solver": {"method": "mpcg", "rtol": 1e-10},
+}
+
+def merge_scene(scene, defaults=DEFAULT_SCENE):
+    r"""
+    Fill in the entries missing from scene with the defaults,
+    recursively.
+
+    Return:
+    new scene dictionary
+    """
+    merged = copy.deepcopy(defaults)
+    for key, value in scene.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_scene(value, merged[key])
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def load_scene(path):
+    r"""
+    Load a scene from a JSON file and fill in the defaults.
+    """
+    with open(path) as f:
+        return merge_scene(json.load(f))
+
+def build_model(scene):
+    r"""
+    Build the ClothModel of a scene.
+
+    :param scene: scene dictionary, see merge_scene()
+
+    Return:
+    ClothModel
+    """
+    cloth = scene["cloth"]
+    Nx, Ny = cloth["Nx"], cloth["Ny"]
+    num_particles = (Nx + 1)*(Ny + 1)
+    external_forces = np.zeros((num_particles, 3))
+    for point_force in scene["point_forces"]:
+        particle = point_force["particle"]
+        if particle == "center":
+            particle = (Nx // 2)*(Ny + 1) + Ny // 2
+        external_forces[particle] += point_force["force"]
+    return ClothModel.rectangle(cloth["Lx"], cloth["Ly"], Nx, Ny, pinned=cloth["pinned"],
+                                external_forces=external_forces, gravity=scene["gravity"],
+                                **scene["material"])
+
+def build_simulator(scene):
+    r"""
+    Build the Simulator of a scene.
+
+    :param scene: scene dictionary, see merge_scene()
+
+    Return:
+    Simulator
+    """
+    return Simulator(build_model(scene), dt=scene["dt"], **scene["solver"])
@@ -0,0 +1,262 @@
+import warnings
+import jax
+import numpy as np
+from cloth.assembly import BlockPattern
+from cloth.energies import element_force_jacobians, force_jacobian, internal_forces
+from solvers.api import LinearSystem, solve
+from solvers.mpcg import MPCGStepper
+
+# compiled once per ClothModel (hashed by identity) and shared by its
+# simulators
+jit_internal_forces = jax.jit(internal_forces, static_argnums=0)
+jit_force_jacobian = jax.jit(force_jacobian, static_argnums=0)
+jit_element_force_jacobians = jax.jit(element_force_jacobians, static_argnums=0,
+                                      static_argnames="project")
+
+class Simulator:
+    r"""
+    Implicit Euler time stepping of a ClothModel (Baraff and Witkin,
+    98'). Each step solves
+
+        (M - h df/dv - h^2 df/dx) dv = h (f + h df/dx v)
+
+    for the velocity change dv, with df/dv = 0 (no damping) and the
+    pinned particles constrained through S and z, then updates
+    v = v + dv and x = x + h v. df/dx and A are sparse (BSR with 3x3
+    blocks), assembled from the per-element Jacobian blocks, each
+    projected to keep A positive definite (see
+    cloth.energies.element_force_jacobians()). Their
+    pattern depends only on the mesh and is shared by the simulators
+    of a topology (see cloth.assembly.BlockPattern.from_topology());
+    each step only scatters new values into A.
+
+    With method "mpcg", one long-lived MPCG solver is warm-started
+    from the previous steps' dv (see solvers.mpcg.MPCGStepper);
+    other methods go through solvers.api.solve(). A step whose
+    solve does not converge (max_iter reached, or a breakdown, e.g.
+    when A is not positive definite) is solved again with the
+    fallback method and a RuntimeWarning, or raises RuntimeError
+    without changing the state.
+    """
+
+    def __init__(self, model, dt=2e-2, method="mpcg", rtol=1e-10, x_0=None, v_0=None,
+                 pattern_cache_dir=None, fallback="cholesky", **solver_opts) -> None:
+        r"""
+        Constructor for Simulator
+
+        :param model: ClothModel
+        :param dt: time step h
+        :param method: "mpcg" or a method of solvers.api.SOLVERS
+        :param rtol: relative tolerance of the solves
+        :param x_0: initial positions of shape (n, 3); the rest
+            positions by default
+        :param v_0: initial velocities of shape (n, 3); zero by default
+        :param pattern_cache_dir: optional directory where the
+            sparsity patterns are cached across runs
+        :param fallback: method of solvers.api.SOLVERS solving the
+            steps whose solve did not converge, or None to raise
+            RuntimeError on them
+        :param solver_opts: passed on to the solver, e.g.
+            preconditioner="ic0"
+        """
+        self._model = model
+        self._dt = dt
+        self._method = method
+        self._rtol = rtol
+        self._solver_opts = solver_opts
+        self._x = np.array(model.rest_positions if x_0 is None else x_0, dtype=np.float64)
+        self._v = np.zeros_like(self._x) if v_0 is None else np.array(v_0, dtype=np.float64)
+        self._t = 0.0
+        self._num_steps = 0
+        self._stats = None
+        self._fallback = fallback
+        self._num_fallbacks = 0
+        self._S, self._z = model.constraints()
+        self._pattern = BlockPattern.from_topology(model.num_particles,
+                                                   (model.faces, model.hinges),
+                                                   cache_dir=pattern_cache_dir)
+        self._A = self._pattern.allocate()
+        self._stepper = MPCGStepper(preconditioner=solver_opts.pop("preconditioner", None)) \
+            if method == "mpcg" else None
+
+    @property
+    def model(self):
+        r"""
+        Getter for the ClothModel
+        """
+        return self._model
+
+    @property
+    def stepper(self):
+        r"""
+        Getter for the MPCGStepper warm-starting the MPCG solves;
+        None for other methods
+        """
+        return self._stepper
+
+    @property
+    def dt(self):
+        r"""
+        Getter for the time step
+        """
+        return self._dt
+
+    @property
+    def x(self):
+        r"""
+        Getter for the current positions, shape (n, 3)
+        """
+        return self._x
+
+    @property
+    def v(self):
+        r"""
+        Getter for the current velocities, shape (n, 3)
+        """
+        return self._v
+
+    @property
+    def t(self):
+        r"""
+        Getter for the current time
+        """
+        return self._t
+
+    @property
+    def num_steps(self):
+        r"""
+        Number of steps taken
+        """
+        return self._num_steps
+
+    @property
+    def num_fallbacks(self):
+        r"""
+        Number of steps solved again with the fallback method
+        """
+        return self._num_fallbacks
+
+    @property
+    def pattern(self):
+        r"""
+        Getter for the BlockPattern of A
+        """
+        return self._pattern
+
+    @property
+    def stats(self):
+        r"""
+        SolveStats of the last step's linear solve
+        """
+        return self._stats
+
+    def forces(self, x, t):
+        r"""
+        Compute the total forces at positions x and time t.
+
+        :param x: positions of shape (n, 3)
+        :param t: time
+
+        Return:
+        forces of shape (n, 3)
+        """
+        with jax.enable_x64(True):
+            f = np.asarray(jit_internal_forces(self._model, x))
+        return f + self._model.external_force(t)
+
+    def force_jacobian(self, x):
+        r"""
+        Compute df/dx at positions x, as used in the steps: with
+        each element's block projected to negative semidefinite.
+
+        :param x: positions of shape (n, 3)
+
+        Return:
+        BSR matrix of shape (3n, 3n)
+        """
+        with jax.enable_x64(True):
+            face_blocks, hinge_blocks = jit_element_force_jacobians(self._model, x)
+        return self._pattern.assemble((face_blocks, hinge_blocks))
+
+    def system(self):
+        r"""
+        Build the linear system of the next step. A is assembled in
+        place into the same matrix at every step; copy it to keep it.
+
+        Return:
+        A as a BSR matrix of shape (3n, 3n), b of shape (3n, )
+        """
+        h = self._dt
+        with jax.enable_x64(True):
+            face_blocks, hinge_blocks = jit_element_force_jacobians(self._model, self._x)
+        # A = M - h^2 df/dx
+        A = self._pattern.assemble((-h**2 * np.asarray(face_blocks),
+                                    -h**2 * np.asarray(hinge_blocks)),
+                                   diagonal=self._model.mass, out=self._A)
+        # b = h (f + h df/dx v), with h^2 df/dx v = (M - A) v
+        f = np.ravel(self.forces(self._x, self._t))
+        v = np.ravel(self._v)
+        b = h * f + (np.repeat(self._model.mass, 3) * v - A @ v)
+        return A, b
+
+    def step(self):
+        r"""
+        Advance the simulation by one time step.
+
+        Return:
+        dv of shape (n, 3)
+        """
+        A, b = self.system()
+        if self._stepper is not None:
+            dv = self._stepper.solve(A, b, self._S, self._z, rtol=self._rtol,
+                                     **self._solver_opts)
+            self._stats = self._stepper.solver.stats
+        else:
+            result = solve(LinearSystem(A, b, self._S, self._z), method=self._method,
+                           rtol=self._rtol, **self._solver_opts)
+            dv, self._stats = result.x, result.stats
+        if not self._stats.converged:
+            message = (f"step {self._num_steps + 1}: the {self._method} solve stopped with "
+                       f"{self._stats.termination} after {self._stats.num_iterations} iterations")
+            if self._fallback is None or self._fallback == self._method:
+                raise RuntimeError(message)
+            warnings.warn(f"{message}; solving it with {self._fallback}", RuntimeWarning)
+            result = solve(LinearSystem(A, b, self._S, self._z), method=self._fallback,
+                           rtol=self._rtol)
+            if not result.converged:
+                raise RuntimeError(f"{message}, and so did the {self._fallback} solve")
+            dv, self._stats = result.x, result.stats
+            if self._stepper is not None:
+                # warm-start the next step from the fallback solution
+                self._stepper.replace_last(dv)
+            self._num_fallbacks += 1
+        dv = np.reshape(dv, self._x.shape)
+        # v_(k+1) = v_k + dv, x_(k+1) = x_k + h v_(k+1)
+        self._v += dv
+        self._x += self._dt * self._v
+        self._t += self._dt
+        self._num_steps += 1
+        return dv
+
+    def run(self, num_steps, callback=None):
+        r"""
+        Take num_steps steps.
+
+        :param num_steps: number of steps
+        :param callback: optional function callback(simulator),
+            called after every step
+
+        Return:
+        - times of shape (num_steps + 1, );
+        - positions of shape (num_steps + 1, n, 3), starting with
+        the current ones
+        """
+        times = [self._t]
+        positions = [self._x.copy()]
+        for _ in range(num_steps):
+            self.step()
+            times.append(self._t)
+            positions.append(self._x.copy())
+            if callback is not None:
+                callback(self)
+        return np.array(times), np.stack(positions)
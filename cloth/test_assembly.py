@@ -0,0 +1,135 @@
+import jax
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from cloth.assembly import PATTERN_CACHE_SIZE, BlockPattern, topology_key
+from cloth.model import ClothModel
+from cloth.simulator import Simulator
+from cloth.simulator import jit_element_force_jacobians as element_force_jacobians
+from cloth.simulator import jit_force_jacobian as force_jacobian
+
+def test_block_pattern_sums_element_blocks():
+    r"""
+    case: overlapping elements of different sizes are summed into
+    the right blocks; the diagonal is stored even for a particle in
+    no element
+    """
+    rng = np.random.default_rng(0)
+    elements = (np.array([[0, 1, 2], [2, 1, 3]]), np.array([[1, 2, 0, 3]]))
+    pattern = BlockPattern(5, elements)
+    blocks = (rng.standard_normal((2, 9, 9)), rng.standard_normal((1, 12, 12)))
+    A = pattern.assemble(blocks, diagonal=np.arange(5.0))
+    A_ref = np.diag(np.repeat(np.arange(5.0), 3))
+    for element_array, element_blocks in zip(elements, blocks):
+        for element, block in zip(element_array, element_blocks):
+            dofs = np.ravel(3*element[:, None] + np.arange(3))
+            A_ref[np.ix_(dofs, dofs)] += block
+    assert sp.isspmatrix_bsr(A) and A.blocksize == (3, 3) and A.has_sorted_indices
+    assert np.allclose(A.toarray(), A_ref)
+    # (4, 4) and the 4 x 4 coupled blocks of particles 0..3
+    assert pattern.num_blocks == 17
+    assert np.array_equal(pattern.indices[pattern.indptr[4]:], [4])
+
+def test_element_jacobians_match_dense_jacobian():
+    r"""
+    case: the assembled exact per-element Jacobian equals the dense
+    Hessian, and the simulator's sparse A and b are built from its
+    projected Jacobian
+    """
+    model = ClothModel.rectangle(1.0, 1.0, 3, 2, k_stretch=3.0, k_shear=2.0, k_bend=5.0)
+    x = model.rest_positions + 0.05*np.random.default_rng(1).standard_normal(
+        model.rest_positions.shape)
+    with jax.enable_x64(True):
+        face_blocks, hinge_blocks = element_force_jacobians(model, x, project=False)
+        J = np.asarray(force_jacobian(model, x))
+    assert face_blocks.shape == (model.num_faces, 9, 9)
+    assert hinge_blocks.shape == (model.num_hinges, 12, 12)
+    v = np.random.default_rng(2).standard_normal(x.shape)
+    simulator = Simulator(model, dt=0.1, x_0=x, v_0=v)
+    J_exact = simulator.pattern.assemble((face_blocks, hinge_blocks))
+    assert np.allclose(J_exact.toarray(), J, atol=1e-10)
+    J_step = simulator.force_jacobian(x).toarray()
+    assert np.allclose(J_step, np.transpose(J_step))
+    A, b = simulator.system()
+    assert np.allclose(A.toarray(), np.diag(np.repeat(model.mass, 3)) - 0.01*J_step, atol=1e-12)
+    f = np.ravel(simulator.forces(x, 0.0))
+    assert np.allclose(b, 0.1*(f + 0.1*J_step @ np.ravel(v)), atol=1e-12)
+
+def test_compressed_cloth_keeps_A_positive_definite():
+    r"""
+    case: on a compressed and crumpled cloth with a large time step,
+    M - h^2 df/dx is indefinite with the exact Jacobian and positive
+    definite with the projected element blocks
+    """
+    model = ClothModel.rectangle(1.0, 1.0, 3, 3, k_stretch=50.0, k_shear=50.0, k_bend=5.0)
+    rng = np.random.default_rng(4)
+    x = 0.6*model.rest_positions + 0.05*rng.standard_normal(model.rest_positions.shape)
+    simulator = Simulator(model, dt=0.5, x_0=x)
+    M = np.diag(np.repeat(model.mass, 3))
+    with jax.enable_x64(True):
+        J_exact = simulator.pattern.assemble(element_force_jacobians(model, x, project=False))
+        face_blocks, hinge_blocks = element_force_jacobians(model, x)
+    assert np.min(np.linalg.eigvalsh(M - 0.25*J_exact.toarray())) < 0
+    # every projected element block is negative semidefinite
+    for blocks in (face_blocks, hinge_blocks):
+        assert np.max(np.linalg.eigvalsh(np.asarray(blocks))) < 1e-10
+    A, _ = simulator.system()
+    assert np.min(np.linalg.eigvalsh(A.toarray())) > 0
+    simulator.step()
+    assert simulator.stats.converged and simulator.num_fallbacks == 0
+
+def test_pattern_cache(tmp_path):
+    r"""
+    case: patterns are shared per topology in memory, and a pattern
+    loaded from the disk cache assembles the same matrix in place
+    """
+    model = ClothModel.rectangle(1.0, 1.0, 3, 3)
+    elements = (model.faces, model.hinges)
+    key = topology_key(model.num_particles, elements)
+    assert key == topology_key(model.num_particles, (model.faces.copy(), model.hinges.copy()))
+    assert key != topology_key(model.num_particles, (model.faces[::-1], model.hinges))
+    pattern = BlockPattern.from_topology(model.num_particles, elements, cache_dir=tmp_path)
+    assert BlockPattern.from_topology(model.num_particles, elements) is pattern
+    assert (tmp_path / f"{key}.npz").exists()
+    loaded = BlockPattern.load(tmp_path / f"{key}.npz")
+    rng = np.random.default_rng(3)
+    blocks = (rng.standard_normal((model.num_faces, 9, 9)),
+              rng.standard_normal((model.num_hinges, 12, 12)))
+    A = pattern.assemble(blocks, diagonal=2.0)
+    A_out = loaded.allocate()
+    data = A_out.data
+    assert loaded.assemble(blocks, diagonal=2.0, out=A_out) is A_out
+    assert A_out.data is data
+    assert np.array_equal(A_out.indptr, A.indptr) and np.array_equal(A_out.indices, A.indices)
+    assert np.allclose(A_out.toarray(), A.toarray())
+    # scattering into a copy would lose the values
+    A_strided = loaded.allocate()
+    A_strided.data = np.zeros((loaded.num_blocks, 3, 6))[:, :, ::2]
+    with pytest.raises(ValueError):
+        loaded.assemble(blocks, out=A_strided)
+
+def test_pattern_cache_is_bounded():
+    r"""
+    case: only the last PATTERN_CACHE_SIZE topologies used stay in
+    memory
+    """
+    chains = [(np.stack([np.arange(n - 1), np.arange(1, n)], axis=1), )
+              for n in range(3, PATTERN_CACHE_SIZE + 4)]
+    first = BlockPattern.from_topology(3, chains[0])
+    second = BlockPattern.from_topology(4, chains[1])
+    for elements in chains[2:]:
+        # keep the first topology in use
+        assert BlockPattern.from_topology(3, chains[0]) is first
+        BlockPattern.from_topology(elements[0].shape[0] + 1, elements)
+    assert BlockPattern.from_topology(3, chains[0]) is first
+    assert BlockPattern.from_topology(4, chains[1]) is not second
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_block_pattern_sums_element_blocks()
+    test_element_jacobians_match_dense_jacobian()
+    test_compressed_cloth_keeps_A_positive_definite()
+    with tempfile.TemporaryDirectory() as directory:
+        test_pattern_cache(pathlib.Path(directory))
+    test_pattern_cache_is_bounded()
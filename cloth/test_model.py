@@ -0,0 +1,101 @@
+import jax
+import numpy as np
+import pytest
+from cloth.energies import e_bend, e_shear, e_stretch, total_energy
+from cloth.model import ClothModel
+from cloth.simulator import jit_force_jacobian as force_jacobian
+from cloth.simulator import jit_internal_forces as internal_forces
+
+@pytest.fixture(autouse=True)
+def enable_x64():
+    r"""
+    Run the tests with 64-bit JAX types.
+    """
+    with jax.enable_x64(True):
+        yield
+
+def perturbed_positions(model, seed=0, scale=0.1):
+    r"""
+    Rest positions plus a random perturbation.
+    """
+    rng = np.random.default_rng(seed)
+    return model.rest_positions + scale*rng.standard_normal(model.rest_positions.shape)
+
+def test_rectangle_matches_notebook_setup():
+    r"""
+    case: the N x N rectangle has the (u, v), areas, hinges and
+    pinned corners of sim.ipynb
+    """
+    N = 4
+    model = ClothModel.rectangle(1.5, 1.5, N, N)
+    assert model.num_particles == (N + 1)**2
+    assert model.num_faces == 2*N**2
+    assert model.num_hinges == 3*N**2 - 2*N
+    # u = floor(index / (N + 1)), v = index % (N + 1)
+    indices = np.arange(model.num_particles)
+    assert np.allclose(model.uv[:, 0], indices // (N + 1))
+    assert np.allclose(model.uv[:, 1], indices % (N + 1))
+    assert np.allclose(model.area, 0.5)
+    assert model.uv_rest_lengths == (1.5/N, 1.5/N)
+    assert sorted(model.pinned) == [0, 4, 20, 24]
+    S, z = model.constraints()
+    assert len(S[4]) == 3 and len(S[5]) == 0 and np.all(z == 0)
+
+def test_energies_match_notebook_formulas():
+    r"""
+    case: on a perturbed cloth, the energies equal the per-face
+    formulas of sim.ipynb
+    """
+    model = ClothModel.rectangle(1.5, 1.5, 3, 3, k_stretch=3.0, k_shear=5.0, k_bend=7.0)
+    x = perturbed_positions(model)
+    b_u, b_v = model.uv_rest_lengths
+    stretch = []
+    shear = []
+    for face_index, face in enumerate(model.faces):
+        del_uv = np.array([model.del_u[face_index], model.del_v[face_index]])
+        dx = np.transpose([x[face[1]] - x[face[0]], x[face[2]] - x[face[0]]])
+        assert np.allclose(model.del_uv_inverse[face_index] @ del_uv, np.eye(2))
+        deform = dx @ np.linalg.inv(del_uv)
+        area = model.area[face_index]
+        C_st = area*np.array([np.linalg.norm(deform[:, 0]) - b_u,
+                              np.linalg.norm(deform[:, 1]) - b_v])
+        stretch.append(0.5*3.0*C_st @ C_st)
+        shear.append(0.5*5.0*(area*deform[:, 0] @ deform[:, 1])**2)
+    normals = np.cross(x[model.faces[:, 1]] - x[model.faces[:, 0]],
+                       x[model.faces[:, 2]] - x[model.faces[:, 0]])
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    bend = [0.5*7.0*np.arccos(normals[a] @ normals[b])**2 for a, b in model.hinge_faces]
+    assert np.allclose(e_stretch(model, x), stretch, rtol=1e-10)
+    assert np.allclose(e_shear(model, x), shear, rtol=1e-10)
+    assert np.allclose(e_bend(model, x), bend, rtol=1e-8)
+    assert np.isclose(total_energy(model, np.ravel(x)),
+                      np.sum(stretch) + np.sum(shear) + np.sum(bend), rtol=1e-10)
+
+def test_rest_state_and_derivatives():
+    r"""
+    case: no internal forces at rest; the force Jacobian is
+    symmetric, negative semi-definite at rest, and matches finite
+    differences of the forces
+    """
+    model = ClothModel.rectangle(1.0, 1.0, 2, 2)
+    x_rest = model.rest_positions
+    assert np.max(np.abs(internal_forces(model, x_rest))) < 1e-12
+    J = np.asarray(force_jacobian(model, x_rest))
+    assert np.allclose(J, np.transpose(J))
+    assert np.max(np.linalg.eigvalsh(J)) < 1e-10
+    # bending is stiff even when flat
+    assert np.linalg.norm(np.asarray(force_jacobian(
+        ClothModel.rectangle(1.0, 1.0, 2, 2, k_stretch=0.0, k_shear=0.0), x_rest))) > 0
+    x = perturbed_positions(model, scale=0.05)
+    J = np.asarray(force_jacobian(model, x))
+    step = np.zeros_like(x)
+    step[4, 2] = 1e-6
+    difference = (np.asarray(internal_forces(model, x + step))
+                  - np.asarray(internal_forces(model, x - step))) / 2e-6
+    assert np.allclose(np.ravel(difference), J[:, 3*4 + 2], atol=1e-6)
+
+if __name__ == "__main__":
+    with jax.enable_x64(True):
+        test_rectangle_matches_notebook_setup()
+        test_energies_match_notebook_formulas()
+        test_rest_state_and_derivatives()
@@ -0,0 +1,88 @@
+import json
+import numpy as np
+import pytest
+from cloth.__main__ import main
+from cloth.model import ClothModel
+from cloth.scene import DEFAULT_SCENE, build_model, merge_scene
+from cloth.simulator import Simulator
+
+def test_step_and_run():
+    r"""
+    case: a force at the center pulls the cloth down while the
+    pinned corners stay in place; MPCG and Cholesky agree
+    """
+    model = build_model(merge_scene({"cloth": {"Nx": 2, "Ny": 2}}))
+    simulator = Simulator(model, dt=2e-2)
+    times, positions = simulator.run(5)
+    assert np.allclose(times, 2e-2*np.arange(6))
+    assert positions.shape == (6, 9, 3)
+    assert simulator.num_steps == 5 and simulator.stats.converged
+    # the center particle moves down, the corners do not move
+    assert positions[-1, 4, 2] < -1e-3
+    assert np.array_equal(positions[-1, model.pinned], model.rest_positions[model.pinned])
+    direct_simulator = Simulator(model, dt=2e-2, method="cholesky")
+    _, direct_positions = direct_simulator.run(5)
+    assert np.allclose(direct_positions, positions, atol=1e-8)
+
+def test_gravity_scene():
+    r"""
+    case: under gravity with the top corners pinned, every free
+    particle falls; the constraint list follows the pinned set
+    """
+    model = ClothModel.rectangle(1.0, 1.0, 2, 2, pinned="top", gravity=(0.0, 0.0, -9.8))
+    assert np.allclose(model.external_force(0.0)[:, 2], -9.8*0.2)
+    simulator = Simulator(model, dt=1e-2)
+    simulator.run(2)
+    free = np.setdiff1d(np.arange(9), model.pinned)
+    assert np.all(simulator.x[free, 2] < 0)
+    assert np.all(simulator.x[model.pinned, 2] == 0)
+
+def test_unconverged_solves_are_reported():
+    r"""
+    case: with max_iter=1 MPCG stops early; the step is solved with
+    Cholesky and a warning, or raises without moving the cloth
+    """
+    model = build_model(merge_scene({"cloth": {"Nx": 2, "Ny": 2}}))
+    simulator = Simulator(model, dt=2e-2, max_iter=1)
+    with pytest.warns(RuntimeWarning, match="max_iter"):
+        simulator.step()
+    assert simulator.num_fallbacks == 1 and simulator.stats.converged
+    reference = Simulator(model, dt=2e-2, method="cholesky")
+    reference.step()
+    assert np.allclose(simulator.x, reference.x, atol=1e-10)
+    # the next step starts from the fallback solution, not the failed one
+    dv_reference = np.reshape(reference.v, (-1, 1)).copy()
+    assert len(simulator.stepper.history) == 1
+    assert np.allclose(simulator.stepper.guess(), dv_reference, atol=1e-10)
+    with pytest.warns(RuntimeWarning, match="max_iter"):
+        simulator.step()
+    reference.step()
+    assert np.allclose(simulator.stepper.history[-1], np.reshape(reference.v, (-1, 1)) - dv_reference,
+                       atol=1e-10)
+    strict_simulator = Simulator(model, dt=2e-2, max_iter=1, fallback=None)
+    with pytest.raises(RuntimeError, match="max_iter"):
+        strict_simulator.step()
+    assert strict_simulator.num_steps == 0
+    assert np.array_equal(strict_simulator.x, model.rest_positions)
+
+def test_command_line(tmp_path, capsys):
+    r"""
+    case: python -m cloth runs a scene file and saves the trajectory
+    """
+    scene_path = tmp_path / "scene.json"
+    scene_path.write_text(json.dumps({"cloth": {"Nx": 2, "Ny": 2}, "num_steps": 3}))
+    output_path = tmp_path / "run.npz"
+    assert main([str(scene_path), "--steps", "2", "--output", str(output_path),
+                 "--pattern-cache", str(tmp_path / "patterns")]) == 0
+    assert "step     2" in capsys.readouterr().out
+    run = np.load(output_path)
+    assert run["positions"].shape == (3, 9, 3)
+    assert len(list((tmp_path / "patterns").glob("*.npz"))) == 1
+    assert np.array_equal(run["faces"], build_model(merge_scene({"cloth": {"Nx": 2, "Ny": 2}})).faces)
+    # the defaults are those of the notebook
+    assert DEFAULT_SCENE["cloth"]["Nx"] == 4 and DEFAULT_SCENE["dt"] == 2e-2
+
+if __name__ == "__main__":
+    test_step_and_run()
+    test_gravity_scene()
+    test_unconverged_solves_are_reported()
@@ -0,0 +1,74 @@
+import pathlib
+import numpy as np
+import pytest
+import dhutils.dhutils as dhu
+from cloth.model import ClothModel
+from cloth.topology import MeshTopology
+
+def test_two_faces():
+    r"""
+    case: two faces sharing edge (1, 2); the other edges are on the
+    boundary, directed as in their face
+    """
+    topology = MeshTopology(np.array([[0, 1, 2], [2, 1, 3]]))
+    assert np.array_equal(topology.hinges, [[1, 2, 0, 3]])
+    assert np.array_equal(topology.hinge_faces, [[0, 1]])
+    assert np.array_equal(topology.edges, [[0, 1], [0, 2], [1, 2], [1, 3], [2, 3]])
+    assert np.array_equal(topology.edges[topology.hinge_edges], [[1, 2]])
+    assert sorted(map(tuple, topology.boundary_edges)) == [(0, 1), (1, 3), (2, 0), (3, 2)]
+    # half-edges 1 (1 -> 2 in face 0) and 3 (2 -> 1 in face 1) are twins
+    assert np.array_equal(topology.twins, [-1, 3, -1, 1, -1, -1])
+    assert np.array_equal(topology.vertex_faces(1), [0, 1])
+    assert np.array_equal(topology.vertex_faces(3), [1])
+
+def test_grid_matches_brute_force():
+    r"""
+    case: on a shuffled rectangle, the maps agree with scans over
+    all faces, and the hinges are those of sim.ipynb's square grid
+    """
+    N = 5
+    positions, faces = dhu.standard_rectangle(1.0, 1.0, N, N)
+    num_vertices = positions.shape[0]
+    rng = np.random.default_rng(0)
+    faces = rng.permutation(num_vertices)[faces[rng.permutation(faces.shape[0])]]
+    topology = MeshTopology(faces, num_vertices)
+    assert topology.num_edges == 3*N**2 + 2*N and topology.is_manifold
+    assert topology.hinges.shape == (3*N**2 - 2*N, 4)
+    assert topology.boundary_edges.shape == (4*N, 2)
+    for vertex in range(num_vertices):
+        assert np.array_equal(topology.vertex_faces(vertex),
+                              np.flatnonzero(np.any(faces == vertex, axis=1)))
+    for (e0, e1, a, b), (face_a, face_b) in zip(topology.hinges, topology.hinge_faces):
+        # (e0, e1, a) is face a and (e1, e0, b) is face b, up to rotation
+        assert any(np.array_equal(np.roll(faces[face_a], shift), [e0, e1, a]) for shift in range(3))
+        assert any(np.array_equal(np.roll(faces[face_b], shift), [e1, e0, b]) for shift in range(3))
+    half_edges = np.arange(3*topology.num_faces)
+    interior = topology.twins >= 0
+    assert np.array_equal(topology.twins[topology.twins[interior]], half_edges[interior])
+
+def test_non_manifold_edge():
+    r"""
+    case: an edge with three faces is neither a hinge nor a boundary
+    """
+    topology = MeshTopology(np.array([[0, 1, 2], [1, 0, 3], [0, 1, 4]]))
+    assert not topology.is_manifold
+    assert topology.hinges.shape == (0, 4)
+    assert topology.boundary_edges.shape == (6, 2)
+    assert np.all(topology.twins == -1)
+
+def test_square_glb():
+    r"""
+    case: the bundled square.glb is a 4 x 4 grid, flat and at rest
+    """
+    pytest.importorskip("gltflib")
+    model = ClothModel.from_gltf(pathlib.Path(__file__).parent.parent / "square.glb")
+    topology = model.topology
+    assert model.num_particles == 25 and model.num_faces == 32
+    assert topology.hinges.shape == (40, 4) and topology.boundary_edges.shape == (16, 2)
+    assert np.all(model.area > 0)
+
+if __name__ == "__main__":
+    test_two_faces()
+    test_grid_matches_brute_force()
+    test_non_manifold_edge()
+    test_square_glb()
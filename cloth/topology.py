@@ -0,0 +1,214 @@
+import numpy as np
+import dhutils.dhutils.gltf_parsing_helper_functions as gltf_parsing
+
+class MeshTopology:
+    r"""
+    Connectivity of a triangle mesh: its edges, the faces around
+    each edge and each vertex, the boundary edges, and the hinges
+    (pairs of faces sharing an edge) of the bending energy.
+
+    Face f has the half-edges 3f + c, c = 0, 1, 2, going from
+    faces[f, c] to faces[f, (c + 1) % 3]. Edges are the half-edges
+    grouped by their unordered vertex pair, found by sorting the
+    pair keys of all half-edges at once; every map is built with a
+    few vectorized passes over the 3F half-edges, whatever the mesh.
+    An edge with one half-edge is on the boundary, with two it is
+    the shared edge of a hinge, and with more it is non-manifold
+    and gets no hinge.
+    """
+
+    def __init__(self, faces, num_vertices=None) -> None:
+        r"""
+        Constructor for MeshTopology
+
+        :param faces: faces of shape (F, 3), consistently oriented
+            for the hinges to be usable by the bending energy
+        :param num_vertices: number of vertices; max(faces) + 1 by
+            default
+        """
+        self._faces = np.array(faces, dtype=np.int64).reshape(-1, 3)
+        if num_vertices is None:
+            num_vertices = int(np.max(self._faces)) + 1 if self._faces.size > 0 else 0
+        self._num_vertices = num_vertices
+        # origin, destination and opposite vertex of every half-edge
+        origins = np.ravel(self._faces)
+        destinations = np.ravel(self._faces[:, [1, 2, 0]])
+        opposites = np.ravel(self._faces[:, [2, 0, 1]])
+        keys = np.minimum(origins, destinations)*num_vertices + np.maximum(origins, destinations)
+        edge_keys, half_edge_edges, counts = np.unique(keys, return_inverse=True,
+                                                       return_counts=True)
+        self._edges = np.stack([edge_keys // num_vertices, edge_keys % num_vertices], axis=1)
+        self._face_edges = np.reshape(half_edge_edges, (-1, 3))
+        self._edge_face_counts = counts
+        # half-edges grouped by edge, in face order within an edge
+        edge_half_edges = np.argsort(half_edge_edges, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        boundary = starts[counts == 1]
+        self._boundary_edges = np.stack([origins[edge_half_edges[boundary]],
+                                         destinations[edge_half_edges[boundary]]], axis=1)
+        interior = starts[counts == 2]
+        half_edges_a = edge_half_edges[interior]
+        half_edges_b = edge_half_edges[interior + 1]
+        self._twins = np.full(origins.shape[0], -1, dtype=np.int64)
+        self._twins[half_edges_a] = half_edges_b
+        self._twins[half_edges_b] = half_edges_a
+        # shared edge as seen from face a, then the opposite vertices
+        self._hinges = np.stack([origins[half_edges_a], destinations[half_edges_a],
+                                 opposites[half_edges_a], opposites[half_edges_b]], axis=1)
+        self._hinge_faces = np.stack([half_edges_a // 3, half_edges_b // 3], axis=1)
+        self._hinge_edges = half_edge_edges[half_edges_a]
+        # vertex -> faces in CSR form
+        corners = np.argsort(origins, kind="stable")
+        self._vertex_face_indices = corners // 3
+        self._vertex_face_indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+        np.cumsum(np.bincount(origins, minlength=num_vertices), out=self._vertex_face_indptr[1:])
+
+    @property
+    def faces(self):
+        r"""
+        Getter for the faces, shape (F, 3)
+        """
+        return self._faces
+
+    @property
+    def num_vertices(self):
+        r"""
+        Number of vertices
+        """
+        return self._num_vertices
+
+    @property
+    def num_faces(self):
+        r"""
+        Number of faces F
+        """
+        return self._faces.shape[0]
+
+    @property
+    def num_edges(self):
+        r"""
+        Number of edges
+        """
+        return self._edges.shape[0]
+
+    @property
+    def edges(self):
+        r"""
+        Getter for the edges, shape (E, 2), each as (lower vertex,
+        higher vertex), sorted
+        """
+        return self._edges
+
+    @property
+    def face_edges(self):
+        r"""
+        Getter for the edge of every half-edge, shape (F, 3); entry
+        (f, c) is the edge from faces[f, c] to faces[f, (c + 1) % 3]
+        """
+        return self._face_edges
+
+    @property
+    def edge_face_counts(self):
+        r"""
+        Getter for the number of faces around each edge, shape (E, )
+        """
+        return self._edge_face_counts
+
+    @property
+    def twins(self):
+        r"""
+        Getter for the opposite half-edge of every half-edge 3f + c,
+        shape (3F, ); -1 on the boundary and on non-manifold edges
+        """
+        return self._twins
+
+    @property
+    def boundary_edges(self):
+        r"""
+        Getter for the boundary edges, shape (B, 2), directed as in
+        their face
+        """
+        return self._boundary_edges
+
+    @property
+    def is_manifold(self):
+        r"""
+        True if no edge has more than two faces
+        """
+        return bool(np.all(self._edge_face_counts <= 2))
+
+    @property
+    def hinges(self):
+        r"""
+        Getter for the hinges, shape (H, 4): the shared edge (e0, e1)
+        as directed in the first face, then the opposite vertex of
+        each face
+        """
+        return self._hinges
+
+    @property
+    def hinge_faces(self):
+        r"""
+        Getter for the two faces of every hinge, shape (H, 2)
+        """
+        return self._hinge_faces
+
+    @property
+    def hinge_edges(self):
+        r"""
+        Getter for the shared edge of every hinge, shape (H, )
+        """
+        return self._hinge_edges
+
+    @property
+    def vertex_face_indptr(self):
+        r"""
+        Getter for the CSR index pointer of the vertex -> face map,
+        shape (num_vertices + 1, )
+        """
+        return self._vertex_face_indptr
+
+    @property
+    def vertex_face_indices(self):
+        r"""
+        Getter for the CSR face indices of the vertex -> face map,
+        shape (3F, )
+        """
+        return self._vertex_face_indices
+
+    def vertex_faces(self, vertex):
+        r"""
+        Faces around a vertex.
+
+        :param vertex: vertex index
+
+        Return:
+        face indices, increasing
+        """
+        return self._vertex_face_indices[
+            self._vertex_face_indptr[vertex]:self._vertex_face_indptr[vertex + 1]]
+
+def load_gltf_mesh(path):
+    r"""
+    Load the vertex positions and faces of the first mesh of a glTF
+    file, with dhutils' glTF parsing helpers. Unlike
+    dhutils.load_glTF, it needs no pythreejs, but gltflib is
+    required.
+
+    :param path: .glb or .gltf file
+
+    Return:
+    positions of shape (n, 3), faces of shape (F, 3)
+    """
+    if gltf_parsing.GLTF is None:
+        raise ImportError("loading glTF files requires gltflib")
+    gltf, bin_data = gltf_parsing.load_gltf_and_bin(str(path))
+    accessors, bufferViews, _buffers = gltf_parsing.get_accessors_bufferViews_buffers(gltf)
+    mesh, _skin = gltf_parsing.get_mesh_and_skin_nodes(gltf)
+    accessor_ids = gltf_parsing.get_mesh_attributes_accessor_ids(mesh)
+    positions = gltf_parsing.get_data_from_accessor(
+        accessors[accessor_ids["position_accessor_id"]], bin_data, bufferViews)
+    faces = gltf_parsing.get_data_from_accessor(
+        accessors[accessor_ids["faces_accessor_id"]], bin_data, bufferViews)
+    return (np.array(positions, dtype=np.float64),
+            np.reshape(np.array(faces, dtype=np.int64), (-1, 3)))
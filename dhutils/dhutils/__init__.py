@@ -11,10 +11,19 @@ import math
 import numpy as np
 from pathlib import Path
 from scipy.spatial.transform import Rotation
-from IPython.display import display
-import ipywidgets
-import pythreejs as THREE
-from gltflib import GLTF
+try:
+    from IPython.display import display
+    import ipywidgets
+    import pythreejs as THREE
+except ImportError:
+    # the viewers need a Jupyter environment; mesh helpers such as
+    # standard_rectangle work without one
+    display = ipywidgets = THREE = None
+try:
+    from gltflib import GLTF
+except ImportError:
+    # glTF loading is unavailable without gltflib
+    GLTF = None
 from .gltf_parsing_helper_functions import *
 
 
@@ -233,7 +242,9 @@ def standard_rectangle(Lx, Ly, Nx, Ny):
             j += 1
 
     # faces (elements)
-    faces = np.zeros((Nx * Ny * 2, 3), dtype=np.uint16)
+    # uint16 indices unless there are too many vertices for them
+    index_dtype = np.uint16 if (Nx + 1) * (Ny + 1) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    faces = np.zeros((Nx * Ny * 2, 3), dtype=index_dtype)
     i = 0  # face index
     j = 0  # vertex index
     for jx in range(Nx):
@@ -11,7 +11,11 @@ Currently limited to reading geometry information
 import numpy as np
 import struct
 
-from gltflib import GLTF
+try:
+    from gltflib import GLTF
+except ImportError:
+    # load_gltf_and_bin needs gltflib
+    GLTF = None
 
 
 def get_format_char_byte_len(accessor):
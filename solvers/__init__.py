@@ -0,0 +1,11 @@
+from solvers.api import SOLVERS, LinearSystem, SolveResult, auto_method, rcm_ordering, solve
+from solvers.batched_mpcg import BatchedMPCGSolver
+from solvers.cg import CGSolver
+from solvers.direct import CholeskySolver
+from solvers.mixed_precision import MixedPrecisionMPCGSolver
+from solvers.mpcg import MPCGSolver, MPCGStepper
+from solvers.pipelined import PipelinedMPCGSolver
+from solvers.recycling import KrylovRecycler
+from solvers.reordering import ParticleOrdering
+from solvers.sd import SDSolver
+from solvers.stats import SolveStats
@@ -0,0 +1,386 @@
+r"""
+Common entry point to the linear solvers:
+
+    system = LinearSystem(A, b, S, z)
+    result = solve(system, method="auto", rtol=1e-8)
+    result.x, result.stats
+
+Every method takes the same rtol / atol / max_iter / x_0 options
+and returns a SolveResult; further keyword options are passed on to
+the solver's constructor (e.g. preconditioner="ic0" for MPCG,
+residual_replacement=10 for CG).
+"""
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator
+from solvers.cg import CGSolver
+from solvers.direct import CholeskySolver, pattern_key
+from solvers.mixed_precision import MixedPrecisionMPCGSolver
+from solvers.mpcg import MPCGSolver
+from solvers.pipelined import PipelinedMPCGSolver
+from solvers.reordering import ParticleOrdering
+from solvers.sd import SDSolver
+
+# "auto": dense A with at least this many rows and at most this
+# fraction of nonzeros is converted to BSR before solving
+AUTO_SPARSIFY_MIN_DOFS = 300
+AUTO_SPARSIFY_MAX_DENSITY = 0.1
+# "auto": sparse particle systems with at most this many rows are
+# solved by CholeskySolver
+AUTO_DIRECT_MAX_DOFS = 5000
+# number of sparsity patterns whose RCM ordering is kept by
+# rcm_ordering()
+RCM_CACHE_SIZE = 8
+
+_rcm_orderings = {}
+
+class LinearSystem:
+    r"""
+    Linear system A x = b, optionally with the kinematic
+    constraints of Baraff and Witkin, 98' on the 3D velocities of n
+    particles (x of shape (3n, )): S lists the prohibited directions
+    of each particle and z its constrained velocity.
+    """
+
+    def __init__(self, A, b, S=None, z=None) -> None:
+        r"""
+        Constructor for LinearSystem
+
+        :param A: matrix of shape (m, m); dense array, scipy sparse
+            matrix, scipy LinearOperator or a callable mapping v to
+            A*v
+        :param b: vector of shape (m, )
+        :param S: optional constraint list of length n = m/3, as for
+            MPCGSolver; None for no constraints
+        :param z: optional constrained velocities of shape (n, 3);
+            zero by default
+        """
+        self._A = A
+        self._b = np.ravel(np.asarray(b, dtype=np.float64))
+        self._S = S
+        self._z = None if z is None else np.asarray(z, dtype=np.float64)
+        if S is not None and 3*len(S) != self._b.shape[0]:
+            raise ValueError(
+                f"S has {len(S)} particles but b has {self._b.shape[0]} entries")
+
+    @property
+    def A(self):
+        r"""
+        Getter for A
+        """
+        return self._A
+
+    @property
+    def b(self):
+        r"""
+        Getter for b, shape (m, )
+        """
+        return self._b
+
+    @property
+    def num_dofs(self):
+        r"""
+        Number of unknowns m
+        """
+        return self._b.shape[0]
+
+    @property
+    def num_particles(self):
+        r"""
+        Number of particles n = m/3, or None if m is not a multiple
+        of 3
+        """
+        if self.num_dofs % 3 != 0:
+            return None
+        return self.num_dofs // 3
+
+    @property
+    def S(self):
+        r"""
+        Constraint list of length n; no constraints if none were given
+        """
+        if self._S is None and self.num_particles is not None:
+            return [()]*self.num_particles
+        return self._S
+
+    @property
+    def z(self):
+        r"""
+        Constrained velocities of shape (n, 3); zero if none were given
+        """
+        if self._z is None and self.num_particles is not None:
+            return np.zeros((self.num_particles, 3))
+        return self._z
+
+    @property
+    def num_constrained(self):
+        r"""
+        Number of particles with at least one constraint
+        """
+        if self._S is None:
+            return 0
+        return sum(1 for S_i in self._S if len(S_i) > 0)
+
+    def with_matrix(self, A):
+        r"""
+        Copy of the system with A replaced, e.g. by another storage
+        format of the same matrix.
+
+        :param A: new A, see constructor
+
+        Return:
+        LinearSystem
+        """
+        return LinearSystem(A, self._b, self._S, self._z)
+
+    def permuted(self, ordering):
+        r"""
+        Copy of the system with its particles renumbered.
+
+        :param ordering: solvers.reordering.ParticleOrdering
+
+        Return:
+        LinearSystem whose solution is ordering.permute_vector() of
+        the solution of this one
+        """
+        if self.is_matrix_free:
+            raise ValueError("a matrix-free A cannot be reordered")
+        return LinearSystem(
+            ordering.permute_matrix(self._A), ordering.permute_vector(self._b),
+            None if self._S is None else ordering.permute_constraints(self._S),
+            None if self._z is None else ordering.permute_particles(self._z))
+
+    @property
+    def is_sparse(self):
+        r"""
+        Whether A is a scipy sparse matrix
+        """
+        return sp.issparse(self._A)
+
+    @property
+    def is_matrix_free(self):
+        r"""
+        Whether A is only available through products with vectors
+        """
+        return isinstance(self._A, LinearOperator) or \
+            (callable(self._A) and not hasattr(self._A, "shape"))
+
+class SolveResult:
+    r"""
+    Result of solve(): the solution and the statistics of the solve.
+    """
+
+    def __init__(self, x, stats, method) -> None:
+        r"""
+        Constructor for SolveResult
+
+        :param x: solution of shape (m, 1)
+        :param stats: SolveStats of the solve
+        :param method: name of the method in SOLVERS that was used
+        """
+        self.x = x
+        self.stats = stats
+        self.method = method
+
+    @property
+    def converged(self):
+        r"""
+        Whether the solve reached the requested tolerance
+        """
+        return self.stats.converged
+
+    @property
+    def num_iterations(self):
+        r"""
+        Number of iterations taken
+        """
+        return self.stats.num_iterations
+
+    def __repr__(self) -> str:
+        return f"SolveResult(method={self.method!r}, stats={self.stats!r})"
+
+
+def _check_unconstrained(system, method):
+    r"""
+    Raise if the system has constraints, which method cannot enforce.
+    """
+    if system.num_constrained > 0:
+        raise ValueError(
+            f"method {method!r} does not support constraints; use 'mpcg'")
+
+def _as_operator(system):
+    r"""
+    A of system in a form usable with the @ operator.
+    """
+    if callable(system.A) and not hasattr(system.A, "shape"):
+        return LinearOperator((system.num_dofs, system.num_dofs), matvec=system.A)
+    return system.A
+
+def _solve_sd(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve an unconstrained system with SDSolver.
+    """
+    _check_unconstrained(system, "sd")
+    solver = SDSolver(_as_operator(system), system.b, max_iter, rtol=rtol, atol=atol,
+                      x_0_in=x_0, **opts)
+    x = solver.solve(history=False)
+    return SolveResult(x, solver.stats, "sd")
+
+def _solve_cg(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve an unconstrained system with CGSolver.
+    """
+    _check_unconstrained(system, "cg")
+    solver = CGSolver(_as_operator(system), system.b, max_iter, rtol=rtol, atol=atol,
+                      x_0_in=x_0, **opts)
+    x = solver.solve(history=False)
+    return SolveResult(x, solver.stats, "cg")
+
+def _solve_mpcg(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve a particle system with MPCGSolver.
+    """
+    with MPCGSolver(system.A, system.b, system.S, system.z, max_iter=max_iter,
+                    rtol=rtol, atol=atol, **opts) as solver:
+        x, stats = solver.solve(x_0, return_stats=True)
+    return SolveResult(x, stats, "mpcg")
+
+def _solve_mpcg_mixed(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve a particle system with MixedPrecisionMPCGSolver; max_iter
+    bounds each float32 solve.
+    """
+    solver = MixedPrecisionMPCGSolver(system.A, system.b, system.S, system.z, rtol=rtol,
+                                      atol=atol, inner_max_iter=max_iter, **opts)
+    x, stats = solver.solve(x_0, return_stats=True)
+    return SolveResult(x, stats, "mpcg_mixed")
+
+def _solve_mpcg_pipelined(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve a particle system with PipelinedMPCGSolver.
+    """
+    with PipelinedMPCGSolver(system.A, system.b, system.S, system.z, max_iter=max_iter,
+                             rtol=rtol, atol=atol, **opts) as solver:
+        x, stats = solver.solve(x_0, return_stats=True)
+    return SolveResult(x, stats, "mpcg_pipelined")
+
+def _solve_cholesky(system, rtol, atol, max_iter, x_0, **opts):
+    r"""
+    Solve a particle system with CholeskySolver; the tolerances,
+    max_iter and x_0 do not apply to a direct solve.
+    """
+    solver = CholeskySolver(system.A, system.b, system.S, system.z, **opts)
+    x, stats = solver.solve(return_stats=True)
+    return SolveResult(x, stats, "cholesky")
+
+SOLVERS = {
+    "sd": _solve_sd,
+    "cg": _solve_cg,
+    "mpcg": _solve_mpcg,
+    "mpcg_mixed": _solve_mpcg_mixed,
+    "mpcg_pipelined": _solve_mpcg_pipelined,
+    "cholesky": _solve_cholesky,
+}
+
+def auto_method(system):
+    r"""
+    Pick a method for system from its size, sparsity and number of
+    constrained particles:
+    - dense A with at least AUTO_SPARSIFY_MIN_DOFS rows and at most
+    AUTO_SPARSIFY_MAX_DENSITY nonzeros is converted to BSR first,
+    since its products then cost O(nnz) instead of O(m^2);
+    - sparse particle systems with at most AUTO_DIRECT_MAX_DOFS rows
+    go to Cholesky, constrained or not. On cloth systems it is as
+    fast as MPCG with the Jacobi preconditioner or faster up to
+    N = 32 (3267 unknowns) at rtol=1e-12; beyond that MPCG wins on
+    soft cloth and Cholesky on stiff cloth, and the factor's memory
+    grows as m^1.5 (see benchmarks/bench_scaling.py);
+    - other systems without constraints go to CG, which needs no
+    particle structure and does the least work per iteration;
+    - other systems with constrained particles go to MPCG with the
+    Jacobi preconditioner, the only iterative method enforcing them.
+
+    :param system: LinearSystem
+
+    Return:
+    - name of the method in SOLVERS;
+    - system to solve, possibly with A converted to BSR
+    """
+    if system.num_particles is not None and \
+            not (system.is_sparse or system.is_matrix_free) and \
+            system.num_dofs >= AUTO_SPARSIFY_MIN_DOFS:
+        A = np.asarray(system.A)
+        if np.count_nonzero(A) <= AUTO_SPARSIFY_MAX_DENSITY*A.size:
+            system = system.with_matrix(sp.bsr_matrix(A, blocksize=(3, 3)))
+    if system.num_particles is not None and system.is_sparse and \
+            system.num_dofs <= AUTO_DIRECT_MAX_DOFS:
+        return "cholesky", system
+    if system.num_constrained == 0:
+        return "cg", system
+    return "mpcg", system
+
+def rcm_ordering(A):
+    r"""
+    Reverse Cuthill-McKee ordering of the particles coupled by A.
+    For a BSR matrix with 3x3 blocks the ordering is cached by
+    sparsity pattern, so time steps of one mesh compute it once.
+
+    :param A: dense array or scipy sparse matrix of shape (3n, 3n)
+
+    Return:
+    ParticleOrdering
+    """
+    if not (sp.issparse(A) and A.format == "bsr" and A.blocksize == (3, 3)):
+        return ParticleOrdering.from_matrix(A)
+    key = pattern_key(A)
+    ordering = _rcm_orderings.pop(key, None)
+    if ordering is None:
+        ordering = ParticleOrdering.from_matrix(A)
+        if len(_rcm_orderings) >= RCM_CACHE_SIZE:
+            # drop the least recently used pattern
+            del _rcm_orderings[next(iter(_rcm_orderings))]
+    _rcm_orderings[key] = ordering
+    return ordering
+
+def solve(system, method="auto", rtol=1e-12, atol=0.0, max_iter=None, x_0=None,
+          reorder=None, **opts):
+    r"""
+    Solve a LinearSystem.
+
+    :param system: LinearSystem
+    :param method: "auto" or one of the names in SOLVERS
+    :param rtol: relative tolerance on the residual norm
+    :param atol: absolute tolerance on the residual norm
+    :param max_iter: max number of iterations; None for no limit
+    :param x_0: optional initial guess of shape (m, ); for MPCG its
+        constrained components are replaced as in
+        MPCGSolver.initial_guess()
+    :param reorder: None to solve in the given particle order, "rcm"
+        to renumber the particles by reverse Cuthill-McKee on the
+        sparsity of A first (see rcm_ordering()), or a
+        ParticleOrdering; the solution is returned in the original
+        order either way. A is permuted on every call; a simulation
+        gains more by assembling on particles renumbered once with
+        ParticleOrdering.from_faces()
+    :param opts: passed on to the solver's constructor
+
+    Return:
+    SolveResult
+    """
+    if reorder is not None:
+        if isinstance(reorder, ParticleOrdering):
+            ordering = reorder
+        elif reorder == "rcm":
+            ordering = rcm_ordering(system.A)
+        else:
+            raise ValueError(f"unknown reordering {reorder!r}; expected 'rcm' or a ParticleOrdering")
+        if x_0 is not None:
+            x_0 = ordering.permute_vector(np.ravel(x_0))
+        result = solve(system.permuted(ordering), method, rtol, atol, max_iter, x_0, **opts)
+        result.x = ordering.unpermute_vector(result.x)
+        return result
+    if method == "auto":
+        method, system = auto_method(system)
+    if method not in SOLVERS:
+        raise ValueError(f"unknown method {method!r}; expected 'auto' or one of {sorted(SOLVERS)}")
+    return SOLVERS[method](system, rtol, atol, max_iter, x_0, **opts)
@@ -0,0 +1,289 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.stats import BREAKDOWN, CONVERGED, MAX_ITER, SolveStats
+
+class BatchedMPCGSolver:
+    r"""
+    Solve a batch of B systems A_k x_k = b_k of the same size
+    with the MPCG method of Baraff and Witkin, 98', in lockstep.
+
+    All B systems are iterated together with vectorized products
+    and dot products, each with its own convergence test. Systems
+    that are done stop being updated, and once less than
+    compact_ratio of the working set is still active, the working
+    set is compacted so that they stop costing work as well.
+
+    The A_k are either stacked dense matrices, or sparse matrices
+    sharing one block sparsity pattern (e.g. identical garments in
+    different states); the preconditioner is Jacobi.
+    """
+
+    def __init__(self, A_in, b_in, S_in, z_in, max_iter=None, rtol=1e-12,
+                 atol=0.0, compact_ratio=0.75) -> None:
+        r"""
+        Constructor for BatchedMPCGSolver
+
+        :param A_in: either a dense array of shape (B, 3n, 3n), or a
+            list of B scipy sparse matrices of shape (3n, 3n) with the
+            same sparsity pattern
+        :param b_in: array of shape (B, 3n)
+        :param S_in: either one constraint list shared by all
+            systems (list of n tuples of prohibited directions, see
+            MPCGSolver), or a list of B such lists
+        :param z_in: constrained velocities, shape (n, 3) shared by
+            all systems or (B, n, 3)
+        :param max_iter: max number of iterations; None for no limit
+        :param rtol: relative tolerance, as for MPCGSolver
+        :param atol: absolute tolerance, as for MPCGSolver
+        :param compact_ratio: the working set is compacted once the
+            fraction of active systems in it drops below this ratio
+        """
+        start = time.perf_counter()
+        self._b = np.array(b_in, dtype=np.float64)
+        self._num_systems, num_dofs = self._b.shape
+        self._num_particles = num_dofs // 3
+        self._max_iter = max_iter
+        self._rtol = rtol
+        self._atol = atol
+        self._compact_ratio = compact_ratio
+        self._z = np.array(np.broadcast_to(
+            np.asarray(z_in, dtype=np.float64),
+            (self._num_systems, self._num_particles, 3))).reshape(self._num_systems, num_dofs)
+        self._set_A(A_in)
+        self._set_S(S_in)
+        self._stats = []
+        self._setup_time = time.perf_counter() - start
+
+    @property
+    def num_systems(self):
+        r"""
+        Getter for the number of systems B
+        """
+        return self._num_systems
+
+    @property
+    def num_particles(self):
+        r"""
+        Getter for the number of particles n of each system
+        """
+        return self._num_particles
+
+    @property
+    def is_sparse(self):
+        r"""
+        Whether the A_k are stored as stacked BSR blocks.
+        """
+        return self._data is not None
+
+    @property
+    def stats(self):
+        r"""
+        List of B SolveStats of the last call to solve()
+        """
+        return self._stats
+
+    def _set_A(self, A_in):
+        r"""
+        Store the A_k and the diagonals for the Jacobi preconditioner.
+        """
+        if isinstance(A_in, np.ndarray) and A_in.ndim == 3:
+            self._A = np.array(A_in, dtype=np.float64)
+            self._data = None
+            self._diag = np.diagonal(self._A, axis1=1, axis2=2).copy()
+            return
+        if len(A_in) != self._num_systems:
+            raise ValueError(f"expected {self._num_systems} matrices, got {len(A_in)}")
+        A_bsr = [MPCGSolver.as_system_matrix(A_k) for A_k in A_in]
+        if not all(sp.issparse(A_k) for A_k in A_bsr):
+            raise ValueError("A must be a (B, 3n, 3n) array or a list of sparse matrices")
+        for A_k in A_bsr:
+            A_k.sort_indices()
+        self._indptr = A_bsr[0].indptr
+        self._indices = A_bsr[0].indices
+        for A_k in A_bsr[1:]:
+            if not (np.array_equal(A_k.indptr, self._indptr)
+                    and np.array_equal(A_k.indices, self._indices)):
+                raise ValueError("all sparse A_k must share one sparsity pattern")
+        # (B, nnzb, 3, 3)
+        self._data = np.stack([A_k.data for A_k in A_bsr])
+        self._A = None
+        self._diag = np.stack([A_k.diagonal() for A_k in A_bsr])
+
+    def _set_S(self, S_in):
+        r"""
+        Compute the constraint matrices of all systems, restricted
+        to the particles constrained in at least one system.
+        """
+        if len(S_in) > 0 and isinstance(S_in[0], list):
+            if len(S_in) != self._num_systems:
+                raise ValueError(f"expected {self._num_systems} constraint lists, got {len(S_in)}")
+            S_all = [constraint_matrices(S_k, self._num_particles) for S_k in S_in]
+        else:
+            S_all = [constraint_matrices(S_in, self._num_particles)] * self._num_systems
+        self._constrained = np.unique(
+            np.concatenate([constrained for _, constrained in S_all]))
+        # (B, m, 3, 3) for the m constrained particles
+        self._S_constrained = np.stack(
+            [S_k[self._constrained] for S_k, _ in S_all])
+        # (I - S) z, the part of del_v fixed by the constraints
+        self._z_fixed = self._z - self._filter(self._z.copy(), self._S_constrained)
+
+    def _filter(self, v, S_constrained):
+        r"""
+        Filter vectors of the working set by their constraints.
+
+        :param v: array of shape (w, 3n); filtered in place
+        :param S_constrained: constraint matrices of the working set,
+            shape (w, m, 3, 3)
+
+        Return:
+        v
+        """
+        if self._constrained.size > 0:
+            v_blocks = np.reshape(v, (v.shape[0], self._num_particles, 3))
+            v_blocks[:, self._constrained] = np.einsum(
+                "wkij,wkj->wki", S_constrained, v_blocks[:, self._constrained])
+        return v
+
+    def _block_diagonal(self, data):
+        r"""
+        Assemble the working set's sparse A_k into one block-diagonal
+        BSR matrix, so that all products are a single sparse matvec.
+
+        :param data: BSR blocks of the working set, shape (w, nnzb, 3, 3)
+        """
+        num_working, num_blocks = data.shape[0], data.shape[1]
+        offsets = np.arange(num_working)
+        indices = (self._indices[None, :] + self._num_particles*offsets[:, None]).ravel()
+        indptr = np.concatenate([
+            [0], (self._indptr[None, 1:] + num_blocks*offsets[:, None]).ravel()])
+        num_dofs = 3*self._num_particles*num_working
+        return sp.bsr_matrix(
+            (np.reshape(data, (-1, 3, 3)), indices, indptr),
+            shape=(num_dofs, num_dofs))
+
+    @staticmethod
+    def _matvec(A, A_block, v):
+        r"""
+        Compute A_k v_k for all systems of the working set.
+
+        :param A: dense A_k of the working set, shape (w, 3n, 3n),
+            or None for sparse A_k
+        :param A_block: block-diagonal BSR matrix of the working
+            set, or None for dense A_k
+        :param v: array of shape (w, 3n)
+
+        Return:
+        array of shape (w, 3n)
+        """
+        if A_block is not None:
+            return np.reshape(A_block @ np.ravel(v), v.shape)
+        return np.matmul(A, v[:, :, None])[:, :, 0]
+
+    def solve(self, del_v_0=None):
+        r"""
+        Solve all B systems.
+
+        :param del_v_0: optional initial guesses of shape (B, 3n);
+            projected as in MPCGSolver.initial_guess()
+
+        Return:
+        del_v of shape (B, 3n, 1)
+        """
+        start = time.perf_counter()
+        num_dofs = 3*self._num_particles
+        self._stats = [SolveStats() for _ in range(self._num_systems)]
+        for stats in self._stats:
+            stats.setup_time = self._setup_time
+        del_v_out = np.zeros((self._num_systems, num_dofs))
+
+        # working set: system ids and their data
+        ids = np.arange(self._num_systems)
+        A = self._A
+        data = self._data
+        S_w = self._S_constrained
+        inv_diag = 1.0 / self._diag
+        b = self._b
+        # initialize del_v
+        if del_v_0 is None:
+            x = self._z.copy()
+        else:
+            x = np.array(np.reshape(del_v_0, (self._num_systems, num_dofs)), dtype=np.float64)
+            self._filter(x, S_w)
+            x += self._z_fixed
+
+        A_block = None if data is None else self._block_diagonal(data)
+        # delta_0 = filter(b)^T P^{-1} filter(b)
+        b_filtered = self._filter(b.copy(), S_w)
+        delta_0 = np.einsum("wi,wi->w", b_filtered, inv_diag*b_filtered)
+        # r = filter(b - A del_v), c = filter(P^{-1} r)
+        r = self._filter(b - self._matvec(A, A_block, x), S_w)
+        c = self._filter(inv_diag*r, S_w)
+        delta_new = np.einsum("wi,wi->w", r, c)
+        num_iterations = np.zeros(self._num_systems, dtype=np.int64)
+        termination = np.full(self._num_systems, None, dtype=object)
+        # (system ids, residual norms) recorded once per iteration
+        history = [(ids, np.sqrt(np.abs(delta_new)))]
+        active = np.ones(ids.shape[0], dtype=bool)
+
+        while True:
+            # retire systems that are done; same test as is_converged()
+            done = active & (delta_new <= np.maximum(
+                np.power(self._rtol, 2)*delta_0, np.power(self._atol, 2)))
+            termination[ids[done]] = CONVERGED
+            active &= ~done
+            if self._max_iter is not None:
+                over_budget = active & (num_iterations[ids] >= self._max_iter)
+                termination[ids[over_budget]] = MAX_ITER
+                active &= ~over_budget
+            if not np.any(active):
+                break
+            # compact the working set once enough systems are done
+            if np.count_nonzero(active) < self._compact_ratio*ids.shape[0]:
+                del_v_out[ids[~active]] = x[~active]
+                ids, x, r, c, b = ids[active], x[active], r[active], c[active], b[active]
+                delta_0, delta_new = delta_0[active], delta_new[active]
+                inv_diag, S_w = inv_diag[active], S_w[active]
+                if A is not None:
+                    A = A[active]
+                else:
+                    data = data[active]
+                    A_block = self._block_diagonal(data)
+                active = np.ones(ids.shape[0], dtype=bool)
+
+            # q = filter(A c)
+            q = self._filter(self._matvec(A, A_block, c), S_w)
+            c_q = np.einsum("wi,wi->w", c, q)
+            breakdown = active & ~(c_q > 0)
+            termination[ids[breakdown]] = BREAKDOWN
+            active &= ~breakdown
+            # inactive systems get alpha = 0 and keep their state
+            alpha = np.where(active, delta_new / np.where(active, c_q, 1.0), 0.0)
+            x += alpha[:, None]*c
+            r -= alpha[:, None]*q
+            s = inv_diag*r
+            delta_old = delta_new
+            delta_new = np.where(active, np.einsum("wi,wi->w", r, s), delta_old)
+            beta = np.where(active, delta_new / np.where(active, delta_old, 1.0), 0.0)
+            # c of inactive systems is not used anymore
+            c *= beta[:, None]
+            c += s
+            self._filter(c, S_w)
+            num_iterations[ids[active]] += 1
+            history.append((ids[active], np.sqrt(np.abs(delta_new[active]))))
+
+        del_v_out[ids] = x
+        solve_time = time.perf_counter() - start
+        for history_ids, residuals in history:
+            for k, residual in zip(history_ids, residuals):
+                self._stats[k].residual_history.append(residual)
+        for k in range(self._num_systems):
+            stats = self._stats[k]
+            stats.termination = termination[k]
+            stats.num_iterations = int(num_iterations[k])
+            # one product for the initial residual, one per iteration
+            stats.num_matvecs = stats.num_iterations + 1
+            stats.solve_time = solve_time
+        return del_v_out[:, :, None]
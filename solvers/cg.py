@@ -1,23 +1,46 @@
+import time
 import numpy as np
+from scipy.sparse.linalg import LinearOperator
+from solvers.stats import CONVERGED, MAX_ITER, SolveStats, is_converged
 
 class CGSolver:
     r"""
     Solve system Ax = b with the CG method.
     """
 
-    def __init__(self, A_in, b_in, i_max_in) -> None:
+    def __init__(self, A_in, b_in, i_max_in, residual_replacement=50, rtol=1e-12,
+                 atol=0.0, x_0_in=None) -> None:
         r"""
         Constructor for PCGSolver
 
-        :param A_in: A matrix of shape (n, n)
+        :param A_in: A matrix of shape (n, n); a dense array, a scipy
+            sparse matrix or a scipy LinearOperator
         :param b_in: vector b of shape (n, )
-        :param i_max_in: max number of iterations when solving
+        :param i_max_in: max number of iterations when solving; None
+            for no limit
+        :param residual_replacement: the residual is updated with the
+            recurrence r = r - alpha*q, and recomputed as b - A x_i
+            every residual_replacement iterations to remove the drift
+            accumulated by round-off; 1 recomputes it every iteration
+        :param rtol: relative tolerance; iterations stop once
+            r^T r <= rtol^2 * r_0^T r_0
+        :param atol: absolute tolerance; iterations stop once
+            r^T r <= atol^2
+        :param x_0_in: optional initial guess of shape (n, ); zero
+            by default
         """
-        self._A = A_in.copy()
+        self._A = A_in if isinstance(A_in, LinearOperator) else A_in.copy()
         self._b = np.expand_dims(b_in, axis=1)
         self._i_max = i_max_in
-        self._x_0 = np.zeros(self._b.shape)
-        self._epsilon = 1e-12
+        if x_0_in is None:
+            self._x_0 = np.zeros(self._b.shape)
+        else:
+            self._x_0 = np.reshape(np.array(x_0_in, dtype=np.float64), self._b.shape)
+        self._rtol = rtol
+        self._atol = atol
+        self._residual_replacement = residual_replacement
+        self._num_matvecs = 0
+        self._stats = SolveStats()
     
     @property
     def A(self):
@@ -32,39 +55,103 @@ class CGSolver:
         Getter for b
         """
         return self._b
+
+    @property
+    def num_matvecs(self):
+        r"""
+        Number of products with A in the last call to solve()
+        """
+        return self._num_matvecs
+
+    @property
+    def stats(self):
+        r"""
+        SolveStats of the last call to solve() or of the last
+        exhausted iterate() generator
+        """
+        return self._stats
     
-    def solve(self):
+    def iterate(self):
         r"""
-        Solve A * x = b. Return x and direction of descent d at each
-        step. Algorithm adapted from Shewchuk, 94'.
+        Run the CG method on A * x = b, yielding the iterates lazily
+        so that the caller decides what to keep. Algorithm adapted
+        from Shewchuk, 94'.
 
-        Return:
-        - a list of x_i's ((n, 1) array each) from the initial guess x_0
-        to the approximated solution x_final;
-        - a list of d_i's
+        Yield:
+        (i, x_i, d_i) for i = 0 (initial guess) to the last iteration,
+        with x_i and d_i (n, 1) arrays; they are not modified by later
+        iterations
         """
+        start = time.perf_counter()
+        stats = SolveStats()
+        self._stats = stats
         i = 0
         x_i = self._x_0.copy()
-        x_is = [x_i]
-        r = self._b - np.matmul(self._A, x_i)
+        r = self._b - self._A @ x_i
+        self._num_matvecs = 1
         d = r
-        d_is = [d]
-        delta_new = np.matmul(np.transpose(r), r)
+        delta_new = np.matmul(np.transpose(r), r).item()
         delta_0 = delta_new
+        stats.residual_history.append(np.sqrt(delta_new))
+        yield i, x_i, d
 
-        while i<self._i_max and delta_new>np.power(self._epsilon, 2)*delta_0:
-            q = np.matmul(self._A, d)
+        while (self._i_max is None or i<self._i_max) and \
+                not is_converged(delta_new, delta_0, self._rtol, self._atol):
+            q = self._A @ d
+            self._num_matvecs += 1
             alpha = delta_new / np.matmul(np.transpose(d), q)
             # update x_i
             x_i = x_i + alpha * d
             # update r
-            r = self._b - np.matmul(self._A, x_i)
+            if (i + 1) % self._residual_replacement == 0:
+                r = self._b - self._A @ x_i
+                self._num_matvecs += 1
+            else:
+                r = r - alpha * q
             delta_old = delta_new
-            delta_new = np.matmul(np.transpose(r), r)
+            delta_new = np.matmul(np.transpose(r), r).item()
             beta = delta_new/delta_old
             # update d
             d = r + beta*d
             i = i + 1
-            x_is.append(x_i)
-            d_is.append(d)
-        return x_is, d_is
\ No newline at end of file
+            stats.num_iterations = i
+            stats.num_matvecs = self._num_matvecs
+            stats.residual_history.append(np.sqrt(delta_new))
+            yield i, x_i, d
+        stats.num_matvecs = self._num_matvecs
+        stats.termination = CONVERGED if is_converged(
+            delta_new, delta_0, self._rtol, self._atol) else MAX_ITER
+        stats.solve_time = time.perf_counter() - start
+
+    def solve(self, history=True, callback=None, callback_every=1):
+        r"""
+        Solve A * x = b. Return x and direction of descent d at each
+        step. Algorithm adapted from Shewchuk, 94'.
+
+        :param history: if True, keep every x_i and d_i; if False,
+            only the final x is kept and memory stays O(n)
+        :param callback: optional function callback(i, x_i, d_i),
+            called on every callback_every-th iterate and on the final
+            one, e.g. to record a subsampled or projected history
+        :param callback_every: subsampling period of the callback
+
+        Return:
+        if history:
+        - a list of x_i's ((n, 1) array each) from the initial guess x_0
+        to the approximated solution x_final;
+        - a list of d_i's
+        otherwise x_final, an (n, 1) array
+        """
+        x_is = []
+        d_is = []
+        for i, x_i, d_i in self.iterate():
+            if history:
+                x_is.append(x_i)
+                d_is.append(d_i)
+            if callback is not None and i % callback_every == 0:
+                callback(i, x_i, d_i)
+        if callback is not None and i % callback_every != 0:
+            callback(i, x_i, d_i)
+        if history:
+            return x_is, d_is
+        return x_i
@@ -0,0 +1,347 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import cho_solve_banded, cholesky_banded
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.reordering import ParticleOrdering
+from solvers.stats import CONVERGED, SolveStats
+
+def pattern_key(A):
+    r"""
+    Key identifying the block sparsity pattern of a BSR matrix.
+
+    :param A: BSR matrix with 3x3 blocks and canonical format
+    """
+    return (A.shape, A.indptr.tobytes(), A.indices.tobytes())
+
+class SymbolicFactorization:
+    r"""
+    Symbolic analysis of a block sparsity pattern for the banded
+    Cholesky factorization of CholeskySolver: the reverse
+    Cuthill-McKee ordering of the particles, the bandwidth of the
+    reordered matrix, and the map scattering the stored entries of
+    A straight into LAPACK's lower band storage.
+
+    It only depends on which 3x3 blocks of A are stored, i.e. on
+    the mesh topology, and is reused by every numeric
+    factorization with that pattern. A banded factor has no fill
+    outside the band, so no further fill analysis is needed.
+    """
+
+    def __init__(self, A) -> None:
+        r"""
+        Constructor for SymbolicFactorization
+
+        :param A: BSR matrix with 3x3 blocks and canonical format;
+            only its pattern is used
+        """
+        self._key = pattern_key(A)
+        num_particles = A.shape[0] // 3
+        self._num_dofs = A.shape[0]
+        self._ordering = ParticleOrdering.from_matrix(A)
+        inverse = self._ordering.inverse
+        # block row and (reordered) position of every stored block
+        block_rows = np.repeat(np.arange(num_particles), np.diff(A.indptr))
+        new_rows = inverse[block_rows]
+        new_cols = inverse[A.indices]
+        self._block_rows = block_rows
+        self._block_cols = A.indices.copy()
+        self._diagonal_blocks = np.flatnonzero(block_rows == A.indices)
+        if self._diagonal_blocks.shape[0] != num_particles:
+            raise ValueError("A must store every diagonal block")
+        # scalar entry (a, b) of block k lands at row 3*new_rows[k] + a,
+        # column 3*new_cols[k] + b of the reordered matrix
+        offsets = np.arange(3)
+        rows = 3*new_rows[:, None, None] + offsets[None, :, None]
+        cols = 3*new_cols[:, None, None] + offsets[None, None, :]
+        rows, cols = np.broadcast_arrays(rows, cols)
+        lower = np.ravel(rows >= cols)
+        # bandwidth in unknowns
+        self._bandwidth = int(np.max(rows - cols))
+        # entries of the lower triangle: flat index into A.data and
+        # into the (bandwidth + 1, 3n) band storage ab[i - j, j]
+        self._source = np.flatnonzero(lower)
+        self._target = np.ravel(rows - cols)[lower]*self._num_dofs + np.ravel(cols)[lower]
+
+    @property
+    def key(self):
+        r"""
+        Getter for the key of the analysed pattern
+        """
+        return self._key
+
+    @property
+    def ordering(self):
+        r"""
+        Getter for the particle ordering, a ParticleOrdering
+        """
+        return self._ordering
+
+    @property
+    def bandwidth(self):
+        r"""
+        Number of subdiagonals of the reordered matrix
+        """
+        return self._bandwidth
+
+    @property
+    def block_rows(self):
+        r"""
+        Getter for the block row of every stored block
+        """
+        return self._block_rows
+
+    @property
+    def block_cols(self):
+        r"""
+        Getter for the block column of every stored block
+        """
+        return self._block_cols
+
+    @property
+    def diagonal_blocks(self):
+        r"""
+        Getter for the indices of the diagonal blocks among the
+        stored blocks, in particle order
+        """
+        return self._diagonal_blocks
+
+    def allocate_band(self):
+        r"""
+        Allocate the band storage of the reordered matrix.
+
+        Return:
+        zero array of shape (bandwidth + 1, 3n)
+        """
+        return np.zeros((self._bandwidth + 1, self._num_dofs))
+
+    def scatter(self, data, out):
+        r"""
+        Scatter the blocks of a matrix with the analysed pattern into
+        the lower band storage of its reordered version.
+
+        :param data: block data of shape (nnzb, 3, 3)
+        :param out: band storage from allocate_band(); overwritten
+        """
+        out.fill(0.0)
+        out.flat[self._target] = np.ravel(data)[self._source]
+        return out
+
+
+class CholeskySolver:
+    r"""
+    Solve A del_v = b with the constraints of Baraff and Witkin, 98'
+    by a sparse direct factorization, as a fallback to MPCG for
+    small to medium cloth and stiff materials where MPCG needs many
+    iterations.
+
+    The constraints are handled as in MPCGSolver: del_v = u + (I - S) z
+    with u in the filtered space, and
+
+        (S A S + (I - S)) u = S (b - A (I - S) z).
+
+    The matrix S A S + (I - S) is SPD with the block pattern of A.
+    Its particles are reordered by reverse Cuthill-McKee and it is
+    factored by LAPACK's banded Cholesky. The symbolic analysis
+    (SymbolicFactorization) is done once per block pattern; update()
+    with an A of the same pattern only redoes the numeric
+    factorization, and changes of b or z need no factorization.
+
+    Memory is (bandwidth + 1) * 3n for the factor, about 3 (N + 1)
+    times the size of A for an N x N cloth grid.
+    """
+
+    def __init__(self, A_in, b_in, S_in, z_in, symbolic=None) -> None:
+        r"""
+        Constructor for CholeskySolver
+
+        :param A_in: A matrix of shape (3n, 3n); a dense array or a
+            scipy sparse matrix (BSR with 3x3 blocks preferred)
+        :param b_in: vector b of shape (3n, )
+        :param S_in: constraint list of length n, as for MPCGSolver
+        :param z_in: constrained velocity matrix of shape (n, 3)
+        :param symbolic: optional SymbolicFactorization to start
+            from, e.g. shared by the solvers of identical meshes;
+            it is only used if its pattern matches A
+        """
+        self._num_particles = None
+        self._A = None
+        self._symbolic = symbolic
+        self._band = None
+        self._num_symbolic_analyses = 0
+        self._num_factorizations = 0
+        self._stats = SolveStats()
+        self._setup_time = 0.0
+        self.update(A_in, b_in, S_in, z_in)
+
+    def update(self, A_in=None, b_in=None, S_in=None, z_in=None):
+        r"""
+        Update the system in place, e.g. for the next time step. A
+        or S trigger a numeric refactorization, and a symbolic
+        analysis only if the block pattern of A changed.
+
+        :param A_in: new A (see constructor), or None to keep A
+        :param b_in: new b of shape (3n, ), or None to keep b
+        :param S_in: new constraint list, or None to keep S
+        :param z_in: new z of shape (n, 3), or None to keep z
+        """
+        start = time.perf_counter()
+        if self._num_particles is None and (A_in is None or b_in is None or
+                                            S_in is None or z_in is None):
+            raise ValueError("A, b, S and z are required to set up the solver")
+        if z_in is not None:
+            self._z = np.array(z_in, dtype=np.float64)
+            if self._num_particles is not None and self._z.shape[0] != self._num_particles \
+                    and (A_in is None or b_in is None or S_in is None):
+                raise ValueError(
+                    "A, b and S are required when the number of particles changes")
+            self._num_particles = self._z.shape[0]
+        num_dofs = 3*self._num_particles
+        if A_in is not None:
+            if not (sp.issparse(A_in) or isinstance(A_in, np.ndarray)):
+                raise ValueError("CholeskySolver needs A as a dense array or sparse matrix")
+            A = A_in if sp.issparse(A_in) else sp.bsr_matrix(np.asarray(A_in), blocksize=(3, 3))
+            self._A = MPCGSolver.as_system_matrix(A, num_dofs)
+            self._A.sort_indices()
+            if self._symbolic is None or self._symbolic.key != pattern_key(self._A):
+                self._symbolic = SymbolicFactorization(self._A)
+                self._band = None
+                self._num_symbolic_analyses += 1
+        if b_in is not None:
+            self._b = np.reshape(np.array(b_in, dtype=np.float64), (num_dofs, 1))
+        if S_in is not None:
+            self._S, self._constrained = constraint_matrices(S_in, self._num_particles)
+        if A_in is not None or S_in is not None:
+            self.factor()
+        self._setup_time = time.perf_counter() - start
+
+    @property
+    def num_particles(self):
+        r"""
+        Getter for num_particles
+        """
+        return self._num_particles
+
+    @property
+    def A(self):
+        r"""
+        Getter for A, as a BSR matrix
+        """
+        return self._A
+
+    @property
+    def symbolic(self):
+        r"""
+        Getter for the SymbolicFactorization of the current pattern
+        """
+        return self._symbolic
+
+    @property
+    def num_symbolic_analyses(self):
+        r"""
+        Number of symbolic analyses done since construction
+        """
+        return self._num_symbolic_analyses
+
+    @property
+    def num_factorizations(self):
+        r"""
+        Number of numeric factorizations done since construction
+        """
+        return self._num_factorizations
+
+    @property
+    def stats(self):
+        r"""
+        SolveStats of the last call to solve()
+        """
+        return self._stats
+
+    def filtered_blocks(self):
+        r"""
+        Compute the blocks of S A S + (I - S), in the storage order
+        of A.
+
+        Return:
+        array of shape (nnzb, 3, 3)
+        """
+        data = self._A.data.copy()
+        if self._constrained.size == 0:
+            return data
+        symbolic = self._symbolic
+        is_constrained = np.zeros(self._num_particles, dtype=bool)
+        is_constrained[self._constrained] = True
+        # S_i A_ij S_j for the blocks touching a constrained particle
+        touched = np.flatnonzero(is_constrained[symbolic.block_rows] |
+                                 is_constrained[symbolic.block_cols])
+        data[touched] = np.matmul(
+            np.matmul(self._S[symbolic.block_rows[touched]], data[touched]),
+            self._S[symbolic.block_cols[touched]])
+        # + (I - S_i) on the diagonal
+        diagonal = symbolic.diagonal_blocks[self._constrained]
+        data[diagonal] += np.eye(3) - self._S[self._constrained]
+        return data
+
+    def factor(self):
+        r"""
+        Numeric factorization of S A S + (I - S) with the current
+        symbolic analysis.
+        """
+        if self._band is None:
+            self._band = self._symbolic.allocate_band()
+        self._symbolic.scatter(self.filtered_blocks(), out=self._band)
+        try:
+            self._factor = cholesky_banded(self._band, lower=True, overwrite_ab=True,
+                                           check_finite=False)
+        except np.linalg.LinAlgError:
+            raise np.linalg.LinAlgError(
+                "S A S + (I - S) is not positive definite") from None
+        self._num_factorizations += 1
+
+    def filter(self, v):
+        r"""
+        Filter vector v by kinematic constraints.
+
+        :param v: vector of shape (3n, 1); filtered in place
+
+        Return:
+        v
+        """
+        if self._constrained.size > 0:
+            v_blocks = np.reshape(v, (self._num_particles, 3))
+            v_blocks[self._constrained] = np.einsum(
+                "kij,kj->ki", self._S[self._constrained], v_blocks[self._constrained])
+        return v
+
+    def solve(self, del_v_0=None, return_stats=False):
+        r"""
+        Solve A * del_v = b with the factorization. Return del_v.
+
+        :param del_v_0: ignored; accepted for compatibility with
+            MPCGSolver.solve()
+        :param return_stats: if True, also return the SolveStats
+
+        Return:
+        del_v of shape (3n, 1), and the SolveStats if return_stats
+        """
+        start = time.perf_counter()
+        stats = SolveStats()
+        stats.setup_time = self._setup_time
+        self._stats = stats
+        ordering = self._symbolic.ordering
+        # (I - S) z
+        z_flat = np.reshape(self._z, self._b.shape)
+        z_fixed = z_flat - self.filter(z_flat.copy())
+        # right-hand side S (b - A (I - S) z)
+        rhs = self.filter(self._b - self._A @ z_fixed)
+        stats.num_matvecs = 1
+        # solve in the reordered numbering
+        u = cho_solve_banded((self._factor, True), ordering.permute_vector(rhs),
+                             check_finite=False)
+        del_v = ordering.unpermute_vector(u)
+        del_v += z_fixed
+        stats.termination = CONVERGED
+        stats.solve_time = time.perf_counter() - start
+        if return_stats:
+            return del_v, stats
+        return del_v
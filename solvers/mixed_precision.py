@@ -0,0 +1,181 @@
+import time
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.stats import CONVERGED, MAX_ITER, SolveStats, is_converged
+
+class MixedPrecisionMPCGSolver:
+    r"""
+    Solve A * del_v = b with MPCG in mixed precision: the MPCG
+    iterations run in float32, which halves the memory traffic of
+    the products with A, and a few float64 iterative refinement
+    steps recover the requested accuracy:
+
+        r_k = filter(b - A del_v_k)           (float64)
+        solve A d_k = r_k with MPCG, z = 0    (float32, loose tolerance)
+        del_v_{k+1} = del_v_k + d_k           (float64)
+
+    The corrections d_k are filtered, so the constrained components
+    of del_v stay equal to those of z.
+
+    The solver stores A twice: the float64 copy used by the residual
+    and the float32 copy iterated on by the inner solver, i.e. 1.5x
+    the memory of a float64 MPCGSolver. Forming the float32 products
+    from the float64 values instead would read the float64 data at
+    every iteration and lose the bandwidth saving, which is all the
+    method has to offer: the float32 solves take ~30% more iterations,
+    so mixed precision only breaks even once A no longer fits in cache
+    (about 5e4 dofs in benchmarks.bench_mixed_precision, which reports
+    time and memory of both modes). A matrix-free A is shared by both
+    solves as is and gains nothing from mixed precision.
+    """
+
+    def __init__(self, A_in, b_in, S_in, z_in, preconditioner=None, diag_in=None,
+                 rtol=1e-12, atol=0.0, inner_rtol=1e-4, inner_max_iter=None, max_refinements=20) -> None:
+        r"""
+        Constructor for MixedPrecisionMPCGSolver
+
+        :param A_in: A matrix of shape (3n, 3n); dense array or scipy
+            sparse matrix, or a matrix-free A as for MPCGSolver
+            (then diag_in is required)
+        :param b_in: vector b of shape (3n, )
+        :param S_in: constraint list of length n, as for MPCGSolver
+        :param z_in: constrained velocity matrix of shape (n, 3)
+        :param preconditioner: preconditioner of the float32 solves,
+            as for MPCGSolver
+        :param diag_in: optional diagonal of A of shape (3n, ); used by
+            the residual norm and, when preconditioner is None, by the
+            Jacobi preconditioner of the float32 solves. Required for
+            matrix-free A
+        :param rtol: relative tolerance on the float64 residual,
+            measured as for MPCGSolver
+        :param atol: absolute tolerance on the float64 residual
+        :param inner_rtol: relative tolerance of each float32 solve;
+            should stay well above float32 round-off (~1e-7)
+        :param inner_max_iter: max number of iterations of each
+            float32 solve
+        :param max_refinements: max number of refinement steps
+        """
+        start = time.perf_counter()
+        self._z = np.array(z_in, dtype=np.float64)
+        self._num_particles = self._z.shape[0]
+        num_dofs = 3*self._num_particles
+        self._A = MPCGSolver.as_system_matrix(A_in, num_dofs)
+        if diag_in is None:
+            if isinstance(self._A, LinearOperator):
+                raise ValueError("diag_in is required for a matrix-free A")
+            diag = self._A.diagonal()
+        else:
+            diag = np.reshape(np.array(diag_in, dtype=np.float64), (num_dofs, ))
+        self._b = np.reshape(np.array(b_in, dtype=np.float64), (num_dofs, 1))
+        S, self._constrained = constraint_matrices(S_in, self._num_particles)
+        self._S_constrained = S[self._constrained]
+        self._rtol = rtol
+        self._atol = atol
+        self._max_refinements = max_refinements
+        # float32 solver for the corrections; its right-hand side is
+        # replaced by the residual at every refinement step
+        self._inner_solver = MPCGSolver(
+            self._A, np.zeros(num_dofs), S_in, np.zeros((self._num_particles, 3)),
+            preconditioner=preconditioner, diag_in=diag_in, rtol=inner_rtol,
+            max_iter=inner_max_iter, dtype=np.float32)
+        self._inv_diag = np.expand_dims(1.0 / diag, axis=1)
+        self._num_refinements = 0
+        self._stats = SolveStats()
+        self._setup_time = time.perf_counter() - start
+
+    @property
+    def num_refinements(self):
+        r"""
+        Number of refinement steps taken by the last call to solve()
+        """
+        return self._num_refinements
+
+    @property
+    def stats(self):
+        r"""
+        SolveStats of the last call to solve(); num_iterations counts
+        the float32 iterations of all refinement steps, and the
+        residual history holds the float64 residual before each step
+        """
+        return self._stats
+
+    @property
+    def inner_solver(self):
+        r"""
+        Getter for the float32 MPCGSolver
+        """
+        return self._inner_solver
+
+    def filter(self, v):
+        r"""
+        Filter vector v by kinematic constraints, in float64.
+
+        :param v: vector of shape (3n, 1); filtered in place
+
+        Return:
+        v
+        """
+        if self._constrained.size > 0:
+            v_blocks = np.reshape(v, (self._num_particles, 3))
+            v_blocks[self._constrained] = np.einsum(
+                "kij,kj->ki", self._S_constrained, v_blocks[self._constrained])
+        return v
+
+    def solve(self, del_v_0=None, return_stats=False):
+        r"""
+        Solve A * del_v = b. Return del_v.
+
+        :param del_v_0: optional initial guess, as for MPCGSolver
+        :param return_stats: if True, also return the SolveStats
+
+        Return:
+        del_v of shape (3n, 1) in float64, and the SolveStats if
+        return_stats
+        """
+        start = time.perf_counter()
+        stats = SolveStats()
+        stats.setup_time = self._setup_time
+        self._stats = stats
+        # initialize del_v = S del_v_0 + (I - S) z
+        z_flat = np.reshape(self._z, self._b.shape)
+        if del_v_0 is None:
+            del_v = z_flat.copy()
+        else:
+            del_v = self.filter(np.array(np.reshape(del_v_0, self._b.shape), dtype=np.float64))
+            del_v += z_flat - self.filter(z_flat.copy())
+
+        # reference delta_0 = filter(b)^T P^{-1} filter(b)
+        b_filtered = self.filter(self._b.copy())
+        delta_0 = np.vdot(b_filtered, self._inv_diag * b_filtered)
+
+        self._num_refinements = 0
+        while True:
+            # float64 residual
+            r = self.filter(self._b - self._A @ del_v)
+            stats.num_matvecs += 1
+            delta = np.vdot(r, self._inv_diag * r)
+            stats.residual_history.append(np.sqrt(abs(delta)))
+            if is_converged(delta, delta_0, self._rtol, self._atol):
+                stats.termination = CONVERGED
+                break
+            if self._num_refinements >= self._max_refinements:
+                stats.termination = MAX_ITER
+                break
+            # float32 correction
+            self._inner_solver.update(b_in=r)
+            d = self._inner_solver.solve()
+            inner_stats = self._inner_solver.stats
+            stats.num_iterations += inner_stats.num_iterations
+            stats.num_matvecs += inner_stats.num_matvecs
+            if not inner_stats.num_iterations > 0:
+                # the float32 solve cannot improve del_v any more
+                stats.termination = inner_stats.termination or MAX_ITER
+                break
+            del_v += d
+            self._num_refinements += 1
+
+        stats.solve_time = time.perf_counter() - start
+        if return_stats:
+            return del_v, stats
+        return del_v
@@ -1,30 +1,207 @@
+import time
 import numpy as np
+import scipy.sparse as sp
+from scipy.linalg.blas import get_blas_funcs
+from scipy.sparse.linalg import LinearOperator
+from solvers.parallel import ParticleBlockKernels
+from solvers.preconditioners import JacobiPreconditioner, make_preconditioner
+from solvers.stats import BREAKDOWN, CONVERGED, MAX_ITER, SolveStats, is_converged
+
+def constraint_matrices(S_in, num_particles):
+    r"""
+    Compute constraint matrix S_i for each particle from its
+    tuple of prohibited directions p, q, ...: S_i = I - p p^T - ...
+    for one or two constraints, S_i = 0 for three.
+
+    :param S_in: list of n tuples of prohibited directions
+    :param num_particles: n
+
+    Return:
+    - array of n constraint matrices S_i, shape (n, 3, 3); S_i is
+    the identity for unconstrained particles;
+    - indices of the constrained particles
+    """
+    S_out = np.tile(np.eye(3), (num_particles, 1, 1))
+    constrained = []
+    for particle_index in range(num_particles):
+        # get the constraint vectors and compute S_i
+        S_in_i = S_in[particle_index]
+        if len(S_in_i) == 0:
+            # no constraints, S_i stays the identity
+            continue
+        elif len(S_in_i) == 1:
+            # one constraint
+            p = np.expand_dims(S_in_i[0], axis=0)
+            S_i = np.eye(3) - np.matmul(np.transpose(p), p)
+        elif len(S_in_i) == 2:
+            # two constraints
+            p = np.expand_dims(S_in_i[0], axis=0)
+            q = np.expand_dims(S_in_i[1], axis=0)
+            S_i = np.eye(3) - np.matmul(np.transpose(p), p) - np.matmul(np.transpose(q), q)
+        else:
+            # three constraints
+            S_i = np.zeros((3, 3))
+        # add S_i to S
+        S_out[particle_index] = S_i
+        constrained.append(particle_index)
+    return S_out, np.array(constrained, dtype=np.int64)
 
 class MPCGSolver:
     r"""
     Solve system Ax = b with the MPCG method. Method adapted
     from Baraff and Witkin, 98'.
+
+    A can be given either as a dense array or as a scipy sparse
+    matrix; sparse matrices are stored in block-sparse (BSR) form
+    with one 3x3 block per pair of interacting particles, so that
+    all products with A are sparse. A can also be matrix-free: a
+    scipy LinearOperator or a callable computing A*v, e.g. a
+    Hessian-vector product, since MPCG only uses A through products
+    with vectors.
+
+    A solver object is meant to be long-lived: update() swaps in a
+    new A, b, S or z in place and only rebuilds what depends on the
+    changed inputs, and solve() iterates on preallocated buffers.
     """
 
-    def __init__(self, A_in, b_in, S_in, z_in) -> None:
+    def __init__(self, A_in, b_in, S_in, z_in, preconditioner=None, diag_in=None,
+                 max_iter=None, rtol=1e-12, atol=0.0, dtype=np.float64, recycler=None,
+                 num_threads=1) -> None:
         r"""
         Constructor for MPCGSolver
 
-        :param A_in: A matrix of shape (3n, 3n)
+        :param A_in: A matrix of shape (3n, 3n); either a dense
+            array, a scipy sparse matrix (BSR with 3x3 blocks
+            preferred, any other format is converted), a scipy
+            LinearOperator, or a callable mapping a (3n, ) vector v
+            to A*v
         :param b_in: vector b of shape (3n, )
         :param S_in: constraint list of length n; each element
             should be a tuple of 0/1/2/3 (not-necessarily unitary)
             vectors indicating prohibited directions
         :param z_in: constrained velocity matrix of shape (n, 3);
             zero vectors for unconstrained particles
+        :param preconditioner: None for the diagonal (Jacobi)
+            preconditioner, a name from
+            solvers.preconditioners.PRECONDITIONERS, or a
+            Preconditioner instance
+        :param diag_in: optional diagonal of A of shape (3n, ) for
+            the default Jacobi preconditioner; meant for matrix-free
+            A, whose diagonal is otherwise estimated by probing
+        :param max_iter: max number of iterations when solving;
+            None for no limit
+        :param rtol: relative tolerance; solve() stops once
+            r^T P^{-1} r <= rtol^2 * delta_0
+        :param atol: absolute tolerance; solve() stops once
+            r^T P^{-1} r <= atol^2
+        :param dtype: floating point type of A and of the iteration
+            (np.float64 or np.float32)
+        :param recycler: optional solvers.recycling.KrylovRecycler;
+            its deflation vectors, harvested from earlier solves,
+            are projected out of every solve
+        :param num_threads: number of threads of the iteration; with
+            more than one, particles are split into contiguous blocks
+            processed in parallel (see
+            solvers.parallel.ParticleBlockKernels). Matrix-free A is
+            always iterated on one thread. The threads live until
+            close(), or the end of a with block on the solver
+        """
+        if preconditioner is None and diag_in is not None:
+            preconditioner = JacobiPreconditioner(diag_in)
+        self._preconditioner = make_preconditioner(preconditioner)
+        self._num_particles = None
+        self._A = None
+        self._dtype = np.dtype(dtype)
+        self._max_iter = max_iter
+        self._rtol = rtol
+        self._atol = atol
+        self._stats = SolveStats()
+        self._setup_time = 0.0
+        self._num_matvecs = 0
+        self._recycler = recycler
+        self._kernels = ParticleBlockKernels(num_threads) if num_threads > 1 else None
+        self._use_kernels = False
+        self.update(A_in, b_in, S_in, z_in)
+
+    def update(self, A_in=None, b_in=None, S_in=None, z_in=None):
+        r"""
+        Update the system in place, e.g. for the next time step.
+        Only what depends on the given inputs is rebuilt: the
+        preconditioner when A or S changes, the constraint
+        matrices when S changes; b and z are copied into the
+        existing buffers. Buffers are reallocated only if the
+        number of particles changes, in which case all four
+        inputs must be given.
+
+        :param A_in: new A (see constructor), or None to keep A
+        :param b_in: new b of shape (3n, ), or None to keep b
+        :param S_in: new constraint list, or None to keep S
+        :param z_in: new z of shape (n, 3), or None to keep z
+        """
+        start = time.perf_counter()
+        if z_in is None and self._num_particles is None:
+            raise ValueError("z is required to set up the solver")
+        if z_in is not None and np.shape(z_in)[0] != self._num_particles:
+            if self._num_particles is not None and \
+                    (A_in is None or b_in is None or S_in is None):
+                raise ValueError(
+                    "A, b and S are required when the number of particles changes")
+            self._num_particles = np.shape(z_in)[0]
+            self._A = None
+            self.allocate_buffers()
+        if A_in is not None:
+            self._A = self.update_system_matrix(A_in)
+        if b_in is not None:
+            np.copyto(self._b, np.reshape(b_in, self._b.shape))
+        if z_in is not None:
+            np.copyto(self._z, z_in)
+        if S_in is not None:
+            self._S = self.compute_S(S_in)
+        if A_in is not None or S_in is not None:
+            self.compute_M()
+            if self._kernels is not None:
+                self._use_kernels = not isinstance(self._A, LinearOperator)
+                if self._use_kernels:
+                    self._kernels.setup(self._A, self._constrained,
+                                        self._S_constrained, self._num_particles)
+        if z_in is not None or S_in is not None:
+            # (I - S) z, the part of del_v fixed by the constraints
+            self.filter(self._z_flat, out=self._z_fixed)
+            np.subtract(self._z_flat, self._z_fixed, out=self._z_fixed)
+        self._setup_time = time.perf_counter() - start
+
+    def close(self):
+        r"""
+        Release the worker threads of a threaded solver. A later
+        solve() starts new ones.
         """
-        self._A = A_in.copy()
-        self._b = np.expand_dims(b_in, axis=1)
-        self._z = z_in.copy()
-        self._num_particles = self._z.shape[0]
-        self._S = self.compute_S(S_in)
-        self.compute_M()
-        self._epsi = 1e-12
+        if self._kernels is not None:
+            self._kernels.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def allocate_buffers(self):
+        r"""
+        Allocate the (3n, 1) work vectors used by solve(), and the
+        storage for b and z.
+        """
+        num_dofs = 3*self._num_particles
+        self._b = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._z = np.zeros((self._num_particles, 3), dtype=self._dtype)
+        # (3n, 1) view of z
+        self._z_flat = np.reshape(self._z, (num_dofs, 1))
+        self._z_fixed = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._del_v = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._r = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._c = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._q = np.zeros((num_dofs, 1), dtype=self._dtype)
+        self._s = np.zeros((num_dofs, 1), dtype=self._dtype)
+        # in-place y = y + a*x on the buffers
+        self._axpy = get_blas_funcs("axpy", (self._del_v, ))
 
     @property
     def num_particles(self):
@@ -33,6 +210,20 @@ class MPCGSolver:
         """
         return self._num_particles
     
+    @property
+    def num_iterations(self):
+        r"""
+        Number of iterations taken by the last call to solve()
+        """
+        return self._stats.num_iterations
+
+    @property
+    def stats(self):
+        r"""
+        SolveStats of the last call to solve()
+        """
+        return self._stats
+
     @property
     def A(self):
         r"""
@@ -50,16 +241,121 @@ class MPCGSolver:
     @property
     def M(self):
         r"""
-        Get the preconditioner matrix M.
+        Get the preconditioner M (a Preconditioner instance).
         """
         return self._M
 
+    @property
+    def preconditioner(self):
+        r"""
+        Getter for the preconditioner; same object as M.
+        """
+        return self._preconditioner
+
+    @property
+    def recycler(self):
+        r"""
+        Getter for the KrylovRecycler, or None
+        """
+        return self._recycler
+
+    @property
+    def num_threads(self):
+        r"""
+        Getter for the number of threads of the iteration
+        """
+        return 1 if self._kernels is None else self._kernels.num_threads
+
+    @property
+    def dtype(self):
+        r"""
+        Getter for the floating point type of the iteration
+        """
+        return self._dtype
+
+    @property
+    def is_sparse(self):
+        r"""
+        Whether A is stored as a sparse (BSR) matrix.
+        """
+        return sp.issparse(self._A)
+
+    @property
+    def is_matrix_free(self):
+        r"""
+        Whether A is only available through products with vectors.
+        """
+        return isinstance(self._A, LinearOperator)
+
+    @staticmethod
+    def as_system_matrix(A_in, num_dofs=None, dtype=np.float64):
+        r"""
+        Convert A to the storage used by the solver.
+
+        :param A_in: dense array, scipy sparse matrix or
+            LinearOperator of shape (3n, 3n), or a callable
+            computing A*v for a (3n, ) vector v
+        :param num_dofs: 3n; only needed when A_in is a callable
+        :param dtype: floating point type of the copy
+
+        Return:
+        a copy of A of type dtype; scipy sparse inputs are returned
+        as a BSR matrix with 3x3 blocks, dense inputs as a
+        dense array, and matrix-free inputs as a LinearOperator
+        """
+        if isinstance(A_in, LinearOperator):
+            return A_in
+        if callable(A_in) and not hasattr(A_in, "shape"):
+            if num_dofs is None:
+                raise ValueError("num_dofs is required for a callable A")
+            return LinearOperator(
+                (num_dofs, num_dofs),
+                matvec=lambda v: np.asarray(A_in(np.ravel(v)), dtype=dtype),
+                dtype=dtype)
+        if sp.issparse(A_in):
+            if A_in.shape[0] % 3 != 0 or A_in.shape[1] % 3 != 0:
+                raise ValueError(
+                    f"A must have shape (3n, 3n), got {A_in.shape}")
+            if A_in.format == "bsr" and A_in.blocksize == (3, 3):
+                A_out = A_in.astype(dtype, copy=True)
+            else:
+                A_out = sp.bsr_matrix(A_in.astype(dtype), blocksize=(3, 3))
+            A_out.sum_duplicates()
+            return A_out
+        return np.array(A_in, dtype=dtype)
+
+    def update_system_matrix(self, A_in):
+        r"""
+        Store a new A, reusing the current storage when A has the
+        same layout: same shape for dense A, same block sparsity
+        pattern for BSR A.
+
+        :param A_in: new A (see constructor)
+
+        Return:
+        A in the storage used by the solver
+        """
+        A_old = self._A
+        if isinstance(A_old, np.ndarray) and not sp.issparse(A_in) \
+                and not callable(A_in) and np.shape(A_in) == A_old.shape:
+            np.copyto(A_old, A_in)
+            return A_old
+        if sp.issparse(A_old) and sp.issparse(A_in) and A_in.format == "bsr" \
+                and A_in.blocksize == (3, 3) and A_in.has_canonical_format \
+                and np.array_equal(A_in.indptr, A_old.indptr) \
+                and np.array_equal(A_in.indices, A_old.indices):
+            np.copyto(A_old.data, A_in.data)
+            return A_old
+        return self.as_system_matrix(A_in, 3*self._num_particles, self._dtype)
+
     def compute_M(self):
         r"""
-        Compute the preconditioner P from A.
+        Set up the preconditioner M from A and the constraint
+        matrices S. This is done once; solve() only applies it.
         """
         assert self._A is not None
-        self._M = np.diag(np.diag(self._A))
+        self._preconditioner.setup(self._A, self._S)
+        self._M = self._preconditioner
 
     @property
     def z(self):
@@ -68,84 +364,318 @@ class MPCGSolver:
         """
         return self._z
 
+    @property
+    def S(self):
+        r"""
+        Get the constraint matrices S as an array of shape (n, 3, 3).
+        """
+        return self._S
+
+    @property
+    def constrained_particles(self):
+        r"""
+        Get the indices of particles with at least one constraint.
+        """
+        return self._constrained
+
     def compute_S(self, S_in):
         r"""
         Compute constraint matrix S for each particle
-        from list of constrained direction tuples.
+        from list of constrained direction tuples. Also records
+        which particles are constrained, so that filter() only
+        needs to touch those.
 
         :param S_in: list of n tuples of prohibited directions
 
         :return:
-            list of n constraint matrices S_i of shape (3, 3)
-        """
-        S_out = []
-        for particle_index in range(self._num_particles):
-            # get the constraint vectors and compute S_i
-            S_in_i = S_in[particle_index]
-            if len(S_in_i) == 0:
-                # no constraints
-                S_i = np.eye(3)
-            elif len(S_in_i) == 1:
-                # one constraint
-                p = np.expand_dims(S_in_i[0], axis=0)
-                S_i = np.eye(3) - np.matmul(np.transpose(p), p)
-            elif len(S_in_i) == 2:
-                # two constraints
-                p = np.expand_dims(S_in_i[0], axis=0)
-                q = np.expand_dims(S_in_i[1], axis=0)
-                S_i = np.eye(3) - np.matmul(np.transpose(p), p) - np.matmul(np.transpose(q), q)
-            else:
-                # three constraints
-                S_i = np.zeros((3, 3))
-            # add S_i to S
-            S_out.append(S_i)
-        return S_out        
+            array of n constraint matrices S_i, shape (n, 3, 3);
+            S_i is the identity for unconstrained particles
+        """
+        S_out, self._constrained = constraint_matrices(S_in, self._num_particles)
+        S_out = S_out.astype(self._dtype)
+        self._S_constrained = S_out[self._constrained]
+        return S_out
 
-    def filter(self, v):
+    def filter(self, v, out=None):
         r"""
-        Filter vector v by kinematic constraints.
+        Filter vector v by kinematic constraints. Entries of
+        unconstrained particles are copied as is; the constrained
+        ones are multiplied by their S_i in a single batched
+        product.
         
         :param v: vector of shape (3n, 1)
+        :param out: optional preallocated output of shape (3n, 1);
+            may be v itself
 
         :return:
             v filtered by constraints; shape is (3n, 1)
         """
-        v_out = np.zeros(v.shape)
-        for particle_index in range(self.num_particles):
-            # extract v_i
-            v_i = v[particle_index*3:(particle_index+1)*3, 0]
-            # compute S_i * v_i
-            S_i_v_i = np.matmul(self._S[particle_index], v_i)
-            # assign S_i*v_i to v_out
-            v_out[particle_index*3:(particle_index+1)*3, 0] = S_i_v_i
+        if out is None:
+            v_out = np.array(v, dtype=self._dtype)
+        else:
+            v_out = out
+            if v_out is not v:
+                np.copyto(v_out, v)
+        if self._constrained.size > 0:
+            # view v, v_out as (n, 3) per-particle blocks
+            v_blocks = np.reshape(v, (self._num_particles, 3))
+            v_out_blocks = np.reshape(v_out, (self._num_particles, 3))
+            # compute S_i * v_i for constrained particles only
+            v_out_blocks[self._constrained] = np.einsum(
+                "kij,kj->ki",
+                self._S_constrained,
+                v_blocks[self._constrained])
         return v_out
     
-    def solve(self):
+    def matvec(self, v, out):
+        r"""
+        Compute A * v into out.
+
+        :param v: vector of shape (3n, 1)
+        :param out: preallocated output of shape (3n, 1)
+
+        Return:
+        out
+        """
+        self._num_matvecs += 1
+        if isinstance(self._A, np.ndarray):
+            np.matmul(self._A, v, out=out)
+        else:
+            # sparse and matrix-free products allocate their result
+            out[...] = self._A @ v
+        return out
+
+    def initial_guess(self, del_v_0=None, out=None):
+        r"""
+        Build the initial iterate of MPCG. Components along the
+        constrained directions are taken from z, the others from
+        del_v_0, i.e. del_v = S del_v_0 + (I - S) z.
+
+        :param del_v_0: optional guess of shape (3n, 1), (3n, ) or
+            (n, 3); if not given, del_v = z as in Baraff and Witkin
+        :param out: optional preallocated output of shape (3n, 1)
+
+        Return:
+        initial del_v of shape (3n, 1)
+        """
+        if out is None:
+            out = np.empty(self._z_flat.shape, dtype=self._dtype)
+        if del_v_0 is None:
+            np.copyto(out, self._z_flat)
+            return out
+        np.copyto(out, np.reshape(np.asarray(del_v_0, dtype=np.float64), out.shape))
+        self.filter(out, out=out)
+        out += self._z_fixed
+        return out
+
+    def solve(self, del_v_0=None, return_stats=False):
         r"""
         Solve A * del_v = b. Return del_v. Algorithm adapted
-        from Baraff and Witkin, 98'.
+        from Baraff and Witkin, 98'. All vector updates are done
+        in place on the solver's buffers.
+
+        :param del_v_0: optional initial guess for del_v, e.g. the
+            solution of the previous time step; it is projected so
+            that the constrained components still come from z
+        :param return_stats: if True, also return the SolveStats
+            of this solve (also available as the stats property)
+
+        Return:
+        del_v of shape (3n, 1), and the SolveStats if return_stats
         """
+        start = time.perf_counter()
+        stats = SolveStats()
+        stats.setup_time = self._setup_time
+        self._stats = stats
+        self._num_matvecs = 0
+        del_v, r, c, q, s = self._del_v, self._r, self._c, self._q, self._s
+        # 1D views for the BLAS axpy
+        del_v_1d, r_1d, c_1d, q_1d = del_v.ravel(), r.ravel(), c.ravel(), q.ravel()
+
         # initialize del_v
-        del_v = np.reshape(
-            self._z.copy(),
-            (self._z.shape[0]*self._z.shape[1], 1))
-        
-        delta_0 = np.matmul(
-            np.transpose(self.filter(self._b)),
-            np.matmul(np.linalg.inv(self._M), self.filter(self._b)))
-        r = self.filter(self._b - np.matmul(self._A, del_v)) # (3n, 1)
-        c = self.filter(np.matmul(np.linalg.inv(self._M), r)) # (3n, 1)
-        delta_new = np.matmul(np.transpose(r), c)
-
-        while delta_new > np.power(self._epsi, 2)*delta_0:
+        self.initial_guess(del_v_0, out=del_v)
+
+        # delta_0 = filter(b)^T P^{-1} filter(b)
+        self.filter(self._b, out=r)
+        self._M.apply(r, out=s)
+        delta_0 = np.vdot(r, s)
+        # r = filter(b - A del_v)
+        self.matvec(del_v, out=q)
+        np.subtract(self._b, q, out=r)
+        self.filter(r, out=r)
+        recycler = self._recycler
+        kernels = self._kernels if self._use_kernels else None
+        if recycler is not None:
+            # correct del_v and r on the recycled space
+            recycler.prepare(self)
+            recycler.project_initial(del_v, r)
+        # c = filter(P^{-1} r)
+        self._M.apply(r, out=c)
+        self.filter(c, out=c)
+        delta_new = np.vdot(r, c)
+        if recycler is not None:
+            recycler.project(c)
+        stats.residual_history.append(np.sqrt(abs(delta_new)))
+
+        while True:
             # iterate until relative error in ||r||^2 is small enough
-            q = self.filter(np.matmul(self._A, c))
-            alpha = delta_new / np.matmul(np.transpose(c), q)
-            del_v = del_v + alpha*c
-            r = r - alpha*q
-            s = np.matmul(np.linalg.inv(self._M), r) # (3n, 1)
+            if is_converged(delta_new, delta_0, self._rtol, self._atol):
+                stats.termination = CONVERGED
+                break
+            if self._max_iter is not None and stats.num_iterations >= self._max_iter:
+                stats.termination = MAX_ITER
+                break
+            # q = filter(A c)
+            if kernels is not None:
+                self._num_matvecs += 1
+                c_q = kernels.matvec_filter_dot(c, q)
+            else:
+                self.matvec(c, out=q)
+                self.filter(q, out=q)
+                c_q = np.vdot(c, q)
+            if not c_q > 0:
+                # A is not SPD on the filtered space, or NaNs appeared
+                stats.termination = BREAKDOWN
+                break
+            if recycler is not None:
+                recycler.record(c, q)
+            alpha = delta_new / c_q
             delta_old = delta_new
-            delta_new = np.matmul(np.transpose(r), s)
-            c = self.filter(s + (delta_new/delta_old)*c)
+            if kernels is not None:
+                delta_new = kernels.update_precondition_dot(alpha, c, q, del_v, r, s, self._M)
+                kernels.direction(delta_new/delta_old, s, c)
+            else:
+                # del_v = del_v + alpha*c, r = r - alpha*q
+                self._axpy(c_1d, del_v_1d, a=alpha)
+                self._axpy(q_1d, r_1d, a=-alpha)
+                # s = P^{-1} r
+                self._M.apply(r, out=s)
+                delta_new = np.vdot(r, s)
+                # c = filter(s + beta*c)
+                c *= delta_new/delta_old
+                c += s
+                self.filter(c, out=c)
+            if recycler is not None:
+                recycler.project(c)
+            stats.num_iterations += 1
+            stats.residual_history.append(np.sqrt(abs(delta_new)))
+
+        if recycler is not None:
+            recycler.harvest()
+        stats.num_matvecs = self._num_matvecs
+        stats.solve_time = time.perf_counter() - start
+        if return_stats:
+            return del_v.copy(), stats
+        return del_v.copy()
+
 
+class MPCGStepper:
+    r"""
+    Solve one MPCG system per time step, warm-starting each
+    solve from the previous solution(s). dv changes smoothly
+    between frames, so the previous dv (or a linear extrapolation
+    of the last two) is a much better initial guess than z alone.
+    """
+
+    def __init__(self, extrapolate=True, preconditioner=None) -> None:
+        r"""
+        Constructor for MPCGStepper
+
+        :param extrapolate: if True and two previous solutions are
+            known, start from 2*dv_{k-1} - dv_{k-2}; otherwise start
+            from dv_{k-1}
+        :param preconditioner: preconditioner passed on to MPCGSolver
+        """
+        self._extrapolate = extrapolate
+        self._preconditioner = preconditioner
+        self._history = []
+        self._solver = None
+        self._solver_kwargs = None
+        self._S_in = None
+
+    @property
+    def solver(self):
+        r"""
+        Getter for the MPCGSolver used in the last step
+        """
+        return self._solver
+
+    @property
+    def history(self):
+        r"""
+        Getter for the (at most two) last solutions, oldest first
+        """
+        return self._history
+
+    def reset(self):
+        r"""
+        Forget previous solutions, e.g. after a discontinuity.
+        """
+        self._history = []
+
+    def replace_last(self, del_v):
+        r"""
+        Replace the last remembered solution, e.g. by the solution
+        of a fallback solver after an unconverged step, so that
+        later guesses do not extrapolate from the failed solve.
+
+        :param del_v: solution of shape (3n, ) or (3n, 1)
+        """
+        del_v = np.reshape(np.array(del_v, dtype=np.float64), (-1, 1))
+        self._history = self._history[:-1] + [del_v]
+
+    def guess(self):
+        r"""
+        Compute the initial guess for the next solve.
+
+        Return:
+        guess of shape (3n, 1), or None before the first solve
+        """
+        if len(self._history) == 0:
+            return None
+        if self._extrapolate and len(self._history) == 2:
+            return 2.0*self._history[1] - self._history[0]
+        return self._history[-1]
+
+    def solve(self, A_in, b_in, S_in, z_in, **kwargs):
+        r"""
+        Solve one time step's system and remember its solution.
+        The constraints are only rebuilt when S_in is a different
+        object from the previous step's, so pass a new list (rather
+        than modifying the old one in place) to change them.
+
+        :param A_in, b_in, S_in, z_in: as for MPCGSolver
+        :param kwargs: other MPCGSolver arguments; they configure the
+            solver built on the first step, and later steps must pass
+            the same values
+
+        Return:
+        del_v of shape (3n, 1)
+        """
+        kwargs.setdefault("preconditioner", self._preconditioner)
+        if self._solver is None:
+            self._solver = MPCGSolver(A_in, b_in, S_in, z_in, **kwargs)
+            self._solver_kwargs = kwargs
+        else:
+            changed = sorted(
+                name for name in kwargs.keys() | self._solver_kwargs.keys()
+                if name not in kwargs or name not in self._solver_kwargs
+                or not (kwargs[name] is self._solver_kwargs[name]
+                        or np.array_equal(kwargs[name], self._solver_kwargs[name])))
+            if changed:
+                raise ValueError(
+                    f"MPCGSolver arguments {changed} differ from the first step's; "
+                    "build a new MPCGStepper to change them")
+            # reuse the solver's buffers and rebuild in place
+            resized = np.shape(z_in)[0] != self._solver.num_particles
+            self._solver.update(A_in, b_in, S_in if resized or S_in is not self._S_in else None,
+                                z_in)
+        self._S_in = S_in
+        guess = self.guess()
+        if guess is not None and guess.shape[0] != 3*self._solver.num_particles:
+            # the system changed size; previous solutions are useless
+            self.reset()
+            guess = None
+        del_v = self._solver.solve(guess)
+        self._history = (self._history + [del_v])[-2:]
         return del_v
@@ -0,0 +1,105 @@
+r"""
+JAX implementation of the MPCG method of Baraff and Witkin, 98'.
+
+Same algorithm as solvers/mpcg.py, written with jax.numpy and
+jax.lax.while_loop so that it can be jitted by XLA and called
+from inside a jitted time step, without moving A or b to the host.
+
+Results match MPCGSolver to round-off when JAX runs in double
+precision (jax.config.update("jax_enable_x64", True)); otherwise
+everything is float32.
+"""
+from functools import partial
+import jax
+import jax.numpy as jnp
+from jax import lax
+
+def filter_jax(S, v):
+    r"""
+    Filter vector v by kinematic constraints.
+
+    :param S: constraint matrices of shape (n, 3, 3)
+    :param v: vector of shape (3n, )
+
+    Return:
+    S_i v_i for every particle i, shape (3n, )
+    """
+    v_blocks = jnp.reshape(v, (S.shape[0], 3))
+    return jnp.reshape(jnp.einsum("kij,kj->ki", S, v_blocks), v.shape)
+
+def mpcg_solve(A, b, S, z, del_v_0=None, inv_diag=None, rtol=1e-12, atol=0.0, max_iter=None):
+    r"""
+    Solve A * del_v = b with MPCG. Traceable: may be called under
+    jax.jit, vmap or from inside a jitted time step.
+
+    :param A: dense array of shape (3n, 3n), or a callable mapping
+        a (3n, ) vector v to A*v (e.g. a jvp-based Hessian-vector
+        product)
+    :param b: vector b of shape (3n, )
+    :param S: constraint matrices of shape (n, 3, 3), e.g. from
+        solvers.mpcg.constraint_matrices()
+    :param z: constrained velocities of shape (n, 3)
+    :param del_v_0: optional initial guess of shape (3n, ); projected
+        as S del_v_0 + (I - S) z
+    :param inv_diag: inverse of the Jacobi preconditioner, shape
+        (3n, ); taken from the diagonal of A if A is an array
+    :param rtol: relative tolerance, as for MPCGSolver
+    :param atol: absolute tolerance, as for MPCGSolver
+    :param max_iter: max number of iterations; None for no limit
+
+    Return:
+    - del_v of shape (3n, );
+    - number of iterations taken;
+    - whether the tolerance was reached
+    """
+    if callable(A):
+        matvec = A
+        if inv_diag is None:
+            raise ValueError("inv_diag is required for a callable A")
+    else:
+        matvec = partial(jnp.matmul, A)
+        if inv_diag is None:
+            inv_diag = 1.0 / jnp.diagonal(A)
+    if max_iter is None:
+        max_iter = jnp.iinfo(jnp.int32).max
+
+    # initialize del_v
+    z_flat = jnp.reshape(z, b.shape).astype(b.dtype)
+    if del_v_0 is None:
+        del_v = z_flat
+    else:
+        del_v = filter_jax(S, del_v_0) + (z_flat - filter_jax(S, z_flat))
+
+    b_filtered = filter_jax(S, b)
+    delta_0 = jnp.dot(b_filtered, inv_diag * b_filtered)
+    r = filter_jax(S, b - matvec(del_v))
+    c = filter_jax(S, inv_diag * r)
+    delta_new = jnp.dot(r, c)
+    threshold = jnp.maximum(rtol**2 * delta_0, atol**2)
+
+    def cond_fun(carry):
+        i, _, _, _, delta_new, breakdown = carry
+        return (delta_new > threshold) & (i < max_iter) & ~breakdown
+
+    def body_fun(carry):
+        i, del_v, r, c, delta_new, _ = carry
+        q = filter_jax(S, matvec(c))
+        c_q = jnp.dot(c, q)
+        breakdown = ~(c_q > 0)
+        # leave the state untouched on breakdown
+        alpha = jnp.where(breakdown, 0.0, delta_new / c_q)
+        del_v = del_v + alpha*c
+        r = r - alpha*q
+        s = inv_diag * r
+        delta_old = delta_new
+        delta_new = jnp.where(breakdown, delta_old, jnp.dot(r, s))
+        c = filter_jax(S, s + (delta_new/delta_old)*c)
+        return i + jnp.where(breakdown, 0, 1), del_v, r, c, delta_new, breakdown
+
+    i, del_v, _, _, delta_new, _ = lax.while_loop(
+        cond_fun, body_fun,
+        (jnp.array(0, dtype=jnp.int32), del_v, r, c, delta_new, jnp.array(False)))
+    return del_v, i, delta_new <= threshold
+
+# jitted entry point for a dense A
+mpcg_solve_jit = jax.jit(mpcg_solve, static_argnames=("max_iter", ))
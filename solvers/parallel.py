@@ -0,0 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+class ParticleBlockKernels:
+    r"""
+    Multithreaded kernels of the MPCG iteration. Particles are
+    split into contiguous blocks, one per thread, and each thread
+    runs its rows of the products with A, the filter, the
+    preconditioner and its share of the dot products. The work of
+    one iteration is fused into three phases separated by the two
+    reductions of CG:
+
+        1. q = filter(A c), partial c^T q
+        2. del_v += alpha c, r -= alpha q, s = P^{-1} r, partial r^T s
+        3. c = filter(s + beta c)
+
+    All per-block work is done by scipy's sparse kernels, BLAS and
+    numpy ufuncs, which release the GIL. Partial dot products are
+    summed in block order, so results do not depend on thread
+    scheduling.
+
+    Preconditioners that act on each particle independently
+    (local = True, e.g. Jacobi and block-Jacobi) are applied per
+    block; others are applied by the calling thread between the
+    parallel parts of phase 2.
+
+    The worker threads are started by the first parallel phase and
+    live until close(); the kernels are also a context manager that
+    closes them on exit. Using the kernels again after close()
+    starts new threads.
+    """
+
+    def __init__(self, num_threads) -> None:
+        r"""
+        Constructor for ParticleBlockKernels
+
+        :param num_threads: number of worker threads and of
+            particle blocks
+        """
+        self._num_threads = num_threads
+        self._executor = None
+        self._bounds = None
+        self._A_rows = []
+        self._constrained = []
+        self._S_constrained = []
+        self._scratch = None
+
+    @property
+    def num_threads(self):
+        r"""
+        Getter for the number of threads
+        """
+        return self._num_threads
+
+    @property
+    def particle_bounds(self):
+        r"""
+        Array of num_blocks + 1 particle indices; block k holds
+        particles bounds[k] to bounds[k+1] - 1
+        """
+        return self._bounds
+
+    def setup(self, A, constrained, S_constrained, num_particles):
+        r"""
+        Split the particles into blocks and take row views of A and
+        the constraint matrices of each block. The row views of a
+        BSR or dense A share its storage, so in-place updates of A
+        need no new setup().
+
+        :param A: dense array or BSR matrix (3x3 blocks)
+        :param constrained: indices of the constrained particles
+        :param S_constrained: their constraint matrices, (m, 3, 3)
+        :param num_particles: n
+        """
+        num_blocks = max(1, min(self._num_threads, num_particles))
+        self._bounds = np.linspace(0, num_particles, num_blocks + 1).astype(np.int64)
+        self._A_rows = []
+        self._constrained = []
+        self._S_constrained = []
+        for first, last in zip(self._bounds[:-1], self._bounds[1:]):
+            if sp.issparse(A):
+                indptr = A.indptr
+                self._A_rows.append(sp.bsr_matrix(
+                    (A.data[indptr[first]:indptr[last]],
+                     A.indices[indptr[first]:indptr[last]],
+                     indptr[first:last+1] - indptr[first]),
+                    shape=(3*(last - first), A.shape[1])))
+            else:
+                self._A_rows.append(A[3*first:3*last])
+            # constrained particles of the block, relative to its first
+            in_block = (constrained >= first) & (constrained < last)
+            self._constrained.append(constrained[in_block] - first)
+            self._S_constrained.append(S_constrained[in_block])
+        self._scratch = np.zeros((3*num_particles, 1), dtype=A.dtype)
+
+    def close(self):
+        r"""
+        Shut down the worker threads and wait for them to exit.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def map_blocks(self, function):
+        r"""
+        Run function(k, rows) for every block k on the pool, with
+        rows the slice of its 3n rows.
+
+        Return:
+        list of the results, in block order
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._num_threads,
+                                                thread_name_prefix="ParticleBlockKernels")
+        return list(self._executor.map(
+            lambda k: function(k, slice(3*self._bounds[k], 3*self._bounds[k+1])),
+            range(len(self._A_rows))))
+
+    def filter_block(self, k, v_rows):
+        r"""
+        Filter the rows of block k in place.
+
+        :param k: block index
+        :param v_rows: rows of the vector in block k, shape (3m, 1)
+        """
+        constrained = self._constrained[k]
+        if constrained.size > 0:
+            v_blocks = np.reshape(v_rows, (-1, 3))
+            v_blocks[constrained] = np.einsum(
+                "kij,kj->ki", self._S_constrained[k], v_blocks[constrained])
+
+    def matvec_filter_dot(self, c, q):
+        r"""
+        Phase 1: q = filter(A c).
+
+        Return:
+        c^T q
+        """
+        def work(k, rows):
+            A_k = self._A_rows[k]
+            if isinstance(A_k, np.ndarray):
+                np.matmul(A_k, c, out=q[rows])
+            else:
+                q[rows] = A_k @ c
+            self.filter_block(k, q[rows])
+            return np.vdot(c[rows], q[rows])
+        return sum(self.map_blocks(work))
+
+    def update_precondition_dot(self, alpha, c, q, del_v, r, s, M):
+        r"""
+        Phase 2: del_v += alpha c, r -= alpha q, s = P^{-1} r.
+
+        Return:
+        r^T s
+        """
+        scratch = self._scratch
+        def update(k, rows):
+            np.multiply(c[rows], alpha, out=scratch[rows])
+            del_v[rows] += scratch[rows]
+            np.multiply(q[rows], alpha, out=scratch[rows])
+            r[rows] -= scratch[rows]
+        def precondition_dot(k, rows):
+            M.apply_rows(r, s, rows)
+            return np.vdot(r[rows], s[rows])
+        def dot(k, rows):
+            return np.vdot(r[rows], s[rows])
+        if M.local:
+            def work(k, rows):
+                update(k, rows)
+                return precondition_dot(k, rows)
+            return sum(self.map_blocks(work))
+        self.map_blocks(update)
+        M.apply(r, out=s)
+        return sum(self.map_blocks(dot))
+
+    def direction(self, beta, s, c):
+        r"""
+        Phase 3: c = filter(s + beta c).
+        """
+        def work(k, rows):
+            c[rows] *= beta
+            c[rows] += s[rows]
+            self.filter_block(k, c[rows])
+        self.map_blocks(work)
+
+    def pipelined_update(self, alpha, beta, u, w, c, q, del_v, r, M=None):
+        r"""
+        Vector updates of the pipelined MPCG iteration (see
+        solvers.pipelined): c = u + beta c, q = w + beta q,
+        del_v += alpha c, r -= alpha q, then u = filter(P^{-1} r)
+        if a local preconditioner M is given.
+        """
+        scratch = self._scratch
+        def work(k, rows):
+            c[rows] *= beta
+            c[rows] += u[rows]
+            q[rows] *= beta
+            q[rows] += w[rows]
+            np.multiply(c[rows], alpha, out=scratch[rows])
+            del_v[rows] += scratch[rows]
+            np.multiply(q[rows], alpha, out=scratch[rows])
+            r[rows] -= scratch[rows]
+            if M is not None:
+                M.apply_rows(r, u, rows)
+                self.filter_block(k, u[rows])
+        self.map_blocks(work)
+
+    def matvec_filter_dots(self, u, w, V):
+        r"""
+        Product with A and fused reduction of the pipelined MPCG
+        iteration: w = filter(A u), then V u, with V the (2, 3n)
+        array whose rows are r and w.
+
+        Return:
+        r^T u, w^T u
+        """
+        def work(k, rows):
+            A_k = self._A_rows[k]
+            if isinstance(A_k, np.ndarray):
+                np.matmul(A_k, u, out=w[rows])
+            else:
+                w[rows] = A_k @ u
+            self.filter_block(k, w[rows])
+            return V[:, rows] @ u[rows]
+        gamma, delta = np.ravel(sum(self.map_blocks(work)))
+        return gamma, delta
@@ -0,0 +1,221 @@
+import time
+import numpy as np
+from solvers.mpcg import MPCGSolver
+from solvers.stats import BREAKDOWN, CONVERGED, MAX_ITER, SolveStats, is_converged
+
+class PipelinedMPCGSolver(MPCGSolver):
+    r"""
+    Solve system Ax = b with a single-reduction variant of MPCG
+    (Chronopoulos and Gear, 89').
+
+    Classic MPCG needs c^T q before it can update r, and r^T s
+    before it can form the next direction: two dependent global
+    reductions per iteration. Here the product with A is applied to
+    the preconditioned residual u instead of the direction c, and
+    A c is carried by the recurrence q = w + beta q, so that both
+    dot products of an iteration,
+
+        gamma = r^T u,    delta = w^T u,    w = filter(A u),
+
+    are computed together in one reduction, from which
+
+        beta = gamma / gamma_old
+        alpha = gamma / (delta - beta gamma / alpha_old).
+
+    The filter is applied as in MPCG: u, w and therefore c and q
+    stay in the filtered space, and in exact arithmetic the
+    iterates are those of MPCGSolver.
+
+    The extra recurrence lets q drift from filter(A c) through
+    round-off, which can stall convergence or make the recursive
+    residual lie. The true residual filter(b - A del_v) (and q) are
+    therefore recomputed every residual_replacement iterations, and
+    convergence is only reported once the true residual passes the
+    test; otherwise the iteration carries on from it.
+    """
+
+    def __init__(self, A_in, b_in, S_in, z_in, preconditioner=None, diag_in=None,
+                 max_iter=None, rtol=1e-12, atol=0.0, dtype=np.float64, num_threads=1,
+                 residual_replacement=50) -> None:
+        r"""
+        Constructor for PipelinedMPCGSolver
+
+        :param A_in: A matrix of shape (3n, 3n), as for MPCGSolver
+        :param b_in: vector b of shape (3n, )
+        :param S_in: constraint list of length n, as for MPCGSolver
+        :param z_in: constrained velocity matrix of shape (n, 3)
+        :param preconditioner: preconditioner, as for MPCGSolver
+        :param diag_in: optional diagonal of A, as for MPCGSolver
+        :param max_iter: max number of iterations; None for no limit
+        :param rtol: relative tolerance, as for MPCGSolver
+        :param atol: absolute tolerance, as for MPCGSolver
+        :param dtype: floating point type of the iteration
+        :param num_threads: number of threads, as for MPCGSolver;
+            an iteration then has two parallel phases (vector
+            updates and preconditioner, product with A and the
+            fused reduction) instead of three
+        :param residual_replacement: the residual r and q = filter(A c)
+            are recomputed from del_v and c every residual_replacement
+            iterations (two extra products with A); None to only
+            check the true residual at convergence
+        """
+        self._residual_replacement = residual_replacement
+        super().__init__(A_in, b_in, S_in, z_in, preconditioner=preconditioner,
+                         diag_in=diag_in, max_iter=max_iter, rtol=rtol, atol=atol,
+                         dtype=dtype, num_threads=num_threads)
+
+    def allocate_buffers(self):
+        r"""
+        Allocate the work vectors of MPCGSolver, plus u and w. r and
+        w are the two rows of one (2, 3n) array, so that r^T u and
+        w^T u are computed by a single product.
+        """
+        super().allocate_buffers()
+        num_dofs = 3*self._num_particles
+        self._rw = np.zeros((2, num_dofs), dtype=self._dtype)
+        # (3n, 1) views of the rows of rw
+        self._r = np.reshape(self._rw[0], (num_dofs, 1))
+        self._w = np.reshape(self._rw[1], (num_dofs, 1))
+        self._u = np.zeros((num_dofs, 1), dtype=self._dtype)
+
+    @property
+    def residual_replacement(self):
+        r"""
+        Getter for the residual replacement period
+        """
+        return self._residual_replacement
+
+    def replace_residual(self, del_v, c, r, q):
+        r"""
+        Recompute r = filter(b - A del_v) and q = filter(A c) in
+        place, removing the drift of their recurrences.
+        """
+        self.matvec(del_v, out=r)
+        np.subtract(self._b, r, out=r)
+        self.filter(r, out=r)
+        self.matvec(c, out=q)
+        self.filter(q, out=q)
+
+    def precondition_matvec_dots(self, u, kernels=None, precondition=True):
+        r"""
+        Compute u = filter(P^{-1} r), w = filter(A u), and the fused
+        reduction (r^T u, w^T u).
+
+        :param u: buffer for u, shape (3n, 1)
+        :param kernels: ParticleBlockKernels for the product with A
+            and the reduction, or None for the serial path
+        :param precondition: if False, u is already up to date
+
+        Return:
+        gamma = r^T u, delta = w^T u
+        """
+        if precondition:
+            self._M.apply(self._r, out=u)
+            self.filter(u, out=u)
+        if kernels is not None:
+            self._num_matvecs += 1
+            return kernels.matvec_filter_dots(u, self._w, self._rw)
+        self.matvec(u, out=self._w)
+        self.filter(self._w, out=self._w)
+        gamma, delta = np.ravel(self._rw @ u)
+        return gamma, delta
+
+    def solve(self, del_v_0=None, return_stats=False):
+        r"""
+        Solve A * del_v = b. Return del_v. All vector updates are
+        done in place on the solver's buffers.
+
+        :param del_v_0: optional initial guess, as for MPCGSolver
+        :param return_stats: if True, also return the SolveStats
+
+        Return:
+        del_v of shape (3n, 1), and the SolveStats if return_stats
+        """
+        start = time.perf_counter()
+        stats = SolveStats()
+        stats.setup_time = self._setup_time
+        self._stats = stats
+        self._num_matvecs = 0
+        del_v, r, c, q, u, w = self._del_v, self._r, self._c, self._q, self._u, self._w
+        del_v_1d, r_1d, c_1d, q_1d = del_v.ravel(), r.ravel(), c.ravel(), q.ravel()
+        kernels = self._kernels if self._use_kernels else None
+        # local preconditioners are applied inside the parallel update
+        fused_precondition = kernels is not None and self._M.local
+
+        # initialize del_v
+        self.initial_guess(del_v_0, out=del_v)
+
+        # delta_0 = filter(b)^T P^{-1} filter(b)
+        self.filter(self._b, out=r)
+        self._M.apply(r, out=u)
+        delta_0 = np.vdot(r, u)
+        # r = filter(b - A del_v)
+        self.matvec(del_v, out=r)
+        np.subtract(self._b, r, out=r)
+        self.filter(r, out=r)
+        gamma, delta = self.precondition_matvec_dots(u, kernels)
+        stats.residual_history.append(np.sqrt(abs(gamma)))
+        # true residual at the last failed convergence check
+        gamma_true_failed = None
+
+        while True:
+            if is_converged(gamma, delta_0, self._rtol, self._atol):
+                if stats.num_iterations == 0:
+                    # r is the true residual
+                    stats.termination = CONVERGED
+                    break
+                # check the true residual before reporting convergence
+                self.replace_residual(del_v, c, r, q)
+                gamma, delta = self.precondition_matvec_dots(u, kernels)
+                if is_converged(gamma, delta_0, self._rtol, self._atol):
+                    stats.termination = CONVERGED
+                    break
+                if gamma_true_failed is not None and gamma >= gamma_true_failed:
+                    # round-off bounds the attainable accuracy above
+                    # the requested tolerance
+                    stats.termination = BREAKDOWN
+                    break
+                # carry on from the true residual
+                gamma_true_failed = gamma
+            if self._max_iter is not None and stats.num_iterations >= self._max_iter:
+                stats.termination = MAX_ITER
+                break
+            if stats.num_iterations == 0:
+                beta = 0.0
+                denominator = delta
+            else:
+                beta = gamma / gamma_old
+                denominator = delta - beta*gamma/alpha
+            if not denominator > 0:
+                # A is not SPD on the filtered space, or NaNs appeared
+                stats.termination = BREAKDOWN
+                break
+            alpha = gamma / denominator
+            gamma_old = gamma
+            replace = self._residual_replacement is not None and \
+                (stats.num_iterations + 1) % self._residual_replacement == 0
+            precondition = not fused_precondition or replace
+            if kernels is not None:
+                kernels.pipelined_update(alpha, beta, u, w, c, q, del_v, r,
+                                         None if precondition else self._M)
+            else:
+                # c = u + beta*c, q = w + beta*q
+                c *= beta
+                c += u
+                q *= beta
+                q += w
+                # del_v = del_v + alpha*c, r = r - alpha*q
+                self._axpy(c_1d, del_v_1d, a=alpha)
+                self._axpy(q_1d, r_1d, a=-alpha)
+            stats.num_iterations += 1
+            if replace:
+                self.replace_residual(del_v, c, r, q)
+            # u = filter(P^{-1} r), w = filter(A u), and their dots
+            gamma, delta = self.precondition_matvec_dots(u, kernels, precondition)
+            stats.residual_history.append(np.sqrt(abs(gamma)))
+
+        stats.num_matvecs = self._num_matvecs
+        stats.solve_time = time.perf_counter() - start
+        if return_stats:
+            return del_v.copy(), stats
+        return del_v.copy()
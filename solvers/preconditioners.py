@@ -0,0 +1,822 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse.linalg import LinearOperator, spsolve_triangular
+
+class Preconditioner:
+    r"""
+    Base class for preconditioners used by MPCGSolver.
+
+    A preconditioner is set up once from the system matrix A
+    and the per-particle constraint matrices S, and then applied
+    to residuals as r -> P^{-1} r every iteration. Subclasses
+    implement _setup() and apply(), and fill in their own cost
+    estimates.
+    """
+
+    name = None
+    # whether P^{-1} acts on each particle independently, so that
+    # it can be applied to blocks of rows by apply_rows()
+    local = False
+
+    def __init__(self) -> None:
+        r"""
+        Constructor for Preconditioner
+        """
+        self._num_dofs = 0
+        self._setup_time = 0.0
+        self._setup_flops = 0
+        self._apply_flops = 0
+
+    @property
+    def num_dofs(self):
+        r"""
+        Getter for the number of degrees of freedom (3n)
+        """
+        return self._num_dofs
+
+    @property
+    def setup_time(self):
+        r"""
+        Wall time in seconds spent in the last setup()
+        """
+        return self._setup_time
+
+    @property
+    def setup_flops(self):
+        r"""
+        Estimated number of floating point operations of setup()
+        """
+        return self._setup_flops
+
+    @property
+    def apply_flops(self):
+        r"""
+        Estimated number of floating point operations of one apply()
+        """
+        return self._apply_flops
+
+    @property
+    def nbytes(self):
+        r"""
+        Memory in bytes held by the preconditioner after setup()
+        """
+        return 0
+
+    def cost(self):
+        r"""
+        Summarize the setup and apply cost of the preconditioner.
+
+        Return:
+        dictionary with the name, the setup wall time, the
+        estimated setup and apply flops, and the memory footprint
+        """
+        return {
+            "name": self.name,
+            "setup_time": self._setup_time,
+            "setup_flops": self._setup_flops,
+            "apply_flops": self._apply_flops,
+            "nbytes": self.nbytes,
+        }
+
+    def setup(self, A, S):
+        r"""
+        Set up the preconditioner from A and S.
+
+        :param A: dense array or BSR matrix of shape (3n, 3n)
+        :param S: constraint matrices of shape (n, 3, 3)
+        """
+        start = time.perf_counter()
+        self._num_dofs = A.shape[0]
+        self._setup(A, S)
+        self._setup_time = time.perf_counter() - start
+
+    def _setup(self, A, S):
+        raise NotImplementedError
+
+    def apply(self, r, out=None):
+        r"""
+        Apply the inverse of the preconditioner to r.
+
+        :param r: vector of shape (3n, 1)
+        :param out: optional preallocated output of shape (3n, 1)
+
+        Return:
+        P^{-1} r, shape (3n, 1)
+        """
+        raise NotImplementedError
+
+    def apply_rows(self, r, out, rows):
+        r"""
+        Apply the inverse of a local preconditioner to some rows of
+        r only: out[rows] = (P^{-1} r)[rows].
+
+        :param r: vector of shape (3n, 1)
+        :param out: preallocated output of shape (3n, 1)
+        :param rows: slice of rows, starting and ending on particle
+            boundaries
+        """
+        raise NotImplementedError
+
+
+def estimate_diagonal(A, num_probes=32, seed=0):
+    r"""
+    Estimate the diagonal of a matrix-free operator by stochastic
+    probing (Bekas, Kokiopoulou and Saad, 07'):
+
+        diag(A) ~ sum_k v_k * (A v_k) / sum_k v_k * v_k
+
+    with Rademacher probe vectors v_k. Costs num_probes products
+    with A.
+
+    :param A: LinearOperator (or anything supporting A @ v) of
+        shape (3n, 3n)
+    :param num_probes: number of probe vectors
+    :param seed: seed of the probe vectors
+
+    Return:
+    estimated diagonal of shape (3n, )
+    """
+    rng = np.random.default_rng(seed)
+    num_dofs = A.shape[0]
+    numerator = np.zeros(num_dofs)
+    denominator = np.zeros(num_dofs)
+    for _ in range(num_probes):
+        v = rng.choice([-1.0, 1.0], size=num_dofs)
+        numerator += v * np.ravel(A @ v)
+        denominator += v * v
+    return numerator / denominator
+
+
+def diagonal_blocks(A):
+    r"""
+    Extract the 3x3 diagonal blocks of A.
+
+    :param A: dense array or BSR matrix (3x3 blocks) of shape (3n, 3n)
+
+    Return:
+    array of shape (n, 3, 3) holding A_ii for each particle i
+    """
+    if isinstance(A, LinearOperator):
+        raise ValueError(
+            "the diagonal blocks of a matrix-free A are not available")
+    num_particles = A.shape[0] // 3
+    if sp.issparse(A):
+        A_bsr = A if A.format == "bsr" and A.blocksize == (3, 3) \
+            else sp.bsr_matrix(A, blocksize=(3, 3))
+        blocks = np.zeros((num_particles, 3, 3), dtype=A_bsr.dtype)
+        # block row index of every stored block
+        block_rows = np.repeat(
+            np.arange(num_particles), np.diff(A_bsr.indptr))
+        on_diagonal = A_bsr.indices == block_rows
+        # accumulate, in case duplicate blocks were not summed
+        np.add.at(blocks, block_rows[on_diagonal], A_bsr.data[on_diagonal])
+        return blocks
+    A_4d = np.reshape(np.asarray(A), (num_particles, 3, num_particles, 3))
+    particle_indices = np.arange(num_particles)
+    return A_4d[particle_indices, :, particle_indices, :]
+
+
+class JacobiPreconditioner(Preconditioner):
+    r"""
+    Diagonal (Jacobi) preconditioner P = diag(A), as used by
+    Baraff and Witkin, 98'. Applying P^{-1} is an elementwise
+    product. For matrix-free A the diagonal is either given up
+    front or estimated with estimate_diagonal().
+    """
+
+    name = "jacobi"
+    local = True
+
+    def __init__(self, diag_in=None) -> None:
+        r"""
+        Constructor for JacobiPreconditioner
+
+        :param diag_in: optional diagonal of A of shape (3n, );
+            if given, it is used instead of reading the diagonal
+            off A
+        """
+        super().__init__()
+        self._diag_in = diag_in
+        self._inv_diag = None
+
+    @property
+    def nbytes(self):
+        return 0 if self._inv_diag is None else self._inv_diag.nbytes
+
+    def _setup(self, A, S):
+        if self._diag_in is not None:
+            diag = np.asarray(self._diag_in, dtype=A.dtype).ravel()
+        elif isinstance(A, LinearOperator):
+            diag = estimate_diagonal(A)
+            if np.any(diag <= 0):
+                raise ValueError(
+                    "estimated diagonal of A is not positive; "
+                    "pass the diagonal explicitly")
+        else:
+            diag = A.diagonal()
+        if np.any(diag == 0):
+            raise ValueError("Jacobi preconditioner needs a zero-free diagonal")
+        # (3n, 1) so it broadcasts against column vectors
+        self._inv_diag = np.expand_dims(1.0 / diag, axis=1).astype(A.dtype, copy=False)
+        self._setup_flops = diag.shape[0]
+        self._apply_flops = diag.shape[0]
+
+    def apply(self, r, out=None):
+        return np.multiply(self._inv_diag, r, out=out)
+
+    def apply_rows(self, r, out, rows):
+        np.multiply(self._inv_diag[rows], r[rows], out=out[rows])
+
+
+class BlockJacobiPreconditioner(Preconditioner):
+    r"""
+    3x3 block-Jacobi preconditioner. For each particle i the
+    diagonal block A_ii is restricted to the directions allowed
+    by its constraint matrix S_i, i.e. we invert
+
+        B_i = S_i A_ii S_i + (I - S_i)
+
+    and apply S_i B_i^{-1} S_i, so constrained directions are
+    neither mixed into nor produced by the preconditioner.
+    """
+
+    name = "block_jacobi"
+    local = True
+
+    def __init__(self) -> None:
+        r"""
+        Constructor for BlockJacobiPreconditioner
+        """
+        super().__init__()
+        self._inv_blocks = None
+
+    @property
+    def nbytes(self):
+        return 0 if self._inv_blocks is None else self._inv_blocks.nbytes
+
+    def _setup(self, A, S):
+        num_particles = A.shape[0] // 3
+        blocks = diagonal_blocks(A) # (n, 3, 3)
+        # B_i = S_i A_ii S_i + (I - S_i)
+        S_A_S = np.matmul(np.matmul(S, blocks), S)
+        B = S_A_S + (np.eye(3) - S)
+        # P_i^{-1} = S_i B_i^{-1} S_i
+        self._inv_blocks = np.matmul(np.matmul(S, np.linalg.inv(B)), S)
+        # two 3x3 products for S A S, one inverse, two products for
+        # S B^-1 S; a 3x3 product costs 45 flops
+        self._setup_flops = num_particles * (4*45 + 45 + 9)
+        # a 3x3 matrix-vector product per particle
+        self._apply_flops = num_particles * 15
+
+    def apply(self, r, out=None):
+        num_particles = self._inv_blocks.shape[0]
+        r_blocks = np.reshape(r, (num_particles, 3))
+        if out is None:
+            out = np.empty(r.shape, dtype=self._inv_blocks.dtype)
+        np.einsum(
+            "kij,kj->ki", self._inv_blocks, r_blocks,
+            out=np.reshape(out, (num_particles, 3)))
+        return out
+
+    def apply_rows(self, r, out, rows):
+        particles = slice(rows.start // 3, rows.stop // 3)
+        np.einsum(
+            "kij,kj->ki", self._inv_blocks[particles], np.reshape(r[rows], (-1, 3)),
+            out=np.reshape(out[rows], (-1, 3)))
+
+
+class IncompleteCholeskySymbolic:
+    r"""
+    Symbolic analysis of the IC(0) factorization of a sparsity
+    pattern, for the level-scheduled right-looking factorization of
+    IncompleteCholeskyPreconditioner.
+
+    Eliminating column k divides its entries by the pivot L_kk and
+    subtracts L_ik L_jk from every stored entry (i, j) with
+    i >= j > k: these updates (target, source, source) are listed
+    once here. Column k can be eliminated once every column j with
+    L_kj != 0 has been; columns are grouped into levels of columns
+    that can be eliminated together, level(k) = 1 + max level(j).
+    The numeric factorization is then a loop over the levels, each
+    a few vectorized operations.
+    """
+
+    def __init__(self, A_lower) -> None:
+        r"""
+        Constructor for IncompleteCholeskySymbolic
+
+        :param A_lower: lower triangle of A in CSR form, with sorted
+            indices and every diagonal entry stored
+        """
+        num_rows = A_lower.shape[0]
+        indptr, indices = A_lower.indptr, A_lower.indices
+        self._key = (A_lower.shape, indptr.tobytes(), indices.tobytes())
+        rows = np.repeat(np.arange(num_rows), np.diff(indptr))
+        # the diagonal entry ends every row
+        self._diagonal = indptr[1:] - 1
+        if np.any(np.diff(indptr) == 0) or np.any(indices[self._diagonal] != np.arange(num_rows)):
+            raise np.linalg.LinAlgError("incomplete Cholesky needs every diagonal entry of A")
+        # levels, from the strictly lower entries of each row
+        levels = [0]*num_rows
+        indptr_list, indices_list = indptr.tolist(), indices.tolist()
+        for k in range(num_rows):
+            level = 0
+            for position in range(indptr_list[k], indptr_list[k+1] - 1):
+                level = max(level, levels[indices_list[position]] + 1)
+            levels[k] = level
+        levels = np.array(levels, dtype=np.int64)
+        self._num_levels = int(np.max(levels)) + 1 if num_rows > 0 else 0
+        # strictly lower entries by column, then row
+        off_diagonal = np.flatnonzero(rows != indices)
+        entries = off_diagonal[np.lexsort((rows[off_diagonal], indices[off_diagonal]))]
+        entry_cols = indices[entries]
+        entry_rows = rows[entries]
+        col_counts = np.bincount(entry_cols, minlength=num_rows)
+        col_starts = np.cumsum(col_counts) - col_counts
+        # pair each entry (i, k) with the entries (j, k), j <= i, of
+        # its column; keep the pairs whose target (i, j) is stored
+        num_partners = np.arange(entries.shape[0]) - col_starts[entry_cols] + 1
+        first = np.repeat(np.arange(entries.shape[0]), num_partners)
+        second = col_starts[entry_cols[first]] + np.arange(first.shape[0]) - \
+            np.repeat(np.cumsum(num_partners) - num_partners, num_partners)
+        keys = rows.astype(np.int64)*num_rows + indices
+        target_keys = entry_rows[first].astype(np.int64)*num_rows + entry_rows[second]
+        targets = np.minimum(np.searchsorted(keys, target_keys), max(keys.shape[0] - 1, 0))
+        stored = keys[targets] == target_keys
+        first, second, targets = first[stored], second[stored], targets[stored]
+        # group the pivots, the entries and the updates by level
+        def by_level(level_of):
+            order = np.argsort(level_of, kind="stable")
+            return order, np.searchsorted(level_of[order], np.arange(self._num_levels + 1))
+        order, self._pivot_ptr = by_level(levels)
+        self._pivots = self._diagonal[order]
+        order, self._entry_ptr = by_level(levels[entry_cols])
+        self._entries = entries[order]
+        self._entry_pivots = self._diagonal[entry_cols[order]]
+        order, self._update_ptr = by_level(levels[entry_cols[first]])
+        self._update_targets = targets[order]
+        self._update_first = entries[first[order]]
+        self._update_second = entries[second[order]]
+
+    @property
+    def key(self):
+        r"""
+        Getter for the key of the analysed pattern
+        """
+        return self._key
+
+    @property
+    def num_levels(self):
+        r"""
+        Number of levels of the factorization
+        """
+        return self._num_levels
+
+    @property
+    def num_updates(self):
+        r"""
+        Number of multiply-subtract updates of the factorization
+        """
+        return self._update_targets.shape[0]
+
+    def factorize(self, data, shift):
+        r"""
+        Compute the IC(0) factor on the analysed pattern.
+
+        :param data: values of the lower triangle of A, in CSR order
+        :param shift: relative shift added to the diagonal
+
+        Return:
+        values of L on the pattern, or None if a non-positive pivot
+        was met
+        """
+        L_data = np.array(data, dtype=np.float64)
+        L_data[self._diagonal] *= 1.0 + shift
+        for level in range(self._num_levels):
+            # L_kk = sqrt(A_kk - sum_{j<k} L_kj^2) for the level's columns
+            pivots = self._pivots[self._pivot_ptr[level]:self._pivot_ptr[level+1]]
+            pivot_values = L_data[pivots]
+            if not np.all(pivot_values > 0):
+                return None
+            L_data[pivots] = np.sqrt(pivot_values)
+            # L_ik = (A_ik - sum_{j<k} L_ij L_kj) / L_kk
+            entries = slice(self._entry_ptr[level], self._entry_ptr[level+1])
+            L_data[self._entries[entries]] /= L_data[self._entry_pivots[entries]]
+            # A_ij -= L_ik L_jk for the stored (i, j) of later columns
+            updates = slice(self._update_ptr[level], self._update_ptr[level+1])
+            np.subtract.at(L_data, self._update_targets[updates],
+                           L_data[self._update_first[updates]] *
+                           L_data[self._update_second[updates]])
+        return L_data
+
+
+class IncompleteCholeskyPreconditioner(Preconditioner):
+    r"""
+    Zero fill-in incomplete Cholesky preconditioner, IC(0), of the
+    filtered matrix S A S + (I - S) (see filtered_matrix()):
+    P = L L^T where L has the sparsity of its lower triangle.
+    Applying P^{-1} takes one forward and one backward triangular
+    solve, between two filterings by S as in
+    BlockJacobiPreconditioner.
+
+    If a non-positive pivot is met, the factorization is retried
+    on A + shift * diag(A) with a growing shift (Manteuffel, 80').
+
+    The factorization is level-scheduled (see
+    IncompleteCholeskySymbolic): the symbolic analysis is done once
+    per sparsity pattern and kept across setups, and the numeric
+    factorization loops over the levels in Python with vectorized
+    work inside. For cloth on an N x N grid in the natural order
+    there are about 6N levels and 45 updates per unknown, so setup
+    is O(n) work in O(sqrt(n)) Python steps (24 ms at N = 64, plus
+    110 ms for the first analysis). The number of levels depends on
+    the ordering: it is the longest dependency chain, up to 3n for
+    a banded ordering of a long chain, where the loop degrades to
+    one column per step. The triangular solves of apply() are
+    sequential.
+    """
+
+    name = "ic0"
+
+    def __init__(self, initial_shift=1e-3, max_retries=10) -> None:
+        r"""
+        Constructor for IncompleteCholeskyPreconditioner
+
+        :param initial_shift: relative diagonal shift tried first
+            after a breakdown
+        :param max_retries: max number of shifted retries
+        """
+        super().__init__()
+        self._initial_shift = initial_shift
+        self._max_retries = max_retries
+        self._shift = 0.0
+        self._S = None
+        self._L = None
+        self._L_T = None
+        self._symbolic = None
+
+    @property
+    def shift(self):
+        r"""
+        Relative diagonal shift used by the last successful factorization
+        """
+        return self._shift
+
+    @property
+    def L(self):
+        r"""
+        Getter for the incomplete Cholesky factor L (CSR)
+        """
+        return self._L
+
+    @property
+    def symbolic(self):
+        r"""
+        Getter for the IncompleteCholeskySymbolic of the last setup
+        """
+        return self._symbolic
+
+    @property
+    def nbytes(self):
+        if self._L is None:
+            return 0
+        return 2 * (self._L.data.nbytes + self._L.indices.nbytes + self._L.indptr.nbytes)
+
+    def _setup(self, A, S):
+        if isinstance(A, LinearOperator):
+            raise ValueError(
+                "incomplete Cholesky needs an explicit matrix A")
+        self._S = S
+        A_lower = sp.tril(sp.csr_matrix(filtered_matrix(A, S)), format="csr")
+        A_lower.sum_duplicates()
+        A_lower.sort_indices()
+        if self._symbolic is None or self._symbolic.key != \
+                (A_lower.shape, A_lower.indptr.tobytes(), A_lower.indices.tobytes()):
+            self._symbolic = IncompleteCholeskySymbolic(A_lower)
+        shift = 0.0
+        for _ in range(self._max_retries + 1):
+            L_data = self.factorize(A_lower, shift, self._symbolic)
+            if L_data is not None:
+                break
+            shift = self._initial_shift if shift == 0.0 else 2.0 * shift
+        else:
+            raise np.linalg.LinAlgError(
+                "incomplete Cholesky factorization broke down")
+        self._shift = shift
+        self._L = sp.csr_matrix(
+            (L_data.astype(A.dtype, copy=False), A_lower.indices.copy(), A_lower.indptr.copy()),
+            shape=A_lower.shape)
+        self._L_T = self._L.T.tocsr()
+        # a multiply-subtract per update, a division per entry
+        self._setup_flops = 2*self._symbolic.num_updates + A_lower.nnz
+        self._apply_flops = 4 * self._L.nnz
+
+    @staticmethod
+    def factorize(A_lower, shift, symbolic=None):
+        r"""
+        Compute the IC(0) factor of a matrix given its lower triangle.
+
+        :param A_lower: lower triangle of A in CSR form, sorted indices
+        :param shift: relative shift added to the diagonal
+        :param symbolic: IncompleteCholeskySymbolic of the pattern of
+            A_lower; analysed here if None
+
+        Return:
+        values of L on the pattern of A_lower, or None if a
+        non-positive pivot was met
+        """
+        if symbolic is None:
+            try:
+                symbolic = IncompleteCholeskySymbolic(A_lower)
+            except np.linalg.LinAlgError:
+                # the diagonal entry is missing
+                return None
+        return symbolic.factorize(A_lower.data, shift)
+
+    def filter(self, v):
+        r"""
+        Compute S v for a vector v of shape (3n, ).
+        """
+        v_blocks = np.reshape(v, (self._S.shape[0], 3))
+        return np.einsum("kij,kj->ki", self._S, v_blocks).ravel()
+
+    def apply(self, r, out=None):
+        y = spsolve_triangular(self._L, self.filter(np.ravel(r)), lower=True)
+        y = spsolve_triangular(self._L_T, y, lower=False)
+        y = np.reshape(self.filter(y), r.shape)
+        if out is None:
+            return y
+        out[...] = y
+        return out
+
+
+def filtered_matrix(A, S):
+    r"""
+    Compute the filtered system matrix S A S + (I - S), which
+    acts as A on the free directions of every particle and as the
+    identity on its constrained directions.
+
+    :param A: dense array or sparse matrix of shape (3n, 3n)
+    :param S: constraint matrices of shape (n, 3, 3)
+
+    Return:
+    BSR matrix (3x3 blocks) of shape (3n, 3n)
+    """
+    num_particles = S.shape[0]
+    particle_indices = np.arange(num_particles)
+    S_bsr = sp.bsr_matrix(
+        (S, particle_indices, np.arange(num_particles + 1)), shape=A.shape)
+    I_minus_S = sp.bsr_matrix(
+        (np.eye(3) - S, particle_indices, np.arange(num_particles + 1)), shape=A.shape)
+    A_hat = S_bsr @ sp.csr_matrix(A) @ S_bsr + I_minus_S
+    return sp.bsr_matrix(A_hat, blocksize=(3, 3))
+
+def grid_prolongation_1d(num_points):
+    r"""
+    Linear interpolation from every other point of a 1D grid
+    (plus the last point) to the whole grid.
+
+    :param num_points: number of fine grid points
+
+    Return:
+    CSR matrix of shape (num_points, num_coarse_points)
+    """
+    coarse = np.arange(0, num_points, 2)
+    if coarse[-1] != num_points - 1:
+        coarse = np.append(coarse, num_points - 1)
+    rows, cols, vals = [], [], []
+    for coarse_index in range(coarse.shape[0]):
+        # coarse point itself
+        rows.append(coarse[coarse_index])
+        cols.append(coarse_index)
+        vals.append(1.0)
+        if coarse_index + 1 < coarse.shape[0]:
+            # fine points between two coarse points
+            a, b = coarse[coarse_index], coarse[coarse_index + 1]
+            for i in range(a + 1, b):
+                rows += [i, i]
+                cols += [coarse_index, coarse_index + 1]
+                vals += [(b - i) / (b - a), (i - a) / (b - a)]
+    return sp.csr_matrix((vals, (rows, cols)), shape=(num_points, coarse.shape[0]))
+
+
+class MultigridPreconditioner(Preconditioner):
+    r"""
+    Geometric multigrid preconditioner for cloth on a regular
+    (Nx+1) x (Ny+1) particle grid numbered as in
+    dhutils.standard_rectangle (column-major, j = jx*(Ny+1) + jy).
+
+    The hierarchy is built on the filtered operator
+    A_0 = S A S + (I - S), so constrained directions are decoupled
+    from the rest on the finest grid. Every coarser grid keeps
+    every other grid line and its operator is the Galerkin product
+    A_{l+1} = P_l^T A_l P_l, with P_l the bilinear interpolation
+    applied to each of the 3 components. Applying P^{-1} runs one
+    symmetric V-cycle (damped block-Jacobi smoothing, direct solve
+    on the coarsest grid) on S r and filters the result by S.
+    """
+
+    name = "multigrid"
+
+    def __init__(self, grid_shape=None, num_smoothing=2, coarse_max_particles=64,
+                 num_power_iterations=10) -> None:
+        r"""
+        Constructor for MultigridPreconditioner
+
+        :param grid_shape: (Nx, Ny), the number of grid segments in
+            x and y; None for a square grid inferred from the number
+            of particles
+        :param num_smoothing: number of pre- and of post-smoothing
+            steps on each level
+        :param coarse_max_particles: coarsening stops once a grid
+            has at most this many particles
+        :param num_power_iterations: number of power iterations to
+            estimate the largest eigenvalue of D^{-1} A of each
+            level, which sets the smoother's damping
+        """
+        super().__init__()
+        self._grid_shape = grid_shape
+        self._num_smoothing = num_smoothing
+        self._coarse_max_particles = coarse_max_particles
+        self._num_power_iterations = num_power_iterations
+        self._S = None
+        # per level: operator, damped inverse diagonal blocks,
+        # prolongation to this level from the next one
+        self._A_levels = []
+        self._inv_blocks_levels = []
+        self._P_levels = []
+        self._coarse_factor = None
+
+    @property
+    def num_levels(self):
+        r"""
+        Number of grids in the hierarchy, including the finest
+        """
+        return len(self._A_levels)
+
+    @property
+    def nbytes(self):
+        total = 0
+        for M in self._A_levels + self._P_levels:
+            total += M.data.nbytes + M.indices.nbytes + M.indptr.nbytes
+        for inv_blocks in self._inv_blocks_levels:
+            total += inv_blocks.nbytes
+        if self._coarse_factor is not None:
+            total += self._coarse_factor[0].nbytes
+        return total
+
+    def _setup(self, A, S):
+        if isinstance(A, LinearOperator):
+            raise ValueError("multigrid needs an explicit matrix A")
+        num_particles = A.shape[0] // 3
+        if self._grid_shape is None:
+            side = int(round(np.sqrt(num_particles)))
+            if side*side != num_particles:
+                raise ValueError(
+                    f"{num_particles} particles do not form a square grid; pass grid_shape")
+            grid_shape = (side - 1, side - 1)
+        else:
+            grid_shape = tuple(self._grid_shape)
+        num_points = (grid_shape[0] + 1, grid_shape[1] + 1)
+        if num_points[0]*num_points[1] != num_particles:
+            raise ValueError(
+                f"grid {grid_shape} has {num_points[0]*num_points[1]} particles, "
+                f"A has {num_particles}")
+        dtype = A.dtype
+        self._S = S
+        self._A_levels = []
+        self._inv_blocks_levels = []
+        self._P_levels = []
+        self._setup_flops = 0
+        self._apply_flops = 0
+
+        A_level = filtered_matrix(A, S).astype(dtype)
+        while True:
+            self._A_levels.append(A_level)
+            # a V-cycle costs 2*num_smoothing + 1 products with A_l
+            self._apply_flops += 2*(2*self._num_smoothing + 1)*A_level.nnz
+            if num_points[0]*num_points[1] <= self._coarse_max_particles or \
+                    max(num_points) <= 2:
+                break
+            self._inv_blocks_levels.append(self.smoother_blocks(A_level))
+            # bilinear interpolation, x is the slow index
+            P_1d_x = grid_prolongation_1d(num_points[0])
+            P_1d_y = grid_prolongation_1d(num_points[1])
+            P = sp.kron(sp.kron(P_1d_x, P_1d_y), sp.eye(3), format="bsr").astype(dtype)
+            P.sort_indices()
+            self._P_levels.append(P)
+            A_P = A_level @ P
+            # each entry of A_l and of A_l P meets about nnz(P)/rows(P)
+            # entries of P in the Galerkin products
+            self._setup_flops += int(2*(A_level.nnz + A_P.nnz)*P.nnz / P.shape[0])
+            A_level = sp.bsr_matrix(P.T @ A_P, blocksize=(3, 3))
+            A_level.sort_indices()
+            self._apply_flops += 4*P.nnz
+            num_points = (P_1d_x.shape[1], P_1d_y.shape[1])
+        # the coarsest grid is solved directly
+        self._coarse_factor = cho_factor(A_level.toarray())
+        self._setup_flops += A_level.shape[0]**3 // 3
+
+    def smoother_blocks(self, A_level):
+        r"""
+        Damped inverse 3x3 diagonal blocks omega D^{-1} of A_level,
+        with omega = 4/(3 lambda_max(D^{-1} A_level)) so that the
+        smoother damps the high frequencies without diverging.
+
+        :param A_level: BSR matrix of one level
+
+        Return:
+        array of shape (n_l, 3, 3)
+        """
+        inv_blocks = np.linalg.inv(diagonal_blocks(A_level))
+        num_particles = inv_blocks.shape[0]
+        # power iteration on D^{-1} A, from a fixed start
+        v = np.cos(np.arange(3*num_particles, dtype=A_level.dtype))
+        lambda_max = 1.0
+        for _ in range(self._num_power_iterations):
+            w = np.einsum("kij,kj->ki", inv_blocks,
+                          np.reshape(A_level @ v, (num_particles, 3))).ravel()
+            lambda_max = np.linalg.norm(w) / np.linalg.norm(v)
+            v = w / np.linalg.norm(w)
+        return (4.0 / (3.0*lambda_max)) * inv_blocks
+
+    def smooth(self, level, x, b):
+        r"""
+        Damped block-Jacobi steps x <- x + omega D^{-1} (b - A_l x).
+
+        :param level: level index
+        :param x: current iterate of shape (3n_l, ); updated in place
+        :param b: right-hand side of shape (3n_l, )
+        """
+        inv_blocks = self._inv_blocks_levels[level]
+        A_level = self._A_levels[level]
+        shape = (inv_blocks.shape[0], 3)
+        for _ in range(self._num_smoothing):
+            r = np.reshape(b - A_level @ x, shape)
+            x += np.einsum("kij,kj->ki", inv_blocks, r).ravel()
+
+    def v_cycle(self, level, b):
+        r"""
+        Approximately solve A_l x = b with one V-cycle from x = 0.
+
+        :param level: level index
+        :param b: right-hand side of shape (3n_l, )
+
+        Return:
+        x of shape (3n_l, )
+        """
+        if level == len(self._A_levels) - 1:
+            return cho_solve(self._coarse_factor, b)
+        x = np.zeros_like(b)
+        self.smooth(level, x, b)
+        # coarse grid correction
+        P = self._P_levels[level]
+        r = b - self._A_levels[level] @ x
+        x += P @ self.v_cycle(level + 1, P.T @ r)
+        self.smooth(level, x, b)
+        return x
+
+    def filter(self, v):
+        r"""
+        Compute S v for a vector v of shape (3n, ).
+        """
+        v_blocks = np.reshape(v, (self._S.shape[0], 3))
+        return np.einsum("kij,kj->ki", self._S, v_blocks).ravel()
+
+    def apply(self, r, out=None):
+        y = self.filter(self.v_cycle(0, self.filter(np.ravel(r))))
+        y = np.reshape(y, r.shape)
+        if out is None:
+            return y
+        out[...] = y
+        return out
+
+
+PRECONDITIONERS = {
+    JacobiPreconditioner.name: JacobiPreconditioner,
+    BlockJacobiPreconditioner.name: BlockJacobiPreconditioner,
+    IncompleteCholeskyPreconditioner.name: IncompleteCholeskyPreconditioner,
+    MultigridPreconditioner.name: MultigridPreconditioner,
+}
+
+def make_preconditioner(preconditioner_in):
+    r"""
+    Build a preconditioner from a name or pass an instance through.
+
+    :param preconditioner_in: None (Jacobi), one of the names in
+        PRECONDITIONERS, or a Preconditioner instance
+
+    Return:
+    a Preconditioner instance
+    """
+    if preconditioner_in is None:
+        return JacobiPreconditioner()
+    if isinstance(preconditioner_in, Preconditioner):
+        return preconditioner_in
+    if preconditioner_in not in PRECONDITIONERS:
+        raise ValueError(
+            f"unknown preconditioner {preconditioner_in!r}; "
+            f"expected one of {sorted(PRECONDITIONERS)}")
+    return PRECONDITIONERS[preconditioner_in]()
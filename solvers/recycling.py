@@ -0,0 +1,170 @@
+import numpy as np
+
+class KrylovRecycler:
+    r"""
+    Deflation space recycled across MPCG solves (deflated CG,
+    Saad, Yeung, Erhel and Guyomarc'h, 00').
+
+    The recycler keeps k vectors W spanning approximate
+    eigenvectors of the filtered A for its smallest eigenvalues,
+    and MPCG keeps every search direction A-orthogonal to them, so
+    those eigenvalues no longer slow down convergence. After each
+    solve, W is refreshed by Rayleigh-Ritz on span(W, first m
+    search directions); the directions and their products with A
+    are already computed by MPCG, so harvesting costs no extra
+    products with A.
+
+    Since A changes between time steps, A W is recomputed at the
+    start of every solve (k products). W is discarded when the
+    constraint set or the number of particles changes.
+    """
+
+    def __init__(self, num_vectors=8, num_stored=24, drop_tol=1e-10) -> None:
+        r"""
+        Constructor for KrylovRecycler
+
+        :param num_vectors: number k of deflation vectors kept
+        :param num_stored: number m of search directions of each
+            solve kept for the Rayleigh-Ritz step
+        :param drop_tol: directions whose relative singular value
+            (or A-norm) falls below drop_tol are dropped as linearly
+            dependent
+        """
+        self._num_vectors = num_vectors
+        self._num_stored = num_stored
+        self._drop_tol = drop_tol
+        self._W = None
+        self._A_W = None
+        self._constraint_key = None
+        self._stored_c = []
+        self._stored_q = []
+        self._ritz_values = None
+
+    @property
+    def W(self):
+        r"""
+        Getter for the deflation vectors, shape (3n, k), or None
+        """
+        return self._W
+
+    @property
+    def num_vectors(self):
+        r"""
+        Number of deflation vectors currently held
+        """
+        return 0 if self._W is None else self._W.shape[1]
+
+    @property
+    def ritz_values(self):
+        r"""
+        Ritz values of the filtered A for the current W, smallest first
+        """
+        return self._ritz_values
+
+    def reset(self):
+        r"""
+        Discard the deflation space.
+        """
+        self._W = None
+        self._A_W = None
+        self._ritz_values = None
+        self._stored_c = []
+        self._stored_q = []
+
+    def prepare(self, solver):
+        r"""
+        Set up the deflation of a solve: discard W if the constraint
+        set changed, then compute A W with the current A and make W
+        A-orthonormal (W^T A W = I).
+
+        :param solver: MPCGSolver about to solve
+        """
+        S = solver.S
+        constraint_key = (S.shape[0], solver.constrained_particles.tobytes(),
+                          S[solver.constrained_particles].tobytes())
+        if constraint_key != self._constraint_key:
+            self.reset()
+            self._constraint_key = constraint_key
+        self._stored_c = []
+        self._stored_q = []
+        if self._W is None:
+            return
+        # A W for the current A, one product per vector
+        A_W = np.empty_like(self._W)
+        q = np.empty((self._W.shape[0], 1), dtype=self._W.dtype)
+        for j in range(self._W.shape[1]):
+            solver.matvec(self._W[:, j:j+1], out=q)
+            solver.filter(q, out=q)
+            A_W[:, j] = q[:, 0]
+        # A-orthonormalize: W <- W V L^{-1/2} with W^T A W = V L V^T
+        E = np.transpose(self._W) @ A_W
+        eigenvalues, V = np.linalg.eigh(0.5*(E + np.transpose(E)))
+        keep = eigenvalues > self._drop_tol*max(eigenvalues[-1], 0.0)
+        if not np.any(keep):
+            self.reset()
+            return
+        T = V[:, keep] / np.sqrt(eigenvalues[keep])
+        self._W = self._W @ T
+        self._A_W = A_W @ T
+
+    def project_initial(self, del_v, r):
+        r"""
+        Galerkin-correct the initial iterate on span(W), so that the
+        initial residual is orthogonal to W:
+        del_v += W W^T r, r -= A W W^T r.
+
+        :param del_v: initial iterate of shape (3n, 1); updated in place
+        :param r: its filtered residual of shape (3n, 1); updated in place
+        """
+        if self._W is None:
+            return
+        mu = np.transpose(self._W) @ r
+        del_v += self._W @ mu
+        r -= self._A_W @ mu
+
+    def project(self, c):
+        r"""
+        Make a search direction A-orthogonal to W: c -= W (A W)^T c.
+
+        :param c: direction of shape (3n, 1); updated in place
+        """
+        if self._W is None:
+            return
+        c -= self._W @ (np.transpose(self._A_W) @ c)
+
+    def record(self, c, q):
+        r"""
+        Keep a search direction c and q = filter(A c) for the next
+        Rayleigh-Ritz step, up to num_stored of them per solve.
+        """
+        if len(self._stored_c) < self._num_stored:
+            self._stored_c.append(c[:, 0].copy())
+            self._stored_q.append(q[:, 0].copy())
+
+    def harvest(self):
+        r"""
+        Refresh W after a solve: Rayleigh-Ritz for the filtered A on
+        span(W, stored directions), keeping the Ritz vectors of the
+        num_vectors smallest Ritz values.
+        """
+        if len(self._stored_c) == 0:
+            return
+        Z = np.stack(self._stored_c, axis=1)
+        A_Z = np.stack(self._stored_q, axis=1)
+        if self._W is not None:
+            Z = np.concatenate([self._W, Z], axis=1)
+            A_Z = np.concatenate([self._A_W, A_Z], axis=1)
+        self._stored_c = []
+        self._stored_q = []
+        # orthonormal basis Q = Z V S^{-1} of span(Z)
+        U, sigma, Vt = np.linalg.svd(Z, full_matrices=False)
+        keep = sigma > self._drop_tol*sigma[0]
+        Q = U[:, keep]
+        A_Q = A_Z @ (np.transpose(Vt[keep]) / sigma[keep])
+        # Rayleigh-Ritz: H = Q^T A Q
+        H = np.transpose(Q) @ A_Q
+        ritz_values, Y = np.linalg.eigh(0.5*(H + np.transpose(H)))
+        k = min(self._num_vectors, ritz_values.shape[0])
+        self._ritz_values = ritz_values[:k]
+        self._W = Q @ Y[:, :k]
+        self._A_W = None
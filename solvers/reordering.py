@@ -0,0 +1,222 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+def particle_graph(A):
+    r"""
+    Adjacency of the particles coupled by A: particles i and j are
+    adjacent when the 3x3 block (i, j) of A is stored (BSR) or
+    nonzero (dense).
+
+    :param A: dense array or scipy sparse matrix of shape (3n, 3n)
+
+    Return:
+    CSR matrix of shape (n, n)
+    """
+    num_particles = A.shape[0] // 3
+    if sp.issparse(A):
+        if A.format != "bsr" or A.blocksize != (3, 3):
+            A = sp.bsr_matrix(A, blocksize=(3, 3))
+        return sp.csr_matrix(
+            (np.ones(A.indices.shape[0]), A.indices, A.indptr),
+            shape=(num_particles, num_particles))
+    blocks = np.reshape(np.asarray(A) != 0, (num_particles, 3, num_particles, 3))
+    return sp.csr_matrix(np.any(blocks, axis=(1, 3)).astype(np.float64))
+
+def mesh_graph(faces, num_particles):
+    r"""
+    Adjacency of the particles sharing an edge of a triangle mesh.
+
+    :param faces: array of shape (F, 3)
+    :param num_particles: n
+
+    Return:
+    CSR matrix of shape (n, n)
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    rows = np.concatenate([faces[:, 0], faces[:, 1], faces[:, 2]])
+    cols = np.concatenate([faces[:, 1], faces[:, 2], faces[:, 0]])
+    graph = sp.coo_matrix((np.ones(rows.shape[0]), (rows, cols)),
+                          shape=(num_particles, num_particles)).tocsr()
+    return graph + graph.T
+
+def block_bandwidth(A):
+    r"""
+    Bandwidth of A counted in particles: max |i - j| over the
+    stored 3x3 blocks (i, j).
+
+    :param A: dense array or scipy sparse matrix of shape (3n, 3n)
+    """
+    graph = particle_graph(A).tocoo()
+    if graph.nnz == 0:
+        return 0
+    return int(np.max(np.abs(graph.row - graph.col)))
+
+class ParticleOrdering:
+    r"""
+    Renumbering of the n particles of a system, e.g. the reverse
+    Cuthill-McKee ordering of the particle graph (Cuthill and McKee,
+    69'), which gathers the nonzero blocks of A close to the
+    diagonal. Mesh generators and glTF files number particles in
+    whatever order they like; after reordering, the particles a row
+    of A couples are close in memory, so products with A and the
+    preconditioners touch fewer cache lines.
+
+    Everything indexed by particle (positions, velocities, z, S,
+    faces, A, b) must be permuted with the same ordering, and
+    solutions permuted back with unpermute_vector().
+    permutation[k] is the old index of the particle that becomes
+    particle k.
+    """
+
+    def __init__(self, permutation) -> None:
+        r"""
+        Constructor for ParticleOrdering
+
+        :param permutation: array of shape (n, ); permutation[k] is
+            the old index of new particle k
+        """
+        self._permutation = np.asarray(permutation, dtype=np.int64)
+        num_particles = self._permutation.shape[0]
+        self._inverse = np.empty(num_particles, dtype=np.int64)
+        self._inverse[self._permutation] = np.arange(num_particles)
+        if not np.array_equal(self._permutation[self._inverse], np.arange(num_particles)):
+            raise ValueError("permutation must contain every particle index once")
+        # permutation of the 3n unknowns
+        self._dof_permutation = np.ravel(
+            3*self._permutation[:, None] + np.arange(3)[None, :])
+
+    @classmethod
+    def identity(cls, num_particles):
+        r"""
+        Ordering that keeps the particles in place.
+        """
+        return cls(np.arange(num_particles))
+
+    @classmethod
+    def rcm(cls, graph):
+        r"""
+        Reverse Cuthill-McKee ordering of a particle graph.
+
+        :param graph: symmetric sparse (n, n) adjacency, e.g. from
+            particle_graph() or mesh_graph()
+        """
+        return cls(reverse_cuthill_mckee(sp.csr_matrix(graph), symmetric_mode=True))
+
+    @classmethod
+    def from_matrix(cls, A):
+        r"""
+        Reverse Cuthill-McKee ordering of the particles coupled by A.
+
+        :param A: dense array or scipy sparse matrix of shape (3n, 3n)
+        """
+        return cls.rcm(particle_graph(A))
+
+    @classmethod
+    def from_faces(cls, faces, num_particles):
+        r"""
+        Reverse Cuthill-McKee ordering of the vertices of a triangle
+        mesh, to apply before assembling A.
+
+        :param faces: array of shape (F, 3)
+        :param num_particles: n
+        """
+        return cls.rcm(mesh_graph(faces, num_particles))
+
+    @property
+    def permutation(self):
+        r"""
+        Getter for the permutation; entry k is the old index of new
+        particle k
+        """
+        return self._permutation
+
+    @property
+    def inverse(self):
+        r"""
+        Getter for the inverse permutation; entry i is the new index
+        of old particle i
+        """
+        return self._inverse
+
+    @property
+    def num_particles(self):
+        r"""
+        Number of particles n
+        """
+        return self._permutation.shape[0]
+
+    def permute_particles(self, x):
+        r"""
+        Reorder a per-particle array, e.g. positions, velocities or z.
+
+        :param x: array of shape (n, ...)
+
+        Return:
+        reordered copy of x
+        """
+        return np.asarray(x)[self._permutation]
+
+    def unpermute_particles(self, x):
+        r"""
+        Undo permute_particles().
+        """
+        return np.asarray(x)[self._inverse]
+
+    def permute_vector(self, v):
+        r"""
+        Reorder a vector of the 3n unknowns, e.g. b.
+
+        :param v: array of shape (3n, ) or (3n, 1)
+
+        Return:
+        reordered copy of v, of the same shape
+        """
+        return np.asarray(v)[self._dof_permutation]
+
+    def unpermute_vector(self, v):
+        r"""
+        Undo permute_vector(), e.g. on a solution.
+        """
+        v_out = np.empty_like(v)
+        v_out[self._dof_permutation] = v
+        return v_out
+
+    def permute_constraints(self, S):
+        r"""
+        Reorder a constraint list of length n (see MPCGSolver).
+        """
+        return [S[particle_index] for particle_index in self._permutation]
+
+    def permute_faces(self, faces):
+        r"""
+        Renumber the vertices of a face array of shape (F, 3).
+        """
+        return self._inverse[np.asarray(faces, dtype=np.int64)]
+
+    def permute_matrix(self, A):
+        r"""
+        Compute P A P^T, i.e. reorder the block rows and block
+        columns of A.
+
+        :param A: dense array or scipy sparse matrix of shape (3n, 3n)
+
+        Return:
+        reordered A; BSR matrix with 3x3 blocks and sorted indices
+        for sparse A, dense array otherwise
+        """
+        if not sp.issparse(A):
+            return np.asarray(A)[np.ix_(self._dof_permutation, self._dof_permutation)]
+        if A.format != "bsr" or A.blocksize != (3, 3):
+            A = sp.bsr_matrix(A, blocksize=(3, 3))
+        # new block row k is old block row permutation[k]
+        row_starts = A.indptr[self._permutation]
+        row_lengths = A.indptr[self._permutation + 1] - row_starts
+        indptr = np.zeros(self.num_particles + 1, dtype=A.indptr.dtype)
+        np.cumsum(row_lengths, out=indptr[1:])
+        # position of each new block in the old storage
+        source = np.repeat(row_starts - indptr[:-1], row_lengths) + np.arange(indptr[-1])
+        A_out = sp.bsr_matrix(
+            (A.data[source], self._inverse[A.indices[source]], indptr), shape=A.shape)
+        A_out.sort_indices()
+        return A_out
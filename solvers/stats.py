@@ -0,0 +1,85 @@
+import numpy as np
+
+# reasons why an iterative solve stopped
+CONVERGED = "converged"
+MAX_ITER = "max_iter"
+BREAKDOWN = "breakdown"
+
+class SolveStats:
+    r"""
+    Statistics about one call to a solver's solve().
+    """
+
+    def __init__(self) -> None:
+        r"""
+        Constructor for SolveStats
+        """
+        # number of iterations taken
+        self.num_iterations = 0
+        # residual norm before the first and after each iteration;
+        # for preconditioned solvers this is sqrt(r^T P^{-1} r)
+        self.residual_history = []
+        # wall time in seconds spent building the solver (and its
+        # preconditioner) and spent iterating
+        self.setup_time = 0.0
+        self.solve_time = 0.0
+        # number of products with the system matrix
+        self.num_matvecs = 0
+        # one of CONVERGED, MAX_ITER, BREAKDOWN
+        self.termination = None
+
+    @property
+    def converged(self):
+        r"""
+        Whether the solve reached the requested tolerance
+        """
+        return self.termination == CONVERGED
+
+    @property
+    def final_residual(self):
+        r"""
+        Last entry of the residual history, or None if empty
+        """
+        if len(self.residual_history) == 0:
+            return None
+        return self.residual_history[-1]
+
+    def to_dict(self):
+        r"""
+        Convert to a dictionary of plain Python values, e.g. to
+        dump as JSON.
+        """
+        return {
+            "num_iterations": int(self.num_iterations),
+            "residual_history": [float(res) for res in self.residual_history],
+            "setup_time": float(self.setup_time),
+            "solve_time": float(self.solve_time),
+            "num_matvecs": int(self.num_matvecs),
+            "termination": self.termination,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"SolveStats(termination={self.termination!r}, "
+            f"num_iterations={self.num_iterations}, "
+            f"num_matvecs={self.num_matvecs}, "
+            f"final_residual={self.final_residual}, "
+            f"setup_time={self.setup_time:.3g}, "
+            f"solve_time={self.solve_time:.3g})")
+
+
+def is_converged(delta, delta_0, rtol, atol):
+    r"""
+    Convergence test shared by the solvers: stop once the
+    squared residual norm delta is below rtol^2 * delta_0 or
+    below atol^2.
+
+    :param delta: current squared residual norm
+    :param delta_0: squared residual norm of the right-hand side
+    :param rtol: relative tolerance on the residual norm
+    :param atol: absolute tolerance on the residual norm
+
+    Return:
+    True if converged
+    """
+    return delta <= max(np.power(rtol, 2)*delta_0, np.power(atol, 2))
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from solvers.api import AUTO_DIRECT_MAX_DOFS, AUTO_SPARSIFY_MIN_DOFS, SOLVERS, LinearSystem, auto_method, solve
+from solvers.mpcg import MPCGSolver
+from solvers.test_mpcg import build_chain_system
+
+def test_methods_agree_unconstrained():
+    r"""
+    case: every method solves an unconstrained chain system to the
+    requested tolerance and returns an (m, 1) solution with stats
+    """
+    A, b = build_chain_system(6)
+    x_ref = np.linalg.solve(A, np.expand_dims(b, axis=1))
+    system = LinearSystem(A, b)
+    for method in SOLVERS:
+        result = solve(system, method=method, rtol=1e-10, max_iter=5000)
+        assert result.method == method
+        assert result.x.shape == (18, 1)
+        assert result.converged
+        if method != "cholesky":
+            # iterative methods
+            assert result.num_iterations > 0
+            assert result.stats.num_matvecs > result.num_iterations
+        assert np.linalg.norm(result.x - x_ref) < 1e-6*np.linalg.norm(x_ref)
+
+def test_options_are_shared():
+    r"""
+    case: max_iter and x_0 behave the same for CG and MPCG
+    """
+    A, b = build_chain_system(6)
+    system = LinearSystem(A, b)
+    for method in ("sd", "cg", "mpcg"):
+        result = solve(system, method=method, max_iter=2)
+        assert result.num_iterations == 2
+        assert not result.converged
+        # starting from the solution, no iteration is needed
+        x_ref = np.linalg.solve(A, b)
+        result = solve(system, method=method, x_0=x_ref, atol=1e-8)
+        assert result.num_iterations == 0
+        assert result.converged
+
+def test_constrained_system():
+    r"""
+    case: MPCG honours the constraints; CG and SD refuse them
+    """
+    A, b = build_chain_system(4)
+    S = [(np.array([0.0, 0, 1]), ), (), (), (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]))]
+    z = np.zeros((4, 3))
+    z[0, 2] = 0.5
+    system = LinearSystem(A, b, S, z)
+    assert system.num_constrained == 2
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    result = solve(system)
+    assert result.method == "mpcg"
+    assert np.linalg.norm(result.x - x_ref) < 1e-9
+    for method in ("cg", "sd"):
+        with pytest.raises(ValueError):
+            solve(system, method=method)
+    with pytest.raises(ValueError):
+        solve(system, method="unknown")
+
+def test_auto_method():
+    r"""
+    case: "auto" picks Cholesky for small sparse particle systems,
+    otherwise CG without constraints and MPCG with them, and stores
+    large mostly-zero dense A as BSR
+    """
+    A = np.array([[3.0, 2], [2, 6]])
+    method, _ = auto_method(LinearSystem(A, np.array([2.0, -8])))
+    assert method == "cg"
+    result = solve(LinearSystem(A, np.array([2.0, -8])))
+    assert np.linalg.norm(result.x[:, 0] - np.array([2.0, -2])) < 1e-9
+
+    A, b = build_chain_system(4)
+    method, system = auto_method(LinearSystem(A, b))
+    assert method == "cg"
+    assert not system.is_sparse
+    S = [()]*4
+    S[1] = (np.array([0.0, 1, 0]), )
+    method, system = auto_method(LinearSystem(A, b, S))
+    assert method == "mpcg"
+    assert not system.is_sparse
+
+    # below and above the size threshold of the BSR conversion;
+    # small sparse systems are solved directly
+    num_particles = AUTO_SPARSIFY_MIN_DOFS // 3
+    for size, expected in ((num_particles - 1, "mpcg"), (num_particles, "cholesky")):
+        A, b = build_chain_system(size)
+        S = [()]*size
+        S[0] = (np.array([1.0, 0, 0]), )
+        method, system = auto_method(LinearSystem(A, b, S))
+        assert method == expected
+        assert system.is_sparse == (expected == "cholesky")
+        result = solve(LinearSystem(A, b, S), rtol=1e-10)
+        assert result.method == expected and result.converged
+        x_ref = MPCGSolver(A, b, S, np.zeros((size, 3)), rtol=1e-12).solve()
+        assert np.linalg.norm(result.x - x_ref) < 1e-8*np.linalg.norm(x_ref)
+
+    # at and above the size threshold of the direct solve
+    for num_particles, unconstrained, constrained in (
+            (AUTO_DIRECT_MAX_DOFS // 3, "cholesky", "cholesky"),
+            (AUTO_DIRECT_MAX_DOFS // 3 + 1, "cg", "mpcg")):
+        chain = sp.diags([-1.0, 2.5, -1.0], [-1, 0, 1], shape=(num_particles, num_particles))
+        A = sp.bsr_matrix(sp.kron(chain, np.eye(3)), blocksize=(3, 3))
+        b = np.ones(3*num_particles)
+        S = [()]*num_particles
+        S[0] = (np.array([0.0, 0, 1]), )
+        assert auto_method(LinearSystem(A, b))[0] == unconstrained
+        assert auto_method(LinearSystem(A, b, S))[0] == constrained
+
+def test_matrix_free_cg():
+    r"""
+    case: CG through a callable A
+    """
+    A, b = build_chain_system(5)
+    A_sparse = sp.csr_matrix(A)
+    system = LinearSystem(lambda v: A_sparse @ v, b)
+    assert system.is_matrix_free
+    result = solve(system, method="cg", rtol=1e-10)
+    x_ref = np.linalg.solve(A, np.expand_dims(b, axis=1))
+    assert np.linalg.norm(result.x - x_ref) < 1e-8*np.linalg.norm(x_ref)
+
+if __name__ == "__main__":
+    test_methods_agree_unconstrained()
+    test_options_are_shared()
+    test_constrained_system()
+    test_auto_method()
+    test_matrix_free_cg()
@@ -0,0 +1,77 @@
+import numpy as np
+import scipy.sparse as sp
+from solvers.batched_mpcg import BatchedMPCGSolver
+from solvers.mpcg import MPCGSolver
+from solvers.stats import CONVERGED, MAX_ITER
+from solvers.test_mpcg import build_chain_system
+
+def build_batch(num_systems, num_particles):
+    r"""
+    Build a batch of chain systems with different values.
+
+    Return:
+    - list of dense A_k;
+    - array of b_k of shape (B, 3n)
+    """
+    A, b = build_chain_system(num_particles)
+    As = [A + k*np.eye(3*num_particles) for k in range(num_systems)]
+    bs = np.stack([np.roll(b, k) for k in range(num_systems)])
+    return As, bs
+
+def test_solve_dense_batch_matches_single():
+    r"""
+    case: 4 dense systems with shared constraints
+    """
+    As, bs = build_batch(4, 5)
+    S = [(), (np.array([0, 0, 1]), ), (), (), (np.array([1, 0, 0]), np.array([0, 1, 0]))]
+    z = np.zeros((5, 3))
+    z[1, 2] = 0.2
+    z[4, 0] = -0.3
+    batched_solver = BatchedMPCGSolver(np.stack(As), bs, S, z)
+    xs = batched_solver.solve()
+    assert xs.shape == (4, 15, 1)
+    for k in range(4):
+        mpcg_solver = MPCGSolver(As[k], bs[k], S, z)
+        x_ref = mpcg_solver.solve()
+        assert np.linalg.norm(xs[k] - x_ref) < 1e-9
+        assert batched_solver.stats[k].termination == CONVERGED
+        assert batched_solver.stats[k].num_iterations == mpcg_solver.num_iterations
+
+def test_solve_sparse_batch_per_system_constraints():
+    r"""
+    case: 6 sparse systems with one sparsity pattern and
+    per-system constraints and constrained velocities; systems
+    converge at different iterations, so the working set gets
+    compacted
+    """
+    As, bs = build_batch(6, 5)
+    Ss = [[()]*5 for _ in range(6)]
+    for k in range(6):
+        Ss[k][k % 5] = (np.array([0, 1, 0]), )
+    zs = np.zeros((6, 5, 3))
+    for k in range(6):
+        zs[k, k % 5, 1] = 0.1*k
+    batched_solver = BatchedMPCGSolver(
+        [sp.bsr_matrix(A, blocksize=(3, 3)) for A in As], bs, Ss, zs)
+    assert batched_solver.is_sparse
+    xs = batched_solver.solve()
+    for k in range(6):
+        x_ref = MPCGSolver(As[k], bs[k], Ss[k], zs[k]).solve()
+        assert np.linalg.norm(xs[k] - x_ref) < 1e-9
+
+def test_solve_batch_max_iter():
+    r"""
+    case: iteration budget applies to every system
+    """
+    As, bs = build_batch(3, 6)
+    batched_solver = BatchedMPCGSolver(np.stack(As), bs, [()]*6, np.zeros((6, 3)), max_iter=2)
+    batched_solver.solve()
+    for stats in batched_solver.stats:
+        assert stats.termination == MAX_ITER
+        assert stats.num_iterations == 2
+        assert len(stats.residual_history) == 3
+
+if __name__ == "__main__":
+    test_solve_dense_batch_matches_single()
+    test_solve_sparse_batch_per_system_constraints()
+    test_solve_batch_max_iter()
@@ -1,5 +1,6 @@
 import numpy as np
 from solvers.cg import CGSolver
+from solvers.sd import SDSolver
 
 def test_solve_2d():
     r"""
@@ -13,5 +14,64 @@ def test_solve_2d():
     x_ref = np.matmul(np.linalg.inv(A), np.expand_dims(b, axis=1))
     assert np.linalg.norm(x - x_ref) < 1e-9
 
+def test_residual_recurrence():
+    r"""
+    For CG and SD, the residual recurrence solves an SPD system to
+    the same accuracy as recomputing b - A x every iteration, with
+    about half the products with A
+    """
+    rng = np.random.default_rng(0)
+    Q = rng.standard_normal((40, 40))
+    A = Q @ Q.T + 40*np.eye(40)
+    b = rng.standard_normal(40)
+    x_ref = np.linalg.solve(A, np.expand_dims(b, axis=1))
+    for solver_class in (CGSolver, SDSolver):
+        # recompute the true residual every iteration, as before
+        solver = solver_class(A, b, 500, residual_replacement=1)
+        xs, _ = solver.solve()
+        assert np.linalg.norm(xs[-1] - x_ref) < 1e-9*np.linalg.norm(x_ref)
+        assert solver.num_matvecs == 2*(len(xs) - 1) + 1
+        num_matvecs_true = solver.num_matvecs
+        # recurrence with periodic replacement
+        for k in (5, 50):
+            solver = solver_class(A, b, 500, residual_replacement=k)
+            xs, _ = solver.solve()
+            assert np.linalg.norm(xs[-1] - x_ref) < 1e-9*np.linalg.norm(x_ref)
+            num_iterations = len(xs) - 1
+            assert solver.num_matvecs == 1 + num_iterations + num_iterations // k
+        assert solver.num_matvecs < 0.6*num_matvecs_true
+
+def test_history_modes():
+    r"""
+    For CG and SD, the final-only, generator and callback modes
+    agree with the full history (of search directions for CG, of
+    residuals for SD)
+    """
+    rng = np.random.default_rng(1)
+    Q = rng.standard_normal((30, 30))
+    A = Q @ Q.T + 30*np.eye(30)
+    b = rng.standard_normal(30)
+    for solver_class in (CGSolver, SDSolver):
+        solver = solver_class(A, b, 500)
+        xs, vs = solver.solve()
+        # final iterate only
+        x_final = solver.solve(history=False)
+        assert np.array_equal(x_final, xs[-1])
+        # generator
+        for (i, x_i, v_i), x_ref, v_ref in zip(solver.iterate(), xs, vs):
+            assert np.array_equal(x_i, x_ref)
+            assert np.array_equal(v_i, v_ref)
+        assert i == len(xs) - 1
+        # every 4th iterate plus the final one, projected on 2 coordinates
+        recorded = {}
+        solver.solve(history=False, callback=lambda i, x_i, v_i: recorded.update({i: x_i[:2, 0]}),
+                     callback_every=4)
+        expected = sorted(set(range(0, len(xs), 4)) | {len(xs) - 1})
+        assert sorted(recorded) == expected
+        for i in expected:
+            assert np.array_equal(recorded[i], xs[i][:2, 0])
+
 if __name__ == "__main__":
-    test_solve_2d()
\ No newline at end of file
+    test_solve_2d()
+    test_residual_recurrence()
+    test_history_modes()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+import dhutils.dhutils as dhu
+from solvers.api import LinearSystem, solve
+from solvers.direct import CholeskySolver
+from solvers.mpcg import MPCGSolver
+from solvers.test_parallel import build_constrained_chain
+from solvers.test_reordering import spring_system
+
+def grid_system(N):
+    r"""
+    Spring system on the N x N standard_rectangle pinned at its two
+    top corners.
+    """
+    positions, faces = dhu.standard_rectangle(1.0, 1.0, N, N)
+    return spring_system(positions, faces, pinned=(0, N*(N+1)))
+
+def test_matches_mpcg():
+    r"""
+    case: with one, two and three constraints per particle and
+    nonzero z, the direct solve gives the MPCG solution, for dense
+    and sparse A
+    """
+    A, b, S, z = build_constrained_chain(20)
+    S[9] = (np.array([1.0, 0, 0]), np.array([0.0, 0, 1]))
+    z[9] = [0.3, 0.0, -0.1]
+    z[11] = [0.0, 0.6, 0.8]
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3)), sp.csr_matrix(A)):
+        solver = CholeskySolver(A_in, b, S, z)
+        x, stats = solver.solve(return_stats=True)
+        assert stats.converged
+        assert np.linalg.norm(x - x_ref) < 1e-10*np.linalg.norm(x_ref)
+        assert np.linalg.norm(x[0:3, 0] - z[0]) < 1e-15
+
+def test_symbolic_analysis_is_reused():
+    r"""
+    case: time steps with the same mesh only refactor; b and z
+    changes do not even refactor; a new pattern is analysed again
+    """
+    A, b, S, z = grid_system(6)
+    solver = CholeskySolver(A, b, S, z)
+    symbolic = solver.symbolic
+    # RCM keeps the band within about one grid column
+    assert solver.symbolic.bandwidth < 3*2*7
+    for step in range(3):
+        A_step = A.copy()
+        A_step.data *= 1.0 + 0.1*step
+        solver.update(A_in=A_step, b_in=b*step)
+        x = solver.solve()
+        x_ref = MPCGSolver(A_step, b*step, S, z, rtol=1e-14).solve()
+        assert np.linalg.norm(x - x_ref) <= 1e-9*max(np.linalg.norm(x_ref), 1.0)
+    solver.update(z_in=z + 1.0)
+    assert solver.symbolic is symbolic
+    assert solver.num_symbolic_analyses == 1
+    assert solver.num_factorizations == 4
+    # new constraints: refactor only
+    S_new = list(S)
+    S_new[5] = (np.array([0.0, 0, 1]), )
+    solver.update(S_in=S_new)
+    assert solver.num_symbolic_analyses == 1 and solver.num_factorizations == 5
+    # new topology: analyse again
+    A_new, b_new, S_new, z_new = grid_system(7)
+    solver.update(A_new, b_new, S_new, z_new)
+    assert solver.num_symbolic_analyses == 2
+    x_ref = MPCGSolver(A_new, b_new, S_new, z_new, rtol=1e-14).solve()
+    assert np.linalg.norm(solver.solve() - x_ref) < 1e-9*np.linalg.norm(x_ref)
+    # a symbolic analysis can be shared by solvers of the same mesh
+    other_solver = CholeskySolver(A_new, b_new, S_new, z_new, symbolic=solver.symbolic)
+    assert other_solver.num_symbolic_analyses == 0
+
+def test_not_positive_definite():
+    r"""
+    case: an indefinite filtered system is reported
+    """
+    A, b, S, z = build_constrained_chain(5)
+    with pytest.raises(np.linalg.LinAlgError):
+        CholeskySolver(-A, b, S, z)
+    result = solve(LinearSystem(A, b, S, z), method="cholesky")
+    assert result.converged
+
+if __name__ == "__main__":
+    test_matches_mpcg()
+    test_symbolic_analysis_is_reused()
+    test_not_positive_definite()
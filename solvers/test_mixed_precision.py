@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator
+from solvers.mixed_precision import MixedPrecisionMPCGSolver
+from solvers.mpcg import MPCGSolver
+from solvers.stats import CONVERGED
+from solvers.test_mpcg import build_chain_system
+
+def test_matches_float64_solver():
+    r"""
+    case: 20 particles, two constrained; float32 iterations with
+    float64 refinement reach the float64 solution
+    """
+    A, b = build_chain_system(20)
+    S = [()]*20
+    S[0] = (np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))
+    S[7] = (np.array([0, 0, 1]), )
+    z = np.zeros((20, 3))
+    z[7, 2] = 0.5
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3))):
+        mixed_solver = MixedPrecisionMPCGSolver(A_in, b, S, z)
+        assert mixed_solver.inner_solver.dtype == np.float32
+        x, stats = mixed_solver.solve(return_stats=True)
+        assert x.dtype == np.float64
+        assert stats.termination == CONVERGED
+        assert mixed_solver.num_refinements >= 2
+        assert np.linalg.norm(x - x_ref) < 1e-9
+        assert abs(x[23, 0] - 0.5) < 1e-15
+        assert np.linalg.norm(x[0:3, 0]) < 1e-15
+
+def test_matrix_free_needs_diagonal():
+    r"""
+    case: matrix-free A; rejected without diag_in, solved with it
+    """
+    A, b = build_chain_system(10)
+    S = [()]*10
+    S[0] = (np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))
+    z = np.zeros((10, 3))
+    A_op = LinearOperator(A.shape, matvec=lambda v: A @ v)
+    with pytest.raises(ValueError, match="diag_in"):
+        MixedPrecisionMPCGSolver(A_op, b, S, z)
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    x, stats = MixedPrecisionMPCGSolver(A_op, b, S, z, diag_in=np.diag(A)).solve(return_stats=True)
+    assert stats.termination == CONVERGED
+    assert np.linalg.norm(x - x_ref) < 1e-9
+
+if __name__ == "__main__":
+    test_matches_float64_solver()
+    test_matrix_free_needs_diagonal()
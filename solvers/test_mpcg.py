@@ -1,5 +1,30 @@
 import numpy as np
-from solvers.mpcg import MPCGSolver
+import pytest
+import scipy.sparse as sp
+from scipy.sparse.linalg import aslinearoperator
+from solvers.mpcg import MPCGSolver, MPCGStepper
+from solvers.stats import CONVERGED, MAX_ITER
+
+def build_chain_system(num_particles):
+    r"""
+    Build an SPD block-tridiagonal system coupling neighbouring
+    particles of a chain, in the layout used by the cloth
+    simulator.
+
+    Return:
+    - A as a dense array of shape (3n, 3n);
+    - b of shape (3n, )
+    """
+    coupling = np.array([[-1.0, 0.2, 0], [0.2, -1.0, 0.1], [0, 0.1, -0.5]])
+    A = np.zeros((3*num_particles, 3*num_particles))
+    for particle_index in range(num_particles):
+        i = 3*particle_index
+        A[i:i+3, i:i+3] = 5.0*np.eye(3)
+        if particle_index + 1 < num_particles:
+            A[i:i+3, i+3:i+6] = coupling
+            A[i+3:i+6, i:i+3] = np.transpose(coupling)
+    b = np.sin(np.arange(3*num_particles, dtype=float))
+    return A, b
 
 def test_filter_one_particle_unconstrained():
     r"""
@@ -56,6 +81,30 @@ def test_filter_one_particle_three_constraints():
     v_filtered_ref = np.expand_dims(np.array([0.0, 0.0, 0.0]), axis=1)
     assert np.linalg.norm(v_filtered - v_filtered_ref) < 1e-9
 
+def test_filter_many_particles():
+    r"""
+    case: 4 particles with 0 to 3 constraints; compare with
+    filtering particle by particle
+    """
+    A, b = build_chain_system(4)
+    S = [
+        (),
+        (np.array([0, 0, 1]), ),
+        (np.array([1, 0, 0]), np.array([0, 1, 0])),
+        (np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))]
+    z = np.zeros((4, 3))
+    mpcg_solver = MPCGSolver(A, b, S, z)
+    assert mpcg_solver.S.shape == (4, 3, 3)
+    assert np.array_equal(mpcg_solver.constrained_particles, [1, 2, 3])
+    v = np.expand_dims(np.arange(1.0, 13.0), axis=1)
+    v_filtered = mpcg_solver.filter(v)
+    v_filtered_ref = np.concatenate([
+        np.matmul(mpcg_solver.S[particle_index], v[3*particle_index:3*particle_index+3])
+        for particle_index in range(4)])
+    assert np.linalg.norm(v_filtered - v_filtered_ref) < 1e-9
+    # v itself must not be modified
+    assert np.array_equal(v, np.expand_dims(np.arange(1.0, 13.0), axis=1))
+
 def test_solve_one_particle_unconstrained():
     r"""
     case: 1 particle unconstrained
@@ -93,11 +142,189 @@ def test_solve_one_particle_two_constraints():
     x = mpcg_solver.solve()
     assert np.linalg.norm(x[0:2, 0] - np.transpose(z)[0:2, 0]) < 1e-9
 
+def test_solve_sparse_matches_dense():
+    r"""
+    case: 6 particles, two of them constrained; A given as
+    BSR and CSR matrices
+    """
+    A, b = build_chain_system(6)
+    S = [(), (np.array([0, 0, 1]), ), (), (), (np.array([1, 0, 0]), np.array([0, 1, 0])), ()]
+    z = np.zeros((6, 3))
+    z[1, 2] = 0.3
+    z[4, 0:2] = [-0.1, 0.2]
+    x_dense = MPCGSolver(A, b, S, z).solve()
+    for A_sparse in (sp.bsr_matrix(A, blocksize=(3, 3)), sp.csr_matrix(A)):
+        mpcg_solver = MPCGSolver(A_sparse, b, S, z)
+        assert mpcg_solver.is_sparse
+        assert mpcg_solver.A.format == "bsr"
+        assert mpcg_solver.A.blocksize == (3, 3)
+        x_sparse = mpcg_solver.solve()
+        assert np.linalg.norm(x_sparse - x_dense) < 1e-9
+
+def test_solve_matrix_free():
+    r"""
+    case: 6 particles, A only given through products with
+    vectors, with and without an explicit diagonal
+    """
+    A, b = build_chain_system(6)
+    S = [(), (np.array([0, 0, 1]), ), (), (), (), (np.array([1, 0, 0]), )]
+    z = np.zeros((6, 3))
+    z[5, 0] = 0.25
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    mpcg_solver = MPCGSolver(lambda v: np.matmul(A, v), b, S, z, diag_in=np.diag(A))
+    assert mpcg_solver.is_matrix_free
+    assert np.linalg.norm(mpcg_solver.solve() - x_ref) < 1e-9
+    # diagonal estimated by probing
+    mpcg_solver = MPCGSolver(aslinearoperator(A), b, S, z)
+    assert np.linalg.norm(mpcg_solver.solve() - x_ref) < 1e-9
+
+def test_solve_warm_start():
+    r"""
+    case: 6 particles; a guess that violates the constraints
+    still yields the constrained components of z, and the
+    exact solution as guess needs no iterations
+    """
+    A, b = build_chain_system(6)
+    S = [(), (np.array([0, 0, 1]), ), (), (), (np.array([1, 0, 0]), np.array([0, 1, 0])), ()]
+    z = np.zeros((6, 3))
+    z[1, 2] = 0.3
+    z[4, 0:2] = [-0.1, 0.2]
+    mpcg_solver = MPCGSolver(A, b, S, z)
+    x_ref = mpcg_solver.solve()
+    cold_iterations = mpcg_solver.num_iterations
+    x = mpcg_solver.solve(np.full((18, 1), 10.0))
+    assert np.linalg.norm(x - x_ref) < 1e-9
+    assert abs(x[5, 0] - 0.3) < 1e-12
+    assert np.linalg.norm(x[12:14, 0] - [-0.1, 0.2]) < 1e-12
+    x = mpcg_solver.solve(x_ref)
+    assert np.linalg.norm(x - x_ref) < 1e-9
+    assert mpcg_solver.num_iterations < cold_iterations
+
+def test_stepper_warm_starts():
+    r"""
+    case: a sequence of slowly changing systems solved by the
+    stepper; solutions match cold solves
+    """
+    A, b = build_chain_system(6)
+    S = [(np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))] + [()]*5
+    z = np.zeros((6, 3))
+    stepper = MPCGStepper()
+    assert stepper.guess() is None
+    for step in range(4):
+        b_step = b*(1.0 + 0.01*step)
+        x = stepper.solve(A, b_step, S, z)
+        x_ref = MPCGSolver(A, b_step, S, z).solve()
+        assert np.linalg.norm(x - x_ref) < 1e-9
+    assert len(stepper.history) == 2
+    # a linear extrapolation is exact for b varying linearly
+    assert np.linalg.norm(stepper.guess() - MPCGSolver(A, b*1.04, S, z).solve()) < 1e-9
+
+def test_stepper_keeps_solver_options():
+    r"""
+    case: the stepper rebuilds the constraints only for a new
+    constraint list, and rejects solver arguments that differ from
+    the first step's
+    """
+    A, b = build_chain_system(6)
+    S = [(np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))] + [()]*5
+    z = np.zeros((6, 3))
+    stepper = MPCGStepper()
+    stepper.solve(A, b, S, z, rtol=1e-10, max_iter=50)
+    S_matrices = stepper.solver.S
+    stepper.solve(A, b, S, z, rtol=1e-10, max_iter=50)
+    assert stepper.solver.S is S_matrices
+    S_new = [()]*5 + [(np.array([0, 0, 1]), )]
+    x = stepper.solve(A, b, S_new, z, rtol=1e-10, max_iter=50)
+    assert stepper.solver.S is not S_matrices
+    assert np.linalg.norm(x - MPCGSolver(A, b, S_new, z).solve()) < 1e-8
+    for kwargs in ({"rtol": 1e-6, "max_iter": 50}, {"rtol": 1e-10},
+                   {"rtol": 1e-10, "max_iter": 50, "preconditioner": "block_jacobi"}):
+        with pytest.raises(ValueError, match="differ from the first step"):
+            stepper.solve(A, b, S, z, **kwargs)
+
+def test_update_in_place():
+    r"""
+    case: 6 particles; updating A, b, S, z of a long-lived solver
+    gives the same result as building a new solver, and reuses
+    the storage of A when its layout does not change
+    """
+    A, b = build_chain_system(6)
+    S = [()]*6
+    z = np.zeros((6, 3))
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3))):
+        mpcg_solver = MPCGSolver(A_in, b, S, z)
+        mpcg_solver.solve()
+        A_storage = mpcg_solver.A
+        # new values of A and b only
+        A_new = 1.5*A_in
+        b_new = -2.0*b
+        mpcg_solver.update(A_in=A_new, b_in=b_new)
+        assert mpcg_solver.A is A_storage
+        x_ref = MPCGSolver(A_new, b_new, S, z).solve()
+        assert np.linalg.norm(mpcg_solver.solve() - x_ref) < 1e-9
+        # new constraints and constrained velocities only
+        S_new = [(np.array([0, 1, 0]), )] + [()]*5
+        z_new = np.zeros((6, 3))
+        z_new[0, 1] = 0.7
+        mpcg_solver.update(S_in=S_new, z_in=z_new)
+        x_ref = MPCGSolver(A_new, b_new, S_new, z_new).solve()
+        x = mpcg_solver.solve()
+        assert np.linalg.norm(x - x_ref) < 1e-9
+        assert abs(x[1, 0] - 0.7) < 1e-12
+
+def test_update_new_size():
+    r"""
+    case: the number of particles changes between updates
+    """
+    A, b = build_chain_system(3)
+    mpcg_solver = MPCGSolver(A, b, [()]*3, np.zeros((3, 3)))
+    A, b = build_chain_system(5)
+    mpcg_solver.update(A, b, [()]*5, np.zeros((5, 3)))
+    x_ref = np.linalg.solve(A, np.expand_dims(b, axis=1))
+    assert np.linalg.norm(mpcg_solver.solve() - x_ref) < 1e-9
+
+def test_solve_stats_and_max_iter():
+    r"""
+    case: 10 particles; statistics of a converged solve, and a
+    solve cut short by max_iter
+    """
+    A, b = build_chain_system(10)
+    S = [()]*10
+    z = np.zeros((10, 3))
+    x, stats = MPCGSolver(A, b, S, z).solve(return_stats=True)
+    assert stats.termination == CONVERGED
+    assert stats.converged
+    assert stats.num_iterations > 2
+    assert len(stats.residual_history) == stats.num_iterations + 1
+    # one product for the initial residual, one per iteration
+    assert stats.num_matvecs == stats.num_iterations + 1
+    assert stats.setup_time >= 0 and stats.solve_time > 0
+    mpcg_solver = MPCGSolver(A, b, S, z, max_iter=2)
+    mpcg_solver.solve()
+    assert mpcg_solver.stats.termination == MAX_ITER
+    assert mpcg_solver.num_iterations == 2
+    # a loose absolute tolerance stops earlier
+    mpcg_solver = MPCGSolver(A, b, S, z, atol=1e-2)
+    x_loose = mpcg_solver.solve()
+    assert mpcg_solver.stats.converged
+    assert mpcg_solver.num_iterations < stats.num_iterations
+    assert mpcg_solver.stats.final_residual <= 1e-2
+    assert np.linalg.norm(x_loose - x) < 1e-1
+
 if __name__ == "__main__":
     test_filter_one_particle_unconstrained()
     test_filter_one_particle_one_constraint()
     test_filter_one_particle_two_constraints()
     test_filter_one_particle_three_constraints()
+    test_filter_many_particles()
     test_solve_one_particle_unconstrained()
     test_solve_one_particle_one_constraint()
     test_solve_one_particle_two_constraints()
+    test_solve_sparse_matches_dense()
+    test_solve_matrix_free()
+    test_solve_warm_start()
+    test_stepper_warm_starts()
+    test_stepper_keeps_solver_options()
+    test_update_in_place()
+    test_update_new_size()
+    test_solve_stats_and_max_iter()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.test_mpcg import build_chain_system
+
+jax = pytest.importorskip("jax")
+import jax.numpy as jnp
+from solvers.mpcg_jax import mpcg_solve, mpcg_solve_jit
+
+@pytest.fixture
+def enable_x64():
+    r"""
+    Run a test with 64-bit JAX types.
+    """
+    jax.config.update("jax_enable_x64", True)
+    yield
+    jax.config.update("jax_enable_x64", False)
+
+def build_constrained_system():
+    r"""
+    Build a 6-particle chain system with two constrained particles.
+    """
+    A, b = build_chain_system(6)
+    S = [(), (np.array([0, 0, 1]), ), (), (), (np.array([1, 0, 0]), np.array([0, 1, 0])), ()]
+    z = np.zeros((6, 3))
+    z[1, 2] = 0.3
+    z[4, 0:2] = [-0.1, 0.2]
+    return A, b, S, z
+
+def test_matches_numpy_solver(enable_x64):
+    r"""
+    case: same solution and iteration count as MPCGSolver
+    """
+    A, b, S, z = build_constrained_system()
+    mpcg_solver = MPCGSolver(A, b, S, z)
+    x_ref = mpcg_solver.solve()
+    S_matrices, _ = constraint_matrices(S, 6)
+    x, num_iterations, converged = mpcg_solve_jit(
+        jnp.asarray(A), jnp.asarray(b), jnp.asarray(S_matrices), jnp.asarray(z))
+    assert x.dtype == jnp.float64
+    assert bool(converged)
+    assert int(num_iterations) == mpcg_solver.num_iterations
+    assert np.linalg.norm(np.asarray(x) - x_ref[:, 0]) < 1e-12
+
+def test_matrix_free_inside_jit(enable_x64):
+    r"""
+    case: A given as a callable closed over by a jitted step,
+    with a warm start and an iteration budget
+    """
+    A, b, S, z = build_constrained_system()
+    x_ref = MPCGSolver(A, b, S, z).solve()[:, 0]
+    S_matrices, _ = constraint_matrices(S, 6)
+    A_jnp = jnp.asarray(A)
+
+    @jax.jit
+    def step(b, del_v_0):
+        return mpcg_solve(
+            lambda v: A_jnp @ v, b, jnp.asarray(S_matrices), jnp.asarray(z),
+            del_v_0=del_v_0, inv_diag=1.0 / jnp.diagonal(A_jnp), max_iter=100)
+
+    x, _, converged = step(jnp.asarray(b), jnp.zeros(18))
+    assert bool(converged)
+    assert np.linalg.norm(np.asarray(x) - x_ref) < 1e-12
+    _, num_iterations, _ = step(jnp.asarray(b), jnp.asarray(x_ref))
+    assert int(num_iterations) <= 1
+
+def test_max_iter():
+    r"""
+    case: float32, stopped by the iteration budget
+    """
+    A, b, S, z = build_constrained_system()
+    S_matrices, _ = constraint_matrices(S, 6)
+    _, num_iterations, converged = mpcg_solve_jit(
+        jnp.asarray(A), jnp.asarray(b), jnp.asarray(S_matrices), jnp.asarray(z), max_iter=2)
+    assert int(num_iterations) == 2
+    assert not bool(converged)
@@ -0,0 +1,105 @@
+import threading
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator
+from solvers.api import LinearSystem, solve
+from solvers.mpcg import MPCGSolver
+from solvers.test_mpcg import build_chain_system
+
+def build_constrained_chain(num_particles):
+    r"""
+    Chain system with a pinned particle and a particle constrained
+    along one direction.
+    """
+    A, b = build_chain_system(num_particles)
+    S = [()]*num_particles
+    S[0] = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+    S[num_particles // 2 + 1] = (np.array([0.0, 0.6, 0.8]), )
+    z = np.zeros((num_particles, 3))
+    z[0] = [0.1, 0.0, -0.2]
+    return A, b, S, z
+
+def test_threaded_matches_serial():
+    r"""
+    case: the threaded iteration gives the serial result for dense
+    and sparse A, with local and non-local preconditioners
+    """
+    A, b, S, z = build_constrained_chain(25)
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3))):
+        for name in ("jacobi", "block_jacobi", "ic0"):
+            serial_solver = MPCGSolver(A_in, b, S, z, preconditioner=name)
+            x_ref = serial_solver.solve()
+            for num_threads in (2, 3, 7):
+                threaded_solver = MPCGSolver(A_in, b, S, z, preconditioner=name,
+                                             num_threads=num_threads)
+                x = threaded_solver.solve()
+                assert threaded_solver.num_threads == num_threads
+                assert np.linalg.norm(x - x_ref) < 1e-12
+                assert threaded_solver.num_iterations == serial_solver.num_iterations
+                assert threaded_solver.stats.num_matvecs == serial_solver.stats.num_matvecs
+
+def test_threaded_is_deterministic_and_follows_updates():
+    r"""
+    case: repeated threaded solves are bitwise identical, and an
+    in-place update of A is seen by the row blocks
+    """
+    A, b, S, z = build_constrained_chain(30)
+    A_bsr = sp.bsr_matrix(A, blocksize=(3, 3))
+    solver = MPCGSolver(A_bsr, b, S, z, num_threads=4)
+    bounds = solver._kernels.particle_bounds
+    assert bounds[0] == 0 and bounds[-1] == 30 and len(bounds) == 5
+    x_1 = solver.solve()
+    x_2 = solver.solve()
+    assert np.array_equal(x_1, x_2)
+    A_new = A_bsr.copy()
+    A_new.data *= 2.0
+    solver.update(A_in=A_new)
+    x_new = solver.solve()
+    x_ref = MPCGSolver(2.0*A, b, S, z).solve()
+    assert np.linalg.norm(x_new - x_ref) < 1e-9
+
+def test_threaded_matrix_free_falls_back_to_serial():
+    r"""
+    case: matrix-free A is iterated serially
+    """
+    A, b, S, z = build_constrained_chain(10)
+    A_op = LinearOperator(A.shape, matvec=lambda v: A @ v)
+    x_ref = MPCGSolver(A, b, S, z, diag_in=np.diag(A)).solve()
+    x = MPCGSolver(A_op, b, S, z, diag_in=np.diag(A), num_threads=4).solve()
+    assert np.linalg.norm(x - x_ref) < 1e-9
+
+def worker_threads():
+    r"""
+    Number of live worker threads of ParticleBlockKernels.
+    """
+    return sum(thread.name.startswith("ParticleBlockKernels") for thread in threading.enumerate())
+
+def test_threads_are_released():
+    r"""
+    case: the worker threads exit when the solver is closed, at the
+    end of a with block, and after api.solve(); a closed solver can
+    solve again
+    """
+    A, b, S, z = build_constrained_chain(20)
+    A_bsr = sp.bsr_matrix(A, blocksize=(3, 3))
+    num_threads = worker_threads()
+    solver = MPCGSolver(A_bsr, b, S, z, num_threads=4)
+    x_ref = solver.solve()
+    assert worker_threads() > num_threads
+    solver.close()
+    assert worker_threads() == num_threads
+    assert np.array_equal(solver.solve(), x_ref)
+    solver.close()
+    with MPCGSolver(A_bsr, b, S, z, num_threads=3) as solver:
+        solver.solve()
+        assert worker_threads() > num_threads
+    assert worker_threads() == num_threads
+    for method in ("mpcg", "mpcg_pipelined"):
+        solve(LinearSystem(A_bsr, b, S, z), method=method, num_threads=2)
+        assert worker_threads() == num_threads
+
+if __name__ == "__main__":
+    test_threaded_matches_serial()
+    test_threaded_is_deterministic_and_follows_updates()
+    test_threaded_matrix_free_falls_back_to_serial()
+    test_threads_are_released()
@@ -0,0 +1,64 @@
+import numpy as np
+import scipy.sparse as sp
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.pipelined import PipelinedMPCGSolver
+from solvers.stats import BREAKDOWN, CONVERGED
+from solvers.test_parallel import build_constrained_chain
+from solvers.test_recycling import build_stiff_chain
+
+def filtered_relative_residual(A, b, S, x):
+    r"""
+    Compute ||S (b - A x)|| / ||S b||.
+    """
+    S_blocks, _ = constraint_matrices(S, len(S))
+    r = np.einsum("kij,kj->ki", S_blocks, np.reshape(b - A @ x[:, 0], (-1, 3)))
+    b_filtered = np.einsum("kij,kj->ki", S_blocks, np.reshape(b, (-1, 3)))
+    return np.linalg.norm(r) / np.linalg.norm(b_filtered)
+
+def test_matches_classic_mpcg():
+    r"""
+    case: the pipelined iteration takes the steps of classic MPCG,
+    for dense and sparse A, serial and threaded, with constraints
+    """
+    A, b, S, z = build_constrained_chain(30)
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3))):
+        for options in ({}, {"preconditioner": "block_jacobi", "num_threads": 3},
+                        {"preconditioner": "ic0", "num_threads": 2}):
+            classic_solver = MPCGSolver(A_in, b, S, z, **options)
+            x_ref = classic_solver.solve()
+            pipelined_solver = PipelinedMPCGSolver(A_in, b, S, z, **options)
+            x, stats = pipelined_solver.solve(return_stats=True)
+            assert stats.termination == CONVERGED
+            assert stats.num_iterations == classic_solver.num_iterations
+            assert np.allclose(stats.residual_history, classic_solver.stats.residual_history,
+                               rtol=1e-6, atol=1e-12*stats.residual_history[0])
+            assert np.linalg.norm(x - x_ref) < 1e-12*np.linalg.norm(x_ref)
+            # constrained components still come from z
+            assert np.linalg.norm(x[0:3, 0] - z[0]) < 1e-15
+
+def test_true_residual_check():
+    r"""
+    case: on a stiff system, convergence is only reported when the
+    true residual passes the test; below the attainable accuracy
+    the solve stops with a breakdown instead of looping
+    """
+    _, _, S, z = build_constrained_chain(60)
+    A, b = build_stiff_chain(60, 1e5)
+    for residual_replacement in (1, 10, None):
+        solver = PipelinedMPCGSolver(A, b, S, z, rtol=1e-10,
+                                     residual_replacement=residual_replacement)
+        x, stats = solver.solve(return_stats=True)
+        assert stats.termination == CONVERGED
+        # residual_history is measured in the P^{-1} norm
+        assert filtered_relative_residual(A, b, S, x) < 1e-8
+        assert np.linalg.norm(x - MPCGSolver(A, b, S, z, rtol=1e-10).solve()) < \
+            1e-8*np.linalg.norm(x)
+    solver = PipelinedMPCGSolver(A, b, S, z, rtol=1e-18, max_iter=1000)
+    x, stats = solver.solve(return_stats=True)
+    assert stats.termination == BREAKDOWN
+    assert stats.num_iterations < 1000
+    assert filtered_relative_residual(A, b, S, x) < 1e-11
+
+if __name__ == "__main__":
+    test_matches_classic_mpcg()
+    test_true_residual_check()
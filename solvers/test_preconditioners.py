@@ -0,0 +1,206 @@
+import numpy as np
+import scipy.sparse as sp
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.preconditioners import BlockJacobiPreconditioner, IncompleteCholeskyPreconditioner, JacobiPreconditioner, MultigridPreconditioner, diagonal_blocks, filtered_matrix, grid_prolongation_1d
+from solvers.test_mpcg import build_chain_system
+from solvers.test_parallel import build_constrained_chain
+
+def test_diagonal_blocks_dense_and_sparse():
+    r"""
+    case: 3x3 diagonal blocks of a chain system
+    """
+    A, _ = build_chain_system(4)
+    blocks_dense = diagonal_blocks(A)
+    blocks_sparse = diagonal_blocks(sp.bsr_matrix(A, blocksize=(3, 3)))
+    for particle_index in range(4):
+        i = 3*particle_index
+        assert np.linalg.norm(blocks_dense[particle_index] - A[i:i+3, i:i+3]) < 1e-12
+        assert np.linalg.norm(blocks_sparse[particle_index] - A[i:i+3, i:i+3]) < 1e-12
+
+def test_jacobi_apply():
+    r"""
+    case: P^{-1} r is r divided by the diagonal of A
+    """
+    A, _ = build_chain_system(3)
+    S = np.tile(np.eye(3), (3, 1, 1))
+    preconditioner = JacobiPreconditioner()
+    preconditioner.setup(A, S)
+    r = np.expand_dims(np.arange(1.0, 10.0), axis=1)
+    assert np.linalg.norm(preconditioner.apply(r) - r / np.expand_dims(np.diag(A), axis=1)) < 1e-12
+    assert preconditioner.apply_flops == 9
+
+def test_block_jacobi_respects_constraints():
+    r"""
+    case: constrained directions are zero after applying the
+    block-Jacobi preconditioner
+    """
+    A, _ = build_chain_system(2)
+    S = np.tile(np.eye(3), (2, 1, 1))
+    S[1] = np.diag([1.0, 1.0, 0.0]) # particle 1 constrained along z
+    preconditioner = BlockJacobiPreconditioner()
+    preconditioner.setup(A, S)
+    r = np.ones((6, 1))
+    out = preconditioner.apply(r)
+    assert abs(out[5, 0]) < 1e-12
+    # particle 0 is unconstrained: plain inverse of its diagonal block
+    assert np.linalg.norm(out[0:3] - np.linalg.solve(A[0:3, 0:3], r[0:3])) < 1e-12
+
+def test_ic0_is_exact_without_fill():
+    r"""
+    case: IC(0) of a tridiagonal matrix is its exact Cholesky factor
+    """
+    A = sp.diags([4.0*np.ones(6), -np.ones(5), -np.ones(5)], [0, -1, 1], format="csr")
+    preconditioner = IncompleteCholeskyPreconditioner()
+    preconditioner.setup(A, np.tile(np.eye(3), (2, 1, 1)))
+    L_ref = np.linalg.cholesky(A.toarray())
+    assert np.linalg.norm(preconditioner.L.toarray() - L_ref) < 1e-12
+    r = np.expand_dims(np.arange(6.0), axis=1)
+    assert np.linalg.norm(preconditioner.apply(r) - np.linalg.solve(A.toarray(), r)) < 1e-9
+
+def test_ic0_factors_the_filtered_matrix():
+    r"""
+    case: on a constrained block-tridiagonal system IC(0) has no
+    dropped fill, so L L^T is S A S + (I - S); the symbolic analysis
+    is kept across setups with the same pattern, and the result
+    matches the entry-by-entry factorization
+    """
+    A, b, S_list, z = build_constrained_chain(12)
+    S, _ = constraint_matrices(S_list, 12)
+    preconditioner = IncompleteCholeskyPreconditioner()
+    preconditioner.setup(sp.bsr_matrix(A, blocksize=(3, 3)), S)
+    L = preconditioner.L.toarray()
+    A_hat = filtered_matrix(A, S).toarray()
+    assert np.linalg.norm(L @ L.T - A_hat) < 1e-10*np.linalg.norm(A_hat)
+    symbolic = preconditioner.symbolic
+    preconditioner.setup(2.0*A, S)
+    assert preconditioner.symbolic is symbolic
+    L_2 = preconditioner.L.toarray()
+    A_hat_2 = filtered_matrix(2.0*A, S).toarray()
+    assert np.linalg.norm(L_2 @ L_2.T - A_hat_2) < 1e-10*np.linalg.norm(A_hat_2)
+    # constrained directions are neither read nor produced
+    r = np.ones((36, 1))
+    out = preconditioner.apply(r)
+    assert abs(out[0, 0]) < 1e-12 and abs(out[2, 0]) < 1e-12
+
+    A_lower = sp.tril(sp.csr_matrix(A_hat), format="csr")
+    A_lower.sort_indices()
+    L_ref = np.zeros_like(A_hat)
+    for i in range(36):
+        for k in range(i + 1):
+            if A_lower[i, k] == 0:
+                continue
+            value = A_hat[i, k] - L_ref[i, :k] @ L_ref[k, :k]
+            L_ref[i, k] = np.sqrt(value) if i == k else value / L_ref[k, k]
+    L_data = IncompleteCholeskyPreconditioner.factorize(A_lower, 0.0)
+    assert np.allclose(sp.csr_matrix((L_data, A_lower.indices, A_lower.indptr)).toarray(), L_ref)
+
+def test_mpcg_with_each_preconditioner():
+    r"""
+    case: MPCG gives the same solution with all preconditioners,
+    for dense and sparse A
+    """
+    A, b = build_chain_system(8)
+    S = [()]*8
+    S[2] = (np.array([0, 1, 0]), )
+    S[5] = (np.array([1, 0, 0]), np.array([0, 0, 1]))
+    z = np.zeros((8, 3))
+    z[2, 1] = 0.4
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    for A_in in (A, sp.bsr_matrix(A, blocksize=(3, 3))):
+        for name in ("jacobi", "block_jacobi", "ic0"):
+            mpcg_solver = MPCGSolver(A_in, b, S, z, preconditioner=name)
+            x = mpcg_solver.solve()
+            assert np.linalg.norm(x - x_ref) < 1e-9
+            cost = mpcg_solver.M.cost()
+            assert cost["name"] == name
+            assert cost["apply_flops"] > 0
+
+def build_grid_system(Nx, Ny):
+    r"""
+    Build an SPD system on an (Nx+1) x (Ny+1) particle grid numbered
+    as dhutils.standard_rectangle, coupling grid neighbours through
+    a 3x3 stiffness block.
+
+    Return:
+    - A as a BSR matrix of shape (3n, 3n);
+    - b of shape (3n, )
+    """
+    def laplacian_1d(num_points):
+        L = sp.diags([2.0*np.ones(num_points), -np.ones(num_points - 1), -np.ones(num_points - 1)],
+                     [0, -1, 1], format="lil")
+        L[0, 0] = L[num_points - 1, num_points - 1] = 1.0
+        return sp.csr_matrix(L)
+    laplacian = sp.kron(laplacian_1d(Nx + 1), sp.eye(Ny + 1)) + \
+        sp.kron(sp.eye(Nx + 1), laplacian_1d(Ny + 1))
+    stiffness = 100.0*np.array([[10.0, 1, 0], [1, 5, 1], [0, 1, 2]])
+    num_dofs = 3*(Nx + 1)*(Ny + 1)
+    A = sp.bsr_matrix(sp.eye(num_dofs) + sp.kron(laplacian, stiffness), blocksize=(3, 3))
+    b = np.sin(np.arange(num_dofs, dtype=float))
+    return A, b
+
+def test_grid_prolongation_1d():
+    r"""
+    case: interpolation keeps every other point and the last one,
+    and reproduces linear functions
+    """
+    for num_points in (2, 5, 8):
+        P = grid_prolongation_1d(num_points)
+        assert P.shape == (num_points, (num_points + 1) // 2 + (num_points % 2 == 0))
+        assert np.allclose(P.sum(axis=1), 1.0)
+        coarse = np.flatnonzero(np.isclose(P.toarray(), 1.0).any(axis=1))
+        assert coarse[0] == 0 and coarse[-1] == num_points - 1
+        x_fine = P @ coarse.astype(float)
+        assert np.allclose(x_fine, np.arange(num_points))
+
+def test_multigrid_respects_constraints():
+    r"""
+    case: MPCG with multigrid matches Jacobi on a constrained chain
+    (a 1D grid), and the preconditioner output is filtered
+    """
+    A, b = build_chain_system(20)
+    S = [()]*20
+    S[0] = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+    S[11] = (np.array([0.0, 1, 0]), )
+    z = np.zeros((20, 3))
+    z[11, 1] = 0.3
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    preconditioner = MultigridPreconditioner(grid_shape=(19, 0), coarse_max_particles=4)
+    mpcg_solver = MPCGSolver(sp.bsr_matrix(A, blocksize=(3, 3)), b, S, z, preconditioner=preconditioner)
+    x = mpcg_solver.solve()
+    assert np.linalg.norm(x - x_ref) < 1e-9
+    assert preconditioner.num_levels > 2
+    out = preconditioner.apply(np.ones((60, 1)))
+    assert np.linalg.norm(out[0:3]) < 1e-12
+    assert abs(out[34, 0]) < 1e-12
+
+def test_multigrid_iterations_independent_of_resolution():
+    r"""
+    case: MPCG iteration counts with multigrid stay flat as the
+    grid is refined, unlike with Jacobi
+    """
+    iterations = {}
+    for N in (8, 32):
+        A, b = build_grid_system(N, N)
+        num_particles = (N + 1)**2
+        S = [()]*num_particles
+        S[0] = S[N*(N + 1)] = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+        z = np.zeros((num_particles, 3))
+        for name in ("jacobi", "multigrid"):
+            mpcg_solver = MPCGSolver(A, b, S, z, preconditioner=name, rtol=1e-8)
+            mpcg_solver.solve()
+            assert mpcg_solver.stats.converged
+            iterations[name, N] = mpcg_solver.num_iterations
+    assert iterations["multigrid", 32] <= iterations["multigrid", 8] + 3
+    assert iterations["multigrid", 32] < iterations["jacobi", 32] / 4
+    assert iterations["jacobi", 32] > 2*iterations["jacobi", 8]
+
+if __name__ == "__main__":
+    test_diagonal_blocks_dense_and_sparse()
+    test_jacobi_apply()
+    test_block_jacobi_respects_constraints()
+    test_ic0_is_exact_without_fill()
+    test_ic0_factors_the_filtered_matrix()
+    test_mpcg_with_each_preconditioner()
+    test_grid_prolongation_1d()
+    test_multigrid_respects_constraints()
+    test_multigrid_iterations_independent_of_resolution()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import numpy as np
+from solvers.mpcg import MPCGSolver, constraint_matrices
+from solvers.recycling import KrylovRecycler
+from solvers.test_mpcg import build_chain_system
+
+def build_stiff_chain(num_particles, stiffness):
+    r"""
+    Chain system with a wide spectrum: identity plus a stiff
+    coupling, as in implicit cloth steps.
+    """
+    A, b = build_chain_system(num_particles)
+    return np.eye(3*num_particles) + stiffness*A, b
+
+def test_recycled_solves_match_plain_solves():
+    r"""
+    case: a sequence of slowly changing systems solved with and
+    without recycling gives the same solutions, with fewer
+    iterations once the deflation space is built
+    """
+    S = [()]*30
+    S[0] = (np.array([1.0, 0, 0]), np.array([0.0, 1, 0]), np.array([0.0, 0, 1]))
+    S[17] = (np.array([0.0, 0, 1]), )
+    z = np.zeros((30, 3))
+    z[17, 2] = -0.2
+    A_0, b_0 = build_stiff_chain(30, 50.0)
+    recycler = KrylovRecycler(num_vectors=6, num_stored=20)
+    recycled_solver = None
+    iterations_plain, iterations_recycled = [], []
+    for step in range(4):
+        A = A_0 * (1.0 + 0.02*step)
+        b = b_0 + 0.1*step
+        plain_solver = MPCGSolver(A, b, S, z, rtol=1e-10)
+        x_ref = plain_solver.solve()
+        iterations_plain.append(plain_solver.num_iterations)
+        if recycled_solver is None:
+            recycled_solver = MPCGSolver(A, b, S, z, rtol=1e-10, recycler=recycler)
+        else:
+            recycled_solver.update(A_in=A, b_in=b)
+        x = recycled_solver.solve()
+        iterations_recycled.append(recycled_solver.num_iterations)
+        assert recycled_solver.stats.converged
+        assert np.linalg.norm(x - x_ref) < 1e-7*np.linalg.norm(x_ref)
+        # constrained components still come from z
+        assert np.linalg.norm(np.reshape(x, (30, 3))[0]) < 1e-12
+        assert abs(np.reshape(x, (30, 3))[17, 2] + 0.2) < 1e-12
+    assert recycler.num_vectors == 6
+    assert iterations_recycled[0] == iterations_plain[0]
+    assert sum(iterations_recycled[1:]) < sum(iterations_plain[1:])
+    # A W is recomputed once per solve
+    assert recycled_solver.stats.num_matvecs == recycled_solver.num_iterations + 1 + 6
+
+def test_ritz_values_approximate_smallest_eigenvalues():
+    r"""
+    case: after a few solves with the same matrix, the recycled
+    vectors approximate the bottom of the spectrum of the filtered A
+    """
+    A, b = build_stiff_chain(20, 20.0)
+    S = [()]*20
+    S[5] = (np.array([0.0, 1, 0]), )
+    z = np.zeros((20, 3))
+    recycler = KrylovRecycler(num_vectors=3, num_stored=60)
+    solver = MPCGSolver(A, b, S, z, rtol=1e-12, recycler=recycler)
+    for _ in range(3):
+        solver.solve()
+    # eigenvalues of S A S + (I - S) on the free directions
+    S_blocks, _ = constraint_matrices(S, 20)
+    free = np.reshape(np.einsum("kii->ki", S_blocks), -1) > 0.5
+    eigenvalues = np.linalg.eigvalsh(A[np.ix_(free, free)])
+    # Ritz values are upper bounds of the eigenvalues
+    assert np.all(recycler.ritz_values >= eigenvalues[:3] - 1e-9)
+    assert np.allclose(recycler.ritz_values, eigenvalues[:3], rtol=1e-2)
+    # W lies in the filtered space
+    assert np.linalg.norm(recycler.W[16]) < 1e-12
+
+def test_reset_on_constraint_change():
+    r"""
+    case: changing the constraint set discards the deflation space
+    """
+    A, b = build_stiff_chain(10, 10.0)
+    z = np.zeros((10, 3))
+    recycler = KrylovRecycler(num_vectors=4)
+    solver = MPCGSolver(A, b, [()]*10, z, recycler=recycler)
+    solver.solve()
+    assert recycler.num_vectors == 4
+    S = [()]*10
+    S[3] = (np.array([1.0, 0, 0]), )
+    solver.update(S_in=S)
+    x = solver.solve()
+    # the first solve with the new constraints runs undeflated
+    assert solver.stats.num_matvecs == solver.num_iterations + 1
+    assert abs(x[9, 0]) < 1e-12
+    x_ref = MPCGSolver(A, b, S, z).solve()
+    assert np.linalg.norm(x - x_ref) < 1e-9
+
+if __name__ == "__main__":
+    test_recycled_solves_match_plain_solves()
+    test_ritz_values_approximate_smallest_eigenvalues()
+    test_reset_on_constraint_change()
@@ -0,0 +1,136 @@
+import numpy as np
+import scipy.sparse as sp
+import dhutils.dhutils as dhu
+from solvers.api import LinearSystem, rcm_ordering, solve
+from solvers.reordering import ParticleOrdering, block_bandwidth, particle_graph
+
+def shuffled_rectangle(N, seed=0):
+    r"""
+    N x N standard_rectangle with randomly numbered vertices, as
+    from an arbitrary mesh file.
+
+    Return:
+    positions, faces
+    """
+    positions, faces = dhu.standard_rectangle(1.0, 1.0, N, N)
+    shuffle = ParticleOrdering(np.random.default_rng(seed).permutation(positions.shape[0]))
+    return shuffle.permute_particles(positions), shuffle.permute_faces(faces)
+
+def spring_system(positions, faces, pinned=()):
+    r"""
+    System A dv = b of a mass-spring network on the mesh edges,
+    A = I + sum over edges (i, j) of the stiffness K_e in blocks
+    (i, i), (j, j) and -K_e in blocks (i, j), (j, i).
+
+    Return:
+    A as a BSR matrix with 3x3 blocks, b, S and z
+    """
+    num_particles = positions.shape[0]
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    d = positions[edges[:, 1]] - positions[edges[:, 0]]
+    d /= np.linalg.norm(d, axis=1, keepdims=True)
+    K_e = 10.0*np.einsum("ei,ej->eij", d, d) + np.eye(3)
+    block_rows = np.concatenate([edges[:, 0], edges[:, 1], edges[:, 0], edges[:, 1],
+                                 np.arange(num_particles)])
+    block_cols = np.concatenate([edges[:, 0], edges[:, 1], edges[:, 1], edges[:, 0],
+                                 np.arange(num_particles)])
+    blocks = np.concatenate([K_e, K_e, -K_e, -K_e, np.tile(np.eye(3), (num_particles, 1, 1))])
+    offsets = np.arange(3)
+    rows = np.broadcast_to(3*block_rows[:, None, None] + offsets[None, :, None], blocks.shape)
+    cols = np.broadcast_to(3*block_cols[:, None, None] + offsets[None, None, :], blocks.shape)
+    A = sp.coo_matrix((blocks.ravel(), (rows.ravel(), cols.ravel())),
+                      shape=(3*num_particles, 3*num_particles)).tobsr(blocksize=(3, 3))
+    A.sum_duplicates()
+    A.sort_indices()
+    b = np.sin(3.0*positions[:, [1, 0, 0]]).ravel() - 0.1
+    S = [()]*num_particles
+    for index in pinned:
+        S[index] = (np.array([1, 0, 0]), np.array([0, 1, 0]), np.array([0, 0, 1]))
+    z = np.zeros((num_particles, 3))
+    return A, b, S, z
+
+def test_rcm_restores_bandwidth():
+    r"""
+    case: on a shuffled grid, the RCM ordering from the faces or from
+    A brings the bandwidth back to about one grid column, and
+    assembling on reordered particles gives P A P^T
+    """
+    N = 12
+    positions, faces = shuffled_rectangle(N)
+    num_particles = positions.shape[0]
+    A, _, _, _ = spring_system(positions, faces)
+    assert block_bandwidth(A) > 4*(N + 1)
+    ordering = ParticleOrdering.from_faces(faces, num_particles)
+    assert block_bandwidth(ordering.permute_matrix(A)) <= 2*(N + 1)
+    assert block_bandwidth(ParticleOrdering.from_matrix(A).permute_matrix(A)) <= 2*(N + 1)
+    # reorder before assembly
+    A_reordered, _, _, _ = spring_system(
+        ordering.permute_particles(positions), ordering.permute_faces(faces))
+    A_permuted = ordering.permute_matrix(A)
+    assert A_permuted.format == "bsr" and A_permuted.has_sorted_indices
+    assert abs(A_reordered - A_permuted).max() < 1e-12
+    # dense and CSR A give the same P A P^T
+    assert np.allclose(ordering.permute_matrix(A.toarray()), A_permuted.toarray())
+    assert np.allclose(ordering.permute_matrix(A.tocsr()).toarray(), A_permuted.toarray())
+    assert (particle_graph(A.toarray()) != particle_graph(A)).nnz == 0
+
+def test_permutation_round_trips():
+    r"""
+    case: permute and unpermute are inverse of each other for every
+    per-particle quantity
+    """
+    ordering = ParticleOrdering(np.array([2, 0, 3, 1]))
+    assert np.array_equal(ordering.inverse, [1, 3, 0, 2])
+    x = np.arange(12.0)
+    assert np.array_equal(ordering.permute_vector(x)[0:3], [6.0, 7.0, 8.0])
+    assert np.array_equal(ordering.unpermute_vector(ordering.permute_vector(x)), x)
+    x_column = np.expand_dims(x, axis=1)
+    assert np.array_equal(ordering.unpermute_vector(ordering.permute_vector(x_column)), x_column)
+    z = np.reshape(x, (4, 3))
+    assert np.array_equal(ordering.unpermute_particles(ordering.permute_particles(z)), z)
+    assert ordering.permute_constraints(["a", "b", "c", "d"]) == ["c", "a", "d", "b"]
+    # a face keeps the same vertices under the new numbering
+    faces = np.array([[0, 1, 2]])
+    assert np.array_equal(ordering.permutation[ordering.permute_faces(faces)], faces)
+
+def test_solve_with_reordering():
+    r"""
+    case: solving with reorder="rcm" returns the solution of the
+    original system, in the original order, with constraints and an
+    initial guess
+    """
+    positions, faces = shuffled_rectangle(8, seed=1)
+    A, b, S, z = spring_system(positions, faces, pinned=(3, 17))
+    z[17] = [0.1, -0.2, 0.3]
+    system = LinearSystem(A, b, S, z)
+    x_0 = np.random.default_rng(2).standard_normal(b.shape[0])
+    for method in ("mpcg", "mpcg_pipelined"):
+        x_ref = solve(system, method=method, x_0=x_0).x
+        result = solve(system, method=method, x_0=x_0, reorder="rcm")
+        assert result.converged
+        assert np.linalg.norm(result.x - x_ref) < 1e-9*np.linalg.norm(x_ref)
+        assert np.allclose(result.x[51:54, 0], z[17], rtol=0.0, atol=1e-15)
+    result = solve(system.with_matrix(A.toarray()), method="mpcg", reorder="rcm")
+    assert np.linalg.norm(result.x - x_ref) < 1e-9*np.linalg.norm(x_ref)
+
+def test_rcm_ordering_is_cached():
+    r"""
+    case: the RCM ordering of a BSR matrix is computed once per
+    sparsity pattern and reused for new values
+    """
+    positions, faces = shuffled_rectangle(6, seed=3)
+    A, _, _, _ = spring_system(positions, faces)
+    ordering = rcm_ordering(A)
+    assert rcm_ordering(2.0*A) is ordering
+    positions, faces = shuffled_rectangle(6, seed=4)
+    A_other, _, _, _ = spring_system(positions, faces)
+    assert rcm_ordering(A_other) is not ordering
+    assert np.array_equal(rcm_ordering(A_other).permutation,
+                          ParticleOrdering.from_matrix(A_other).permutation)
+
+if __name__ == "__main__":
+    test_rcm_restores_bandwidth()
+    test_permutation_round_trips()
+    test_solve_with_reordering()
+    test_rcm_ordering_is_cached()
@@ -25,10 +25,14 @@ for col_index in range(xx.shape[0]):
 plt.contour(X,Y,Z)
 
 # plot x's and r's
+x_coords = []
+y_coords = []
+def record(i, x_i, r_i):
+    # keep the coordinates of x_i only
+    x_coords.append(x_i[0])
+    y_coords.append(x_i[1])
 sd_solver = SDSolver(A, b, 50)
-x_is, r_is = sd_solver.solve()
-x_coords = [x_i[0] for x_i in x_is]
-y_coords = [x_i[1] for x_i in x_is]
+sd_solver.solve(history=False, callback=record)
 dxs = []
 dys = []
 for i in range(len(x_coords)-1):